@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark suite for mochiview2gff
+Copyright 2018 Thaddeus D. Seher.
+
+Generates a synthetic, genome-scale MochiView gene table from a seed, then
+times and memory-profiles each stage of the conversion:
+
+ read       reading the table's lines from disk
+ parse      splitting rows and converting coordinates (_parse_row)
+ build      building gff_feature records from parsed rows (includes escape
+            and validate)
+ validate   checking parsed rows on their own (_row_problems)
+ escape     percent-encoding the DESCRIPTION column on its own
+ serialize  turning records into GFF lines
+ write      writing records to a file with write_features()
+ convert    end-to-end convert(), once per available engine
+ convert_skip  end-to-end convert() with --validate skip
+ fanout     end-to-end convert_formats() to GFF3, GTF and BED12 at once
+ shard      end-to-end convert() into a shard_writer, one file per seqid
+ convert_bytes  end-to-end convert_mmap(), the 'bytes' engine
+ parallel   end-to-end convert_parallel() (with --jobs N, N > 1)
+ latency_*  per-request latency converting the first --server-rows rows
+            (with --server-requests N, N > 0): a cold CLI run (cli), a cold
+            --connect client (connect), request() from a running process
+            (request), and request() with 8 requests in flight (concurrent)
+
+Each conversion stage is timed (best of --repeat runs) and then run once
+more under tracemalloc to record its peak allocation. Latency stages report
+the median request. The report includes rows/s, features/s, the
+per-feature memory of the record types, and the peak RSS of the process.
+Results can be saved as JSON and compared against an earlier run to catch
+regressions:
+
+ python3 benchmark.py --genes 60000 --json new.json --compare old.json
+"""
+
+import sys
+import os
+import time
+import json
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+import concurrent.futures
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import mochiview2gff
+
+__author__ = "Thaddeus D. Seher (@tdseher)"
+__program__ = os.path.basename(sys.argv[0])
+
+HEADER = "SEQ_NAME\tSTART\tEND\tSTRAND\tFEATURE_NAME\tTXN_START\tTXN_END\tEXON_COUNT\tEXON_STARTS\tEXON_ENDS\tCDS_START\tCDS_END\tGENE_NAME\tALIASES\tDESCRIPTION"
+
+# Default exon-count distribution (count: weight), roughly that of a fungal genome
+EXON_COUNTS = {1: 60, 2: 20, 3: 8, 4: 5, 6: 4, 10: 2, 20: 1}
+
+# Vocabulary for descriptions, and characters that must be percent-encoded
+WORDS = ("putative", "protein", "kinase", "transcription", "factor", "involved", "in", "cell", "wall",
+    "biogenesis", "hyphal", "growth", "similar", "to", "S.", "cerevisiae", "ortholog", "of", "membrane",
+    "transporter", "regulated", "by", "Nrg1", "Tup1", "induced", "during", "biofilm", "formation")
+ESCAPED = '";=%,&\'()[]\\\x01\x7f'
+NON_ASCII = ('α', 'β', 'é', 'µ')
+
+def parse_exon_counts(text):
+    '''
+    Parse an exon-count distribution given as 'count:weight,count:weight,...'
+    '''
+    counts = {}
+    for item in text.split(','):
+        count, weight = item.split(':')
+        counts[int(count)] = float(weight)
+    return counts
+
+def generate_table(outfile, genes=10000, seed=1, exon_counts=EXON_COUNTS, minus_fraction=0.5,
+        coding_fraction=0.85, description_length=(20, 200), escape_fraction=0.3, sequences=16):
+    '''
+    Write a synthetic MochiView gene table with 'genes' rows (plus the header)
+    to the text stream 'outfile'. The same arguments always produce the same
+    table. Genes are laid out along 'sequences' chromosomes; a fraction
+    'minus_fraction' is on the minus strand and 'coding_fraction' has a CDS.
+    Description lengths are drawn uniformly from 'description_length', and a
+    fraction 'escape_fraction' of the descriptions contains characters that
+    must be escaped.
+    '''
+    rng = random.Random(seed)
+    count_values = list(exon_counts)
+    count_weights = [exon_counts[c] for c in count_values]
+    positions = [1] * sequences
+
+    outfile.write(HEADER + '\n')
+    for i in range(genes):
+        s = rng.randrange(sequences)
+        seqid = 'chr{}'.format(s+1)
+        strand = '-' if (rng.random() < minus_fraction) else '+'
+        exon_count = rng.choices(count_values, count_weights)[0]
+
+        # Exons, separated by introns, after an intergenic gap
+        pos = positions[s] + rng.randint(100, 3000)
+        exons = []
+        for e in range(exon_count):
+            if e:
+                pos += rng.randint(50, 800)
+            length = rng.randint(60, 1500)
+            exons.append((pos, pos + length - 1))
+            pos += length
+        positions[s] = pos
+        txn_start, txn_end = exons[0][0], exons[-1][1]
+        start = txn_start - rng.randint(0, 50)
+        end = txn_end + rng.randint(0, 50)
+
+        if (rng.random() < coding_fraction):
+            cds_start = rng.randint(txn_start, exons[0][1] - 1)
+            cds_end = rng.randint(max(cds_start + 1, exons[-1][0]), txn_end)
+            if (strand == '-'):
+                cds_start, cds_end = cds_end, cds_start
+        else:
+            cds_start = cds_end = ''
+
+        if (strand == '+'):
+            exon_starts = [a for a, b in exons]
+            exon_ends = [b for a, b in exons]
+        else:
+            exon_starts = [b for a, b in exons][::-1]
+            exon_ends = [a for a, b in exons][::-1]
+
+        feature_name = 'orf19.{}'.format(i+1)
+        gene_name = 'GEN{}'.format(i+1) if (rng.random() < 0.4) else ''
+        aliases = '|'.join('C{}_{:05d}W_A'.format(s+1, rng.randrange(100000)) for a in range(rng.randint(0, 3)))
+
+        length = rng.randint(*description_length)
+        words = []
+        size = 0
+        while (size < length):
+            word = rng.choice(WORDS)
+            if (rng.random() < 0.02):
+                word += rng.choice(NON_ASCII)
+            words.append(word)
+            size += len(word) + 1
+        if (rng.random() < escape_fraction):
+            for c in range(rng.randint(1, 4)):
+                words.insert(rng.randrange(len(words)), rng.choice(ESCAPED))
+            words.append('end')
+        description = ' '.join(words)
+
+        outfile.write('\t'.join(map(str, (seqid, start, end, strand, feature_name, txn_start, txn_end, exon_count,
+            '|'.join(map(str, exon_starts)), '|'.join(map(str, exon_ends)), cds_start, cds_end,
+            gene_name, aliases, description))) + '\n')
+
+def _peak_rss():
+    '''
+    Peak resident set size of this process in bytes, or None if unknown
+    '''
+    if (resource == None):
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if (sys.platform == 'darwin'):
+        return rss
+    return rss * 1024
+
+def measure(function, repeat):
+    '''
+    Run 'function' 'repeat' times and return (best seconds, peak traced bytes
+    of one extra run, result of the last run)
+    '''
+    best = None
+    for r in range(repeat):
+        t0 = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - t0
+        if ((best == None) or (elapsed < best)):
+            best = elapsed
+        del result
+
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+def feature_memory(rows, source):
+    '''
+    Traced bytes per feature for the same features held as 9-tuples, as
+    gff_feature records, and in a feature_batch
+    '''
+    builders = (
+        ('tuple', lambda: [tuple(f) for r in rows for f in mochiview2gff._parsed_row_features(r, source)]),
+        ('gff_feature', lambda: [f for r in rows for f in mochiview2gff._parsed_row_features(r, source)]),
+        ('feature_batch', lambda: mochiview2gff.feature_batch(f for r in rows for f in mochiview2gff._parsed_row_features(r, source))),
+    )
+    sizes = {}
+    for name, build in builders:
+        tracemalloc.start()
+        features = build()
+        sizes[name] = tracemalloc.get_traced_memory()[0] / len(features)
+        tracemalloc.stop()
+        del features
+    return sizes
+
+def run(path, args):
+    '''
+    Benchmark every stage on the table at 'path' and return the results dict
+    '''
+    source = 'benchmark'
+    stages = {}
+
+    def record(name, function, rows, features):
+        seconds, peak, result = measure(function, args.repeat)
+        stages[name] = {
+            'seconds': seconds,
+            'rows_per_s': rows / seconds if seconds else None,
+            'features_per_s': features / seconds if seconds else None,
+            'peak_traced_bytes': peak,
+        }
+        print("{:<14} {:9.3f} s {:>12.0f} rows/s {:>12.0f} features/s {:>10.1f} MiB peak".format(
+            name, seconds, stages[name]['rows_per_s'] or 0, stages[name]['features_per_s'] or 0, peak / 1048576), file=sys.stderr)
+        return result
+
+    def read():
+        with open(path, 'r') as flo:
+            next(flo)
+            return flo.readlines()
+    lines = read()
+    parsed = [mochiview2gff._parse_row(line) for line in lines]
+    features = [f for r in parsed for f in mochiview2gff._parsed_row_features(r, source)]
+    n_rows = len(lines)
+    n_features = len(features)
+
+    record('read', read, n_rows, n_features)
+    record('parse', lambda: [mochiview2gff._parse_row(line) for line in lines], n_rows, n_features)
+    record('build', lambda: [f for r in parsed for f in mochiview2gff._parsed_row_features(r, source)], n_rows, n_features)
+    record('validate', lambda: [mochiview2gff._row_problems(r) for r in parsed], n_rows, n_features)
+    record('escape', lambda: [mochiview2gff._escape_text(r[mochiview2gff.DESCRIPTION]) for r in parsed], n_rows, n_features)
+    record('serialize', lambda: [str(f) for f in features], n_rows, n_features)
+
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmpdir:
+        out_path = os.path.join(tmpdir, 'out.gff')
+
+        def write():
+            with open(out_path, 'w') as out:
+                mochiview2gff.write_features(features, out)
+        record('write', write, n_rows, n_features)
+
+        engines = ['python']
+        if (mochiview2gff._numpy_module() != None):
+            engines.append('numpy')
+        for engine in engines:
+            def convert():
+                with open(path, 'r') as flo, open(out_path, 'w') as out:
+                    mochiview2gff.convert(flo, out, source, engine)
+            record('convert' if (engine == 'python') else 'convert_' + engine, convert, n_rows, n_features)
+
+        def convert_skip():
+            with open(path, 'r') as flo, open(out_path, 'w') as out:
+                mochiview2gff.convert(flo, out, source, validator=mochiview2gff.row_validator('skip'))
+        record('convert_skip', convert_skip, n_rows, n_features)
+
+        def fanout():
+            with open(path, 'r') as flo, open(out_path, 'w') as out, open(out_path + '.gtf', 'w') as gtf, open(out_path + '.bed', 'w') as bed:
+                mochiview2gff.convert_formats(flo, {'gff': out, 'gtf': gtf, 'bed': bed}, source)
+        record('fanout', fanout, n_rows, n_features)
+
+        def shard():
+            with open(path, 'r') as flo, mochiview2gff.shard_writer(os.path.join(tmpdir, 'shards')) as out:
+                mochiview2gff.convert(flo, out, source)
+        record('shard', shard, n_rows, n_features)
+
+        def convert_bytes():
+            with open(out_path, 'wb') as out:
+                mochiview2gff.convert_mmap(path, out, source)
+        record('convert_bytes', convert_bytes, n_rows, n_features)
+
+        if (args.jobs > 1):
+            def parallel():
+                with open(out_path, 'w') as out:
+                    mochiview2gff.convert_parallel(path, source, out, args.jobs)
+            record('parallel', parallel, n_rows, n_features)
+
+        if (args.server_requests > 0):
+            for name, (rows, times) in latency(path, args.server_rows, args.server_requests, tmpdir).items():
+                median = statistics.median(times)
+                p95 = sorted(times)[int(0.95 * (len(times)-1))]
+                stages[name] = {
+                    'seconds': median,
+                    'p95_seconds': p95,
+                    'rows_per_s': rows / median,
+                    'features_per_s': None,
+                    'peak_traced_bytes': None,
+                }
+                print("{:<18} {:9.4f} s median {:9.4f} s p95 {:>12.0f} rows/s".format(name, median, p95, rows / median), file=sys.stderr)
+
+    del features
+    memory = feature_memory(parsed[:args.memory_rows], source)
+    for name, size in memory.items():
+        print("{:<14} {:8.1f} bytes/feature".format(name, size), file=sys.stderr)
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': getattr(mochiview2gff._numpy_module(), '__version__', None),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': {
+            'genes': args.genes,
+            'seed': args.seed,
+            'exon_counts': args.exon_counts,
+            'minus_fraction': args.minus_fraction,
+            'coding_fraction': args.coding_fraction,
+            'description_length': args.description_length,
+            'escape_fraction': args.escape_fraction,
+            'repeat': args.repeat,
+            'jobs': args.jobs,
+            'server_rows': args.server_rows,
+            'server_requests': args.server_requests,
+        },
+        'rows': n_rows,
+        'features': n_features,
+        'input_bytes': os.path.getsize(path),
+        'stages': stages,
+        'memory_per_feature': memory,
+        'peak_rss_bytes': _peak_rss(),
+    }
+
+def latency(path, rows, requests, tmpdir):
+    '''
+    Time conversion requests for the first 'rows' rows of the table at
+    'path', cold through the CLI and through a conversion server started
+    for the purpose. Returns a dict of stage name to (rows, list of
+    per-request seconds).
+    '''
+    source = 'benchmark'
+    subset = os.path.join(tmpdir, 'subset.txt')
+    with open(path, 'r') as flo, open(subset, 'w') as out:
+        out.write(next(flo))
+        count = 0
+        for line in flo:
+            if (count == rows):
+                break
+            out.write(line)
+            count += 1
+    sock = os.path.join(tmpdir, 'server.sock')
+    script = mochiview2gff.__file__
+    server = subprocess.Popen([sys.executable, script, '--serve', sock], stderr=subprocess.DEVNULL)
+    try:
+        while not os.path.exists(sock):
+            if (server.poll() != None):
+                raise RuntimeError("conversion server exited with status {}".format(server.returncode))
+            time.sleep(0.01)
+
+        def timed(function):
+            t0 = time.perf_counter()
+            function()
+            return time.perf_counter() - t0
+
+        def cli(*options):
+            subprocess.run([sys.executable, script] + list(options) + [subset, source], stdout=subprocess.DEVNULL, check=True)
+
+        def request():
+            with open(subset, 'r') as flo, open(os.devnull, 'w') as out:
+                mochiview2gff.request(sock, flo, out, source)
+
+        samples = {
+            'latency_cli': [timed(cli) for i in range(requests)],
+            'latency_connect': [timed(lambda: cli('--connect', sock)) for i in range(requests)],
+            'latency_request': [timed(request) for i in range(requests)],
+        }
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            samples['latency_concurrent'] = list(pool.map(lambda i: timed(request), range(max(requests, 8))))
+    finally:
+        server.terminate()
+        server.wait()
+    return {name: (count, times) for name, times in samples.items()}
+
+def compare(results, baseline, tolerance):
+    '''
+    Compare stage timings against an earlier 'baseline' results dict. Returns
+    the list of stages that are slower by more than 'tolerance' (a fraction).
+    '''
+    regressions = []
+    for name, stage in results['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if (old == None):
+            continue
+        change = stage['seconds'] / old['seconds'] - 1
+        flag = ''
+        if (change > tolerance):
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print("{:<14} {:9.3f} s -> {:9.3f} s ({:+.1%}){}".format(name, old['seconds'], stage['seconds'], change, flag), file=sys.stderr)
+    if (baseline.get('parameters') != results['parameters']):
+        print("Warning: benchmark parameters differ from the baseline", file=sys.stderr)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(prog=__program__, description="Benchmark mochiview2gff on a synthetic MochiView gene table.")
+    parser.add_argument("--genes", type=int, default=20000, help="number of genes (rows) to generate (default: 20000)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the generator (default: 1)")
+    parser.add_argument("--exon-counts", default=','.join('{}:{}'.format(k, v) for k, v in EXON_COUNTS.items()),
+        help="exon-count distribution as count:weight pairs (default: %(default)s)")
+    parser.add_argument("--minus-fraction", type=float, default=0.5, help="fraction of genes on the minus strand (default: 0.5)")
+    parser.add_argument("--coding-fraction", type=float, default=0.85, help="fraction of genes with a CDS (default: 0.85)")
+    parser.add_argument("--description-length", type=int, nargs=2, default=[20, 200], metavar=("MIN", "MAX"),
+        help="range of description lengths (default: 20 200)")
+    parser.add_argument("--escape-fraction", type=float, default=0.3,
+        help="fraction of descriptions containing characters that need escaping (default: 0.3)")
+    parser.add_argument("--repeat", type=int, default=3, help="timing runs per stage; the best is reported (default: 3)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="also benchmark --jobs N parallel conversion")
+    parser.add_argument("--server-requests", type=int, default=20, metavar="N",
+        help="requests timed per latency stage; 0 skips the latency stages (default: 20)")
+    parser.add_argument("--server-rows", type=int, default=200, metavar="ROWS",
+        help="rows converted by each latency request (default: 200)")
+    parser.add_argument("--memory-rows", type=int, default=20000, help="rows used for the per-feature memory report (default: 20000)")
+    parser.add_argument("--input", metavar="PATH", help="benchmark an existing MochiView file instead of generating one")
+    parser.add_argument("--keep-input", metavar="PATH", help="save the generated table to PATH")
+    parser.add_argument("--json", metavar="PATH", help="write the results as JSON to PATH")
+    parser.add_argument("--compare", metavar="PATH", help="compare against results saved with --json")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+        help="slowdown (fraction) reported as a regression by --compare (default: 0.10)")
+    parser.add_argument("--tmpdir", metavar="DIR", help="directory for temporary files")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmpdir:
+        if args.input:
+            path = args.input
+        else:
+            path = args.keep_input or os.path.join(tmpdir, 'annotations.txt')
+            t0 = time.perf_counter()
+            with open(path, 'w') as flo:
+                generate_table(flo, args.genes, args.seed, parse_exon_counts(args.exon_counts), args.minus_fraction,
+                    args.coding_fraction, tuple(args.description_length), args.escape_fraction)
+            print("Generated {} genes in {:.1f} s".format(args.genes, time.perf_counter() - t0), file=sys.stderr)
+        results = run(path, args)
+
+    rss = results['peak_rss_bytes']
+    if (rss != None):
+        print("Peak RSS: {:.1f} MiB".format(rss / 1048576), file=sys.stderr)
+
+    if args.json:
+        with open(args.json, 'w') as flo:
+            json.dump(results, flo, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as flo:
+            baseline = json.load(flo)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+if (__name__ == "__main__"):
+    main()
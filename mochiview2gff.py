@@ -200,293 +200,3646 @@ type list
 
 import sys
 import os
+import re
+import io
+import argparse
+import collections
+import array
+import itertools
+import heapq
+import operator
+import tempfile
+import struct
+import zlib
+import gzip
+import concurrent.futures
+import bz2
+import lzma
+import queue
+import threading
+import time
+import json
+import hashlib
+import inspect
+import socket
+import signal
+import mmap
+import urllib.parse
+
+# NumPy, asyncio, multiprocessing, sqlite3 and the profilers are imported by
+# the code paths that use them, which keeps startup quick for the common
+# single-process conversion
 
 __author__ = "Thaddeus D. Seher (@tdseher)"
 __program__ = os.path.basename(sys.argv[0])
 
-class feature_parser(object):
-    def __init__(self, line, source):
-        # Define MochiView column ID indices
-        SEQ_NAME = 0
-        START = 1
-        END = 2
-        STRAND = 3
-        FEATURE_NAME = 4
-        TXN_START = 5
-        TXN_END = 6
-        EXON_COUNT = 7
-        EXON_STARTS = 8
-        EXON_ENDS = 9
-        CDS_START = 10
-        CDS_END = 11
-        GENE_NAME = 12
-        ALIASES = 13
-        DESCRIPTION = 14
+# GFF3 percent-encoding table for attribute text. Built once at import so
+# that escaping a DESCRIPTION is a single str.translate() call.
+_ESCAPE_TABLE = {
+    '"': '%22',
+    '%': '%25',
+    '&': '%26',
+    "'": '%27',
+    '(': '%28',
+    ')': '%29',
+    ',': '%2C',
+    ';': '%3B',
+    '=': '%3D',
+    '[': '%5B',
+    '\\': '%5C',
+    ']': '%5D',
+    chr(127): '%7F',
+}
+for _i in range(33):
+    _ESCAPE_TABLE[chr(_i)] = '%' + hex(_i)[2:].zfill(2)
+#_ESCAPE_TABLE[chr(0)] = '%20'
+del _i
+_ESCAPE_PATTERN = re.compile('[' + re.escape(''.join(sorted(_ESCAPE_TABLE))) + ']')
+_ESCAPE_TABLE = str.maketrans(_ESCAPE_TABLE)
+
+# Pre-serialized attribute key prefixes, in the order they are written
+_ATTR_PREFIXES = {
+    'Name': 'Name=',
+    'ID': 'ID=',
+    'Parent': 'Parent=',
+    'Alias': 'Alias=',
+    'Note': 'Note=',
+}
+
+def _escape_text(text):
+    '''
+    GFF3 files are nine-column, tab-delimited, plain text files. Literal use
+    of tab, newline, carriage return, the percent (%) sign, and control
+    characters must be encoded using RFC 3986 Percent-Encoding; no other
+    characters may be encoded. Backslash and other ad-hoc escaping
+    conventions that have been added to the GFF format are not allowed.
+    The file contents may include any character in the set supported by the
+    operating environment, although for portability with other systems, use
+    of Latin-1 or Unicode are recommended.
+    
+    Note that unescaped spaces are allowed within fields, meaning that
+    parsers must split on tabs, not spaces. Use of the "+" (plus) character
+    to encode spaces is depracated from early versions of the spec and is
+    no longer allowed.
+    
+    Undefined fields are replaced with the "." character, as described in
+    the original GFF spec.
+    
+    Most descriptions contain nothing that needs escaping, so those are
+    returned as-is without being copied.
+    '''
+    if (_ESCAPE_PATTERN.search(text) is None):
+        return text
+    return text.translate(_ESCAPE_TABLE)
+
+def _join_attributes(attributes):
+    '''
+    Serialize an attribute dict into a GFF3 column 9 string. Values must
+    already be escaped.
+    '''
+    prefixes = _ATTR_PREFIXES
+    return ';'.join([(prefixes[k] if (k in prefixes) else str(k) + '=') + str(v) for k, v in attributes.items()])
+
+class gff_feature(object):
+    '''
+    Compact record for one GFF line. Uses __slots__ instead of a per-instance
+    dict, and the seqid/source/type/strand values are expected to be interned
+    strings shared by every feature that uses them. Iterating or indexing a
+    gff_feature gives the same 9 fields as the tuples this class replaced.
+    '''
+    __slots__ = ('seqid', 'source', 'type', 'start', 'end', 'score', 'strand', 'phase', 'attributes')
+    
+    def __init__(self, seqid, source, type, start, end, score, strand, phase, attributes):
+        self.seqid = seqid
+        self.source = source
+        self.type = type
+        self.start = start
+        self.end = end
+        self.score = score
+        self.strand = strand
+        self.phase = phase
+        self.attributes = attributes
+    
+    def _fields(self):
+        return (self.seqid, self.source, self.type, self.start, self.end, self.score, self.strand, self.phase, self.attributes)
+    
+    def __iter__(self):
+        return iter(self._fields())
+    
+    def __len__(self):
+        return 9
+    
+    def __getitem__(self, index):
+        return self._fields()[index]
+    
+    def __eq__(self, other):
+        if not isinstance(other, (gff_feature, tuple, list)):
+            return NotImplemented
+        return self._fields() == tuple(other)
+    
+    def __hash__(self):
+        # Equal to the hash of the equivalent tuple, as __eq__ is
+        return hash(self._fields())
+    
+    def __repr__(self):
+        return 'gff_feature' + repr(self._fields())
+    
+    def __str__(self):
+        return (self.seqid + '\t' + self.source + '\t' + self.type + '\t' + str(self.start) + '\t' + str(self.end) +
+            '\t' + self.score + '\t' + self.strand + '\t' + str(self.phase) + '\t' + self.attributes)
+
+class feature_batch(object):
+    '''
+    Columnar container for many features. Coordinates are stored in typed
+    array('l') columns and all strings live in one shared pool that the
+    other columns index into with array('i') columns. The low-cardinality
+    columns (seqid, source, type, score, strand) are deduplicated within
+    the pool. Attributes are split into the text before their ID field
+    (Name), the ID field, the Parent field after it and the rest (Alias and
+    Note). All but the ID are shared by the features of a gene, and are
+    deduplicated in the pool too. The nearly always unique ID fields are
+    packed as UTF-8 into one bytearray instead of a str per feature.
+    '''
+    __slots__ = ('strings', '_string_index', 'seqids', 'sources', 'types', 'starts', 'ends', 'scores', 'strands', 'phases',
+        'attribute_heads', 'ids', 'id_ends', 'attribute_parents', 'attribute_tails')
+    
+    def __init__(self, features=None):
+        self.strings = []
+        self._string_index = {}
+        self.seqids = array.array('i')
+        self.sources = array.array('i')
+        self.types = array.array('i')
+        self.starts = array.array('l')
+        self.ends = array.array('l')
+        self.scores = array.array('i')
+        self.strands = array.array('i')
+        self.phases = array.array('b') # -1 for '.'
+        self.attribute_heads = array.array('i')
+        self.ids = bytearray()
+        self.id_ends = array.array('l') # The ID field of feature i is ids[id_ends[i-1]:id_ends[i]]
+        self.attribute_parents = array.array('i')
+        self.attribute_tails = array.array('i')
+        if (features != None):
+            self.extend(features)
+    
+    def _pool(self, text):
+        index = self._string_index.get(text)
+        if (index == None):
+            index = self._string_index[text] = len(self.strings)
+            self.strings.append(sys.intern(text))
+        return index
+    
+    def _pool_attributes(self, text):
+        # Like _pool(), without interning text that is rarely shared beyond
+        # one gene
+        index = self._string_index.get(text)
+        if (index == None):
+            index = self._string_index[text] = len(self.strings)
+            self.strings.append(text)
+        return index
+    
+    def append(self, feature):
+        seqid, source, type, start, end, score, strand, phase, attributes = feature
+        pool = self._pool
+        self.seqids.append(pool(seqid))
+        self.sources.append(pool(source))
+        self.types.append(pool(type))
+        self.starts.append(start)
+        self.ends.append(end)
+        self.scores.append(pool(score))
+        self.strands.append(pool(strand))
+        self.phases.append(-1 if (phase == '.') else phase)
+        if attributes.startswith('ID='):
+            id_start = 0
+        else:
+            id_start = attributes.find(';ID=')
+            if (id_start != -1):
+                id_start += 1
+        if (id_start == -1):
+            # No ID field: the whole text is the head
+            head, id, parent, tail = attributes, '', '', ''
+        else:
+            id_end = attributes.find(';', id_start)
+            if (id_end == -1):
+                id_end = len(attributes)
+            parent_end = id_end
+            if attributes.startswith(';Parent=', id_end):
+                parent_end = attributes.find(';', id_end + 1)
+                if (parent_end == -1):
+                    parent_end = len(attributes)
+            head, id, parent, tail = (attributes[:id_start], attributes[id_start:id_end], attributes[id_end:parent_end],
+                attributes[parent_end:])
+        pool = self._pool_attributes
+        self.attribute_heads.append(pool(head))
+        self.ids += id.encode('utf-8', 'surrogateescape')
+        self.id_ends.append(len(self.ids))
+        self.attribute_parents.append(pool(parent))
+        self.attribute_tails.append(pool(tail))
+    
+    def extend(self, features):
+        for feature in features:
+            self.append(feature)
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def _attributes(self, head, id_start, id_end, parent, tail):
+        s = self.strings
+        return s[head] + self.ids[id_start:id_end].decode('utf-8', 'surrogateescape') + s[parent] + s[tail]
+    
+    def __getitem__(self, index):
+        s = self.strings
+        index = range(len(self))[index]
+        phase = self.phases[index]
+        id_start = self.id_ends[index-1] if (index > 0) else 0
+        attributes = self._attributes(self.attribute_heads[index], id_start, self.id_ends[index], self.attribute_parents[index],
+            self.attribute_tails[index])
+        return gff_feature(s[self.seqids[index]], s[self.sources[index]], s[self.types[index]],
+            self.starts[index], self.ends[index], s[self.scores[index]], s[self.strands[index]],
+            '.' if (phase == -1) else phase, attributes)
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+    
+    def lines(self):
+        '''
+        Generator yielding each feature serialized as a GFF line (without the
+        newline), straight from the columns.
+        '''
+        s = self.strings
+        id_starts = itertools.chain([0], self.id_ends)
+        attributes = map(self._attributes, self.attribute_heads, id_starts, self.id_ends, self.attribute_parents, self.attribute_tails)
+        columns = (self.seqids, self.sources, self.types, self.starts, self.ends, self.scores, self.strands, self.phases, attributes)
+        for seqid, source, type, start, end, score, strand, phase, attributes in zip(*columns):
+            yield (s[seqid] + '\t' + s[source] + '\t' + s[type] + '\t' + str(start) + '\t' + str(end) +
+                '\t' + s[score] + '\t' + s[strand] + '\t' + ('.' if (phase == -1) else str(phase)) + '\t' + attributes)
+    
+    def write(self, outfile):
+        '''
+        Write all features to the 'outfile' text stream as GFF
+        '''
+        for line in self.lines():
+            outfile.write(line + '\n')
+
+# Define MochiView column ID indices
+SEQ_NAME = 0
+START = 1
+END = 2
+STRAND = 3
+FEATURE_NAME = 4
+TXN_START = 5
+TXN_END = 6
+EXON_COUNT = 7
+EXON_STARTS = 8
+EXON_ENDS = 9
+CDS_START = 10
+CDS_END = 11
+GENE_NAME = 12
+ALIASES = 13
+DESCRIPTION = 14
+# Only in rows parsed from files that have these columns
+ISOFORM_NAME = 15
+IS_PRIMARY = 16
+
+def _row_attributes(feature_name, gene_name, aliases, description, isoform=0, escape=_escape_text):
+    '''
+    Build the attribute fragments shared by every feature of a row. The
+    Alias/Note values are serialized (and escaped with 'escape') only once
+    per row, and left out if None. A non-zero 'isoform' numbers the
+    transcript ID. Returns (gene_id, transcript_id, id_prefix, note_attributes,
+    child_attributes).
+    '''
+    if gene_name:
+        name_attribute = _ATTR_PREFIXES['Name'] + gene_name + ';'
+    else:
+        name_attribute = ''
+    # Alias and Note are left out only when the file has no such column
+    note_attributes = ''
+    if (aliases != None):
+        note_attributes += ';' + _ATTR_PREFIXES['Alias'] + ','.join(aliases.split('|'))
+    if (description != None):
+        note_attributes += ';' + _ATTR_PREFIXES['Note'] + escape(description)
+    transcript_id = feature_name + '-T'
+    if isoform:
+        transcript_id += str(isoform)
+    id_prefix = name_attribute + _ATTR_PREFIXES['ID']
+    child_attributes = ';' + _ATTR_PREFIXES['Parent'] + transcript_id
+    return feature_name, transcript_id, id_prefix, note_attributes, child_attributes
+
+# Strand values, as str or as the bytes of the 'bytes' engine
+_PLUS = ('+', b'+')
+_MINUS = ('-', b'-')
+
+def _row_problems(sline):
+    '''
+    Check a parsed row for problems that would make its GFF invalid.
+    Returns a list of (check, message) tuples, which is empty for a good
+    row. A good row costs a handful of comparisons and one pass over its
+    exons, all in C, so the check is always on. Works on rows parsed from
+    str or bytes.
+    '''
+    problems = []
+    strand = sline[STRAND]
+    exon_starts = sline[EXON_STARTS]
+    exon_ends = sline[EXON_ENDS]
+    # Oriented so that each exon runs from 'lows' to 'highs'
+    if (strand in _PLUS):
+        lows, highs = exon_starts, exon_ends
+    elif (strand in _MINUS):
+        lows, highs = exon_ends, exon_starts
+    else:
+        # Without an orientation the exon and CDS spans cannot be checked
+        problems.append(('strand', "Unknown strand: {!r}".format(strand)))
+        lows = highs = None
+    
+    if not (sline[EXON_COUNT] == len(exon_starts) == len(exon_ends)):
+        problems.append(('exon_count', "Exons improperly defined: EXON_COUNT is {} but {} starts and {} ends are listed".format(
+            sline[EXON_COUNT], len(exon_starts), len(exon_ends))))
+    
+    start = sline[START]
+    end = sline[END]
+    if (start > end):
+        problems.append(('gene_span', "START {} is after END {}".format(start, end)))
+    
+    txn_start = sline[TXN_START]
+    txn_end = sline[TXN_END]
+    if (txn_start > txn_end):
+        problems.append(('transcript_span', "TXN_START {} is after TXN_END {}".format(txn_start, txn_end)))
+    elif ((txn_start < start) or (end < txn_end)):
+        problems.append(('transcript_span', "transcript {}-{} extends beyond the gene {}-{}".format(txn_start, txn_end, start, end)))
+    
+    if (lows != None):
+        exons_low = min(lows)
+        exons_high = max(highs)
+        if not all(map(operator.le, lows, highs)):
+            problems.append(('exon_span', "an exon starts after it ends"))
+        elif ((exons_low < txn_start) or (txn_end < exons_high)):
+            problems.append(('exon_span', "exons {}-{} extend beyond the transcript {}-{}".format(exons_low, exons_high, txn_start, txn_end)))
+    
+    cds_start = sline[CDS_START]
+    cds_end = sline[CDS_END]
+    if ((cds_start == None) != (cds_end == None)):
+        problems.append(('cds_span', "only one of CDS_START and CDS_END is set"))
+    elif ((cds_start != None) and (lows != None)):
+        if (cds_end < cds_start):
+            cds_start, cds_end = cds_end, cds_start
+        if ((cds_start < exons_low) or (exons_high < cds_end)):
+            problems.append(('cds_span', "CDS {}-{} extends beyond the exons {}-{}".format(cds_start, cds_end, exons_low, exons_high)))
+    return problems
+
+class invalid_row(ValueError):
+    '''
+    Raised for a MochiView row that fails validation. 'problems' is the
+    list of (check, message) tuples from _row_problems(), 'feature' the
+    row's FEATURE_NAME and 'line_number' its line in the file, when known.
+    '''
+    def __init__(self, problems, feature=None, line_number=None):
+        ValueError.__init__(self, problems, feature, line_number)
+        self.problems = problems
+        self.feature = feature
+        self.line_number = line_number
+    
+    def __str__(self):
+        prefix = ''
+        if (self.line_number != None):
+            prefix += 'line {}: '.format(self.line_number)
+        if (self.feature != None):
+            prefix += '{}: '.format(self.feature)
+        return prefix + '; '.join(message for check, message in self.problems)
+
+class row_validator(object):
+    '''
+    Handles the rows that fail validation (--validate). The converters check
+    every row with _row_problems() and pass the error of each bad row, or of
+    a row that cannot be parsed, to problem() along with its line number.
+    In mode 'fail' the first one raises invalid_row. In modes 'skip' and
+    'collect' the row is left out of the output and its problems are
+    recorded for the report; main() exits with status 0 after 'skip' and 1
+    after 'collect' if there were any.
+    '''
+    MODES = ('fail', 'skip', 'collect')
+    
+    def __init__(self, mode='fail'):
+        if (mode not in self.MODES):
+            raise ValueError("unknown validation mode {!r}".format(mode))
+        self.mode = mode
+        self.invalid_rows = 0
+        self.problems = []
+    
+    def problem(self, line_number, line, error):
+        '''
+        Record 'error', raised while converting the data 'line' at
+        'line_number' (the header being line 1), and raise invalid_row in
+        mode 'fail'
+        '''
+        if isinstance(error, invalid_row):
+            problems = error.problems
+            feature = error.feature
+        elif isinstance(error, IndexError):
+            problems = [('parse', "too few columns")]
+            feature = None
+        else:
+            problems = [('parse', str(error))]
+            feature = None
+        self.invalid_rows += 1
+        for check, message in problems:
+            self.problems.append({'line': line_number, 'feature': feature, 'check': check, 'message': message})
+        if (self.mode == 'fail'):
+            raise invalid_row(problems, feature, line_number) from None
+    
+    def as_dict(self):
+        return {
+            'mode': self.mode,
+            'invalid_rows': self.invalid_rows,
+            'problems': self.problems,
+        }
+    
+    def summary(self, limit=20):
+        lines = []
+        for problem in self.problems[:limit]:
+            lines.append('{__program__}: line {line}: {feature}: {message}'.format(
+                line=problem['line'], feature=problem['feature'] or '?', message=problem['message'], **globals()))
+        if (0 < limit < len(self.problems)):
+            lines.append('{__program__}: ... and {more} more problems'.format(more=len(self.problems) - limit, **globals()))
+        lines.append('{__program__}: {rows} invalid rows {verb}'.format(
+            rows=self.invalid_rows, verb='skipped' if (self.mode == 'skip') else 'left out', **globals()))
+        return '\n'.join(lines)
+
+def _checked_row(line_number, line, parse_row, validator):
+    '''
+    Parse and check one data line, for the stages that keep parsed rows
+    (isoform grouping). Returns the row, or None if 'validator' skips it.
+    Without a validator a bad row raises.
+    '''
+    try:
+        row = parse_row(line)
+        problems = _row_problems(row)
+        if problems:
+            raise invalid_row(problems, row[FEATURE_NAME])
+    except (ValueError, IndexError) as e:
+        if (validator == None):
+            raise
+        validator.problem(line_number, line, e)
+        return None
+    return row
+
+def _checked_gene(entries, validator):
+    '''
+    Check that the rows of one gene, given as (line_number, line, row)
+    entries, are all on the sequence and strand of its first row, and
+    return the rows that are. The others raise invalid_row, or are passed
+    to the row_validator 'validator' and left out.
+    '''
+    first = entries[0][2]
+    rows = [first]
+    for line_number, line, row in entries[1:]:
+        if ((row[SEQ_NAME] != first[SEQ_NAME]) or (row[STRAND] != first[STRAND])):
+            error = invalid_row([('isoforms', "Isoforms of {} are on different sequences or strands".format(first[FEATURE_NAME]))],
+                first[FEATURE_NAME])
+            if (validator == None):
+                raise error
+            validator.problem(line_number, line, error)
+        else:
+            rows.append(row)
+    return rows
+
+def _parse_row(line):
+    '''
+    Split one MochiView data line into a list of its columns, in the order
+    of the column indices above, with the coordinates converted to integers
+    and missing CDS coordinates set to None. Blank optional cells at the
+    end of the line, which rstrip() removes, are read as empty.
+    '''
+    line = line.rstrip()
+    sline = line.split("\t")
+    if (EXON_ENDS < len(sline) <= DESCRIPTION):
+        sline += [''] * (DESCRIPTION + 1 - len(sline))
+    return [
+        sline[SEQ_NAME],
+        int(sline[START]),
+        int(sline[END]),
+        sline[STRAND],
+        sline[FEATURE_NAME],
+        int(sline[TXN_START]),
+        int(sline[TXN_END]),
+        int(sline[EXON_COUNT]),
+        list(map(int, sline[EXON_STARTS].split('|'))),
+        list(map(int, sline[EXON_ENDS].split('|'))),
+        int(sline[CDS_START]) if (sline[CDS_START] != '') else None,
+        int(sline[CDS_END]) if (sline[CDS_END] != '') else None,
+        sline[GENE_NAME],
+        sline[ALIASES],
+        sline[DESCRIPTION],
+    ]
+
+# Column names of the standard MochiView layout, in the order of the indices
+# above. A header line naming these columns in a different order, or leaving
+# out the optional ones, is converted with a row parser compiled for it.
+_COLUMNS = ('SEQ_NAME', 'START', 'END', 'STRAND', 'FEATURE_NAME', 'TXN_START', 'TXN_END', 'EXON_COUNT',
+    'EXON_STARTS', 'EXON_ENDS', 'CDS_START', 'CDS_END', 'GENE_NAME', 'ALIASES', 'DESCRIPTION')
+_REQUIRED_COLUMNS = ('SEQ_NAME', 'START', 'END', 'FEATURE_NAME', 'EXON_STARTS', 'EXON_ENDS')
+# Optional columns describing the isoforms of a gene. Rows parsed from a
+# file with either of them also have ISOFORM_NAME and IS_PRIMARY values.
+_ISOFORM_COLUMNS = ('ISOFORM_NAME', 'IS_PRIMARY')
+
+# Compiled row parsers, by (column names, binary)
+_ROW_PARSERS = {}
+
+def _header_columns(header):
+    '''
+    Return the column names of a MochiView header line, normalized to upper
+    case, or None if the line does not name the SEQ_NAME column (and so is
+    taken to have the standard layout)
+    '''
+    if (header == None):
+        return None
+    if isinstance(header, bytes):
+        header = header.decode('utf-8', 'replace')
+    columns = tuple(name.strip().upper() for name in header.rstrip('\r\n').split('\t'))
+    if ('SEQ_NAME' not in columns):
+        return None
+    return columns
+
+def _compile_row_parser(columns, binary=False):
+    '''
+    Generate the source of a parser for rows laid out as 'columns', and
+    compile it. The parser returns the same list as _parse_row(), with the
+    positions of this layout written into the code as constants. As in
+    _parse_row(), the line is stripped with rstrip(), and blank cells at
+    the end of the line that this removes are read as empty. Missing
+    columns get defaults: STRAND '+', TXN_START/TXN_END those of the gene,
+    EXON_COUNT the number of exons, CDS_START/CDS_END None (non-coding),
+    and GENE_NAME/ALIASES/DESCRIPTION None (the attribute is left out). If
+    the layout has isoform columns, ISOFORM_NAME and IS_PRIMARY are
+    appended (None when missing) unless 'binary', as only the str path
+    groups isoforms. Other columns are ignored.
+    '''
+    positions = {}
+    for i, name in enumerate(columns):
+        if (name in positions):
+            raise ValueError("MochiView header names the {} column more than once".format(name))
+        positions[name] = i
+    missing = [name for name in _REQUIRED_COLUMNS if (name not in positions)]
+    if missing:
+        raise ValueError("MochiView header is missing the {} column(s)".format(', '.join(missing)))
+    if (('CDS_START' in positions) != ('CDS_END' in positions)):
+        raise ValueError("MochiView header must name both CDS_START and CDS_END, or neither")
+    
+    literal = (lambda text: repr(text.encode('ascii'))) if binary else repr
+    column = lambda name: 'sline[{}]'.format(positions[name])
+    names = _COLUMNS
+    if ((not binary) and any((name in positions) for name in _ISOFORM_COLUMNS)):
+        names += _ISOFORM_COLUMNS
+    values = []
+    for name in names:
+        if (name == 'EXON_STARTS'):
+            values.append('exon_starts')
+        elif (name == 'EXON_ENDS'):
+            values.append('list(map(int, {}.split({})))'.format(column(name), literal('|')))
+        elif (name in ('CDS_START', 'CDS_END')) and (name in positions):
+            values.append('int({0}) if ({0} != {1}) else None'.format(column(name), literal('')))
+        elif (name in ('START', 'END', 'TXN_START', 'TXN_END', 'EXON_COUNT')) and (name in positions):
+            values.append('int({})'.format(column(name)))
+        elif (name in positions):
+            values.append(column(name))
+        elif (name == 'TXN_START'):
+            values.append('int({})'.format(column('START')))
+        elif (name == 'TXN_END'):
+            values.append('int({})'.format(column('END')))
+        elif (name == 'EXON_COUNT'):
+            values.append('len(exon_starts)')
+        elif (name == 'STRAND'):
+            values.append(literal('+'))
+        else:
+            values.append('None')
+    last_required = max(positions[name] for name in _REQUIRED_COLUMNS)
+    code = '\n'.join([
+        'def parse_row(line):',
+        '    sline = line.rstrip().split({})'.format(literal('\t')),
+        '    if ({} < len(sline) < {}):'.format(last_required, len(columns)),
+        '        sline += [{}] * ({} - len(sline))'.format(literal(''), len(columns)),
+        '    exon_starts = list(map(int, {}.split({})))'.format(column('EXON_STARTS'), literal('|')),
+        '    return [',
+    ] + ['        {},'.format(value) for value in values] + [
+        '    ]',
+    ])
+    namespace = {}
+    exec(compile(code, '<row parser {}>'.format(','.join(columns)), 'exec'), namespace)
+    return namespace['parse_row']
+
+def row_parser(header, binary=False):
+    '''
+    Return the function that parses data rows of a MochiView file with the
+    given 'header' line into the list _parse_row() returns. The standard
+    layout (including one with extra columns after DESCRIPTION, other than
+    the isoform columns) and headers that do not name the columns use
+    _parse_row() itself, or _parse_bytes_row() if 'binary', for rows given
+    as bytes. Any other layout gets a parser compiled for it once, which is
+    then reused. Raises ValueError if the header lacks a required column.
+    '''
+    columns = _header_columns(header)
+    if ((columns == None) or ((columns[:len(_COLUMNS)] == _COLUMNS) and
+            not any((name in columns) for name in _ISOFORM_COLUMNS))):
+        return _parse_bytes_row if binary else _parse_row
+    parser = _ROW_PARSERS.get((columns, binary))
+    if (parser == None):
+        parser = _ROW_PARSERS[(columns, binary)] = _compile_row_parser(columns, binary)
+    return parser
+
+# _parse_row() for rows given as UTF-8 bytes, used by the 'bytes' engine
+_parse_bytes_row = _compile_row_parser(_COLUMNS, binary=True)
+
+def _row_features(line, source, parse_row=_parse_row):
+    '''
+    Generator that parses one MochiView data line and yields its GFF features
+    as gff_feature records, in gene, mRNA, exon, CDS, UTR order. Pass a
+    parser from row_parser() as 'parse_row' for other column layouts.
+    '''
+    return _parsed_row_features(parse_row(line), source)
+
+def _parsed_row_features(sline, source, isoform=0, escape=_escape_text):
+    '''
+    Generator yielding the GFF features of a row parsed by _parse_row(). The
+    row is checked with _row_problems() before anything is yielded, so a
+    bad row raises invalid_row and never produces a partial gene.
+    
+    With 'isoform' k > 0 the row is the k-th transcript of a gene with
+    several (see _gene_features()): no gene line is yielded, the transcript
+    ID is FEATURE_NAME-Tk, the transcript and its parts are named by its
+    ISOFORM_NAME if it has one, and the CDS and UTR IDs are based on the
+    transcript ID instead of the gene ID.
+    
+    'escape' is the function escaping the DESCRIPTION (see
+    _row_attributes()).
+    '''
+    problems = _row_problems(sline)
+    if problems:
+        raise invalid_row(problems, sline[FEATURE_NAME])
+    
+    if isoform:
+        name = sline[GENE_NAME]
+        if ((len(sline) > ISOFORM_NAME) and sline[ISOFORM_NAME]):
+            name = sline[ISOFORM_NAME]
+        gene_id, transcript_id, id_prefix, note_attributes, child_attributes = _row_attributes(
+            sline[FEATURE_NAME], name, sline[ALIASES], sline[DESCRIPTION], isoform, escape)
+        part_id = transcript_id
+    else:
+        gene_id, transcript_id, id_prefix, note_attributes, child_attributes = _row_attributes(
+            sline[FEATURE_NAME], sline[GENE_NAME], sline[ALIASES], sline[DESCRIPTION], escape=escape)
+        part_id = gene_id
+    
+    # Make sure CDS_START and CDS_END are in ascending order
+    if (sline[CDS_START] != None):
+        s_cds_start, s_cds_end = sorted([sline[CDS_START], sline[CDS_END]])
+    # We assume the EXON_STARTS and EXON_ENDS are properly sorted
+    # We make sure they are in ascending order also
+    if (sline[STRAND] == '+'):
+        s_exon_starts = sline[EXON_STARTS]
+        s_exon_ends = sline[EXON_ENDS]
+    else:
+        s_exon_starts = sline[EXON_ENDS][::-1]
+        s_exon_ends = sline[EXON_STARTS][::-1]
+    
+    ##### gene #####
+    seqid = sys.intern(sline[SEQ_NAME])
+    #source = 'MochiViewConverter'
+    strand = sys.intern(sline[STRAND])
+    if not isoform:
+        attributes = id_prefix + gene_id + note_attributes
         
-        # Process the line
-        line = line.rstrip()
-        sline = line.split("\t")
-        sline = [
-            sline[SEQ_NAME],
-            int(sline[START]),
-            int(sline[END]),
-            sline[STRAND],
-            sline[FEATURE_NAME],
-            int(sline[TXN_START]),
-            int(sline[TXN_END]),
-            int(sline[EXON_COUNT]),
-            list(map(int, sline[EXON_STARTS].split('|'))),
-            list(map(int, sline[EXON_ENDS].split('|'))),
-            int(sline[CDS_START]) if (sline[CDS_START] != '') else None,
-            int(sline[CDS_END]) if (sline[CDS_END] != '') else None,
-            sline[GENE_NAME],
-            sline[ALIASES],
-            sline[DESCRIPTION],
-        ]
+        yield gff_feature(seqid, source, 'gene', sline[START], sline[END], '.', strand, '.', attributes)
+    
+    ##### mRNA #####
+    type = 'mRNA' if (sline[CDS_START] != None) else 'RNA'
+    attributes = id_prefix + transcript_id + ';' + _ATTR_PREFIXES['Parent'] + gene_id + note_attributes
+    
+    yield gff_feature(seqid, source, type, sline[TXN_START], sline[TXN_END], '.', strand, '.', attributes)
+    
+    ##### exon #####
+    exon_prefix = id_prefix + transcript_id + '-E'
+    for i in range(sline[EXON_COUNT]):
+        if (strand == '+'):
+            attributes = exon_prefix + str(i+1) + child_attributes
+        elif (strand == '-'):
+            attributes = exon_prefix + str(sline[EXON_COUNT]-i) + child_attributes
         
-        # Initialize feature list
-        self.features = []
+        yield gff_feature(seqid, source, 'exon', s_exon_starts[i], s_exon_ends[i], '.', strand, '.', attributes)
+    
+    # Add one CDS for every exon if it is a protein-coding gene
+    if (sline[CDS_START] != None):
+        attributes = id_prefix + part_id + '-P' + child_attributes
+        if (sline[EXON_COUNT] == 1):
+            yield gff_feature(seqid, source, 'CDS', s_cds_start, s_cds_end, '.', strand, 0, attributes)
+            
+        else:
+            # Truncate the first exon if needed
+            # Truncate the last exon if needed
+            # If there are any in the middle, the keep the entire exon as a CDS
+            for i in range(len(sline[EXON_STARTS])):
+                if ((s_cds_start < s_exon_ends[i]) and (s_exon_starts[i] < s_cds_end)):
+                    
+                    if (s_exon_starts[i] < s_cds_start < s_exon_ends[i]):
+                        start = s_cds_start
+                    else:
+                        start = s_exon_starts[i]
+                    
+                    if (start < s_cds_end < s_exon_ends[i]):
+                        end = s_cds_end
+                    else:
+                        end = s_exon_ends[i]
+                    
+                    yield gff_feature(seqid, source, 'CDS', start, end, '.', strand, 0, attributes)
         
-        base_attributes = {}
-        if (sline[GENE_NAME] != ''):
-            base_attributes['Name'] = sline[GENE_NAME]
+        # Add upstream 5'(+)/3'(-) UTR
+        if (sline[TXN_START] < s_cds_start):
+            if (strand == '+'):
+                type = 'five_prime_UTR'
+                attributes = id_prefix + part_id + '-5' + child_attributes
+            elif (strand == '-'):
+                type = 'three_prime_UTR'
+                attributes = id_prefix + part_id + '-3' + child_attributes
+            
+            yield gff_feature(seqid, source, type, sline[TXN_START], s_cds_start-1, '.', strand, '.', attributes)
         
-        # Make sure CDS_START and CDS_END are in ascending order
+        # Add downstream 3'(+)/5'(-) UTR
+        if (s_cds_end < sline[TXN_END]):
+            if (strand == '+'):
+                type = 'three_prime_UTR'
+                attributes = id_prefix + part_id + '-3' + child_attributes
+            elif (strand == '-'):
+                type = 'five_prime_UTR'
+                attributes = id_prefix + part_id + '-5' + child_attributes
+            
+            yield gff_feature(seqid, source, type, s_cds_end+1, sline[TXN_END], '.', strand, '.', attributes)
+
+# IS_PRIMARY values that mark the primary isoform of a gene
+_PRIMARY_VALUES = frozenset(['1', 'y', 'yes', 't', 'true', 'primary'])
+
+def _is_primary(sline):
+    return ((len(sline) > IS_PRIMARY) and (sline[IS_PRIMARY] != None) and
+        (sline[IS_PRIMARY].strip().lower() in _PRIMARY_VALUES))
+
+def _gene_features(rows, source):
+    '''
+    Generator yielding the GFF features of one gene from the parsed rows of
+    all its isoforms. A gene with one row gives the same features as
+    _parsed_row_features(). Otherwise there is one gene line spanning every
+    isoform, described by the primary one (IS_PRIMARY), followed by each
+    isoform's transcript and parts, numbered 1, 2, ... with the primary
+    isoforms first and the rest in input order. Every row is checked before
+    anything is yielded.
+    '''
+    if (len(rows) == 1):
+        yield from _parsed_row_features(rows[0], source)
+        return
+    rows = sorted(rows, key=lambda sline: not _is_primary(sline))
+    first = rows[0]
+    isoforms = [_parsed_row_features(sline, source, k) for k, sline in enumerate(rows, 1)]
+    transcripts = [next(features) for features in isoforms]
+    for sline in rows:
+        if ((sline[SEQ_NAME] != first[SEQ_NAME]) or (sline[STRAND] != first[STRAND])):
+            raise invalid_row([('isoforms', "Isoforms of {} are on different sequences or strands".format(first[FEATURE_NAME]))],
+                first[FEATURE_NAME])
+    
+    gene_id, transcript_id, id_prefix, note_attributes, child_attributes = _row_attributes(
+        first[FEATURE_NAME], first[GENE_NAME], first[ALIASES], first[DESCRIPTION])
+    yield gff_feature(transcripts[0].seqid, source, 'gene', min(sline[START] for sline in rows), max(sline[END] for sline in rows),
+        '.', transcripts[0].strand, '.', id_prefix + gene_id + note_attributes)
+    for transcript, features in zip(transcripts, isoforms):
+        yield transcript
+        yield from features
+
+# GTF feature types of the GFF3 types
+_GTF_TYPES = {
+    'gene': 'gene',
+    'mRNA': 'transcript',
+    'RNA': 'transcript',
+    'exon': 'exon',
+    'CDS': 'CDS',
+    'five_prime_UTR': 'five_prime_utr',
+    'three_prime_UTR': 'three_prime_utr',
+}
+
+def _gtf_value(text):
+    '''
+    Quote a GTF attribute value. GTF has no escaping rules of its own, so
+    backslashes and double quotes are escaped with a backslash, as most
+    parsers expect.
+    '''
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+class feature_parser(object):
+    '''
+    The gene model of one MochiView data line: its parsed row and GFF
+    features, built once and then written in any of the output formats
+    (see convert_formats()). IDs are the same in every format.
+    '''
+    def __init__(self, line, source, parse_row=_parse_row):
+        self.row = parse_row(line)
+        self.features = list(_parsed_row_features(self.row, source))
+    
+    def _escape_text(self, text):
+        return _escape_text(text)
+    
+    def _join_attributes(self, attributes):
+        return _join_attributes(attributes)
+    
+    def __str__(self):
+        return '\n'.join(map(_format_feature, self.features))
+    
+    def batch(self, batch=None):
+        '''
+        Add the features of the gene to the feature_batch 'batch', or to a
+        new one if None, and return it
+        '''
+        if (batch == None):
+            batch = feature_batch()
+        batch.extend(self.features)
+        return batch
+    
+    def gff_lines(self):
+        '''
+        GFF3 lines of the gene, as written by convert()
+        '''
+        return list(map(str, self.features))
+    
+    def gtf_lines(self):
+        '''
+        GTF lines of the gene: the gene, transcript, exon, CDS and UTR
+        features with gene_id, transcript_id, gene_name and exon_number
+        attributes
+        '''
+        sline = self.row
+        gene_id = 'gene_id ' + _gtf_value(sline[FEATURE_NAME]) + ';'
+        if sline[GENE_NAME]:
+            gene_name = ' gene_name ' + _gtf_value(sline[GENE_NAME]) + ';'
+        else:
+            gene_name = ''
+        transcript_attributes = gene_id + ' transcript_id ' + _gtf_value(sline[FEATURE_NAME] + '-T') + ';' + gene_name
+        exon_count = sline[EXON_COUNT]
+        exon = 0
+        lines = []
+        for f in self.features:
+            if (f.type == 'gene'):
+                attributes = gene_id + gene_name
+            elif (f.type == 'exon'):
+                # Exons are numbered in transcript order, as in the GFF IDs
+                exon += 1
+                number = exon if (f.strand == '+') else exon_count - exon + 1
+                attributes = transcript_attributes + ' exon_number "' + str(number) + '";'
+            else:
+                attributes = transcript_attributes
+            lines.append(f.seqid + '\t' + f.source + '\t' + _GTF_TYPES[f.type] + '\t' + str(f.start) + '\t' + str(f.end) +
+                '\t' + f.score + '\t' + f.strand + '\t' + str(f.phase) + '\t' + attributes)
+        return lines
+    
+    def bed_lines(self):
+        '''
+        BED12 line of the transcript: 0-based half-open coordinates, the
+        exons as blocks, and the CDS as the thick part (empty for genes
+        without a CDS). Named by FEATURE_NAME.
+        '''
+        sline = self.row
+        exons = [f for f in self.features if (f.type == 'exon')]
+        chrom_start = exons[0].start - 1
+        chrom_end = exons[-1].end
         if (sline[CDS_START] != None):
-            s_cds_start, s_cds_end = sorted([sline[CDS_START], sline[CDS_END]])
-        # We assume the EXON_STARTS and EXON_ENDS are properly sorted
-        # We make sure they are in ascending order also
-        if (sline[STRAND] == '+'):
-            s_exon_starts = sline[EXON_STARTS]
-            s_exon_ends = sline[EXON_ENDS]
-        elif (sline[STRAND] == '-'):
-            s_exon_starts = sline[EXON_ENDS][::-1]
-            s_exon_ends = sline[EXON_STARTS][::-1]
+            thick_start, thick_end = sorted([sline[CDS_START], sline[CDS_END]])
+            thick_start -= 1
+        else:
+            thick_start = thick_end = chrom_start
+        sizes = ''.join([str(f.end - f.start + 1) + ',' for f in exons])
+        starts = ''.join([str(f.start - 1 - chrom_start) + ',' for f in exons])
+        return [exons[0].seqid + '\t' + str(chrom_start) + '\t' + str(chrom_end) + '\t' + sline[FEATURE_NAME] + '\t0\t' +
+            exons[0].strand + '\t' + str(thick_start) + '\t' + str(thick_end) + '\t0\t' + str(len(exons)) + '\t' + sizes +
+            '\t' + starts]
+
+# Output formats of convert_formats(), and the gene model method that
+# writes each
+OUTPUT_FORMATS = {
+    'gff': feature_parser.gff_lines,
+    'gtf': feature_parser.gtf_lines,
+    'bed': feature_parser.bed_lines,
+}
+
+def _numpy_module():
+    '''
+    Import and return NumPy, or return None if it is not installed
+    '''
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def _numpy_features(lines, source, batch_size=4096, parse_row=_parse_row, validator=None):
+    '''
+    Batch engine behind iter_features(engine='numpy'). Rows are parsed in
+    batches of 'batch_size' into flat NumPy arrays (exon coordinates plus
+    per-row offsets), and the strand reversal, exon numbering, CDS clipping
+    and UTR spans are computed with vectorized operations before the
+    features are serialized row by row. Produces exactly the same records as
+    _row_features(). A row that cannot be parsed or fails _row_problems()
+    is passed to _row_features() after the preceding rows have been
+    yielded, so errors surface at the same point as on the pure-Python
+    path, and go to 'validator' the same way.
+    '''
+    batch = []
+    for line_number, line in enumerate(lines, 2):
+        try:
+            row = parse_row(line)
+            if _row_problems(row):
+                row = None
+        except (ValueError, IndexError):
+            row = None
+        if (row == None):
+            yield from _numpy_batch(batch, source)
+            batch = []
+            try:
+                features = list(_row_features(line, source, parse_row))
+            except (ValueError, IndexError) as e:
+                if (validator == None):
+                    raise
+                validator.problem(line_number, line, e)
+            else:
+                yield from features
+            continue
+        batch.append(row)
+        if (len(batch) >= batch_size):
+            yield from _numpy_batch(batch, source)
+            batch = []
+    yield from _numpy_batch(batch, source)
+
+def _numpy_batch(rows, source):
+    '''
+    Vectorized conversion of a list of parsed rows (see _numpy_features)
+    '''
+    if (len(rows) == 0):
+        return
+    import numpy as np
+    n = len(rows)
+    
+    # Per-row columns
+    counts = np.fromiter((r[EXON_COUNT] for r in rows), dtype=np.int64, count=n)
+    minus = np.fromiter((r[STRAND] == '-' for r in rows), dtype=bool, count=n)
+    coding = np.fromiter((r[CDS_START] != None for r in rows), dtype=bool, count=n)
+    cds_a = np.fromiter((r[CDS_START] if (r[CDS_START] != None) else 0 for r in rows), dtype=np.int64, count=n)
+    cds_b = np.fromiter((r[CDS_END] if (r[CDS_END] != None) else 0 for r in rows), dtype=np.int64, count=n)
+    cds_start = np.minimum(cds_a, cds_b)
+    cds_end = np.maximum(cds_a, cds_b)
+    txn_start = np.fromiter((r[TXN_START] for r in rows), dtype=np.int64, count=n)
+    txn_end = np.fromiter((r[TXN_END] for r in rows), dtype=np.int64, count=n)
+    
+    # Flat exon columns, as listed in the file
+    raw_starts = np.fromiter(itertools.chain.from_iterable([r[EXON_STARTS] for r in rows]), dtype=np.int64)
+    raw_ends = np.fromiter(itertools.chain.from_iterable([r[EXON_ENDS] for r in rows]), dtype=np.int64)
+    offsets = np.zeros(n+1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    exon_row = np.repeat(np.arange(n), counts)
+    exon_index = np.arange(len(raw_starts)) - offsets[exon_row]
+    exon_minus = minus[exon_row]
+    
+    # Minus-strand exons are listed 5'->3' with EXON_STARTS holding the
+    # higher coordinate, so swap the columns and reverse them
+    reverse = offsets[exon_row] + counts[exon_row] - 1 - exon_index
+    exon_starts = np.where(exon_minus, raw_ends[reverse], raw_starts)
+    exon_ends = np.where(exon_minus, raw_starts[reverse], raw_ends)
+    exon_number = np.where(exon_minus, counts[exon_row] - exon_index, exon_index + 1)
+    
+    # CDS pieces for multi-exon coding rows: exons overlapping the CDS,
+    # clipped to its bounds
+    e_cds_start = cds_start[exon_row]
+    e_cds_end = cds_end[exon_row]
+    cds_piece = (coding & (counts > 1))[exon_row] & (e_cds_start < exon_ends) & (exon_starts < e_cds_end)
+    piece_starts = np.where((exon_starts < e_cds_start) & (e_cds_start < exon_ends), e_cds_start, exon_starts)
+    piece_ends = np.where((piece_starts < e_cds_end) & (e_cds_end < exon_ends), e_cds_end, exon_ends)
+    
+    # UTR spans
+    upstream_utr = coding & (txn_start < cds_start)
+    downstream_utr = coding & (cds_end < txn_end)
+    
+    offsets = offsets.tolist()
+    exon_starts = exon_starts.tolist()
+    exon_ends = exon_ends.tolist()
+    exon_number = exon_number.tolist()
+    cds_piece = cds_piece.tolist()
+    piece_starts = piece_starts.tolist()
+    piece_ends = piece_ends.tolist()
+    cds_start = cds_start.tolist()
+    cds_end = cds_end.tolist()
+    upstream_utr = upstream_utr.tolist()
+    downstream_utr = downstream_utr.tolist()
+    
+    for r, row in enumerate(rows):
+        gene_id, transcript_id, id_prefix, note_attributes, child_attributes = _row_attributes(
+            row[FEATURE_NAME], row[GENE_NAME], row[ALIASES], row[DESCRIPTION])
+        seqid = sys.intern(row[SEQ_NAME])
+        strand = sys.intern(row[STRAND])
+        is_coding = (row[CDS_START] != None)
         
-        ##### gene #####
-        seqid = sline[SEQ_NAME]
-        #source = 'MochiViewConverter'
-        type = 'gene'
-        start = sline[START]
-        end = sline[END]
-        score = '.'
-        strand = sline[STRAND]
-        phase = '.'
-        attributes = base_attributes.copy()
-        attributes['ID'] = sline[FEATURE_NAME]
-        attributes['Alias'] = ','.join(sline[ALIASES].split('|'))
-        attributes['Note'] = self._escape_text(sline[DESCRIPTION])
+        yield gff_feature(seqid, source, 'gene', row[START], row[END], '.', strand, '.', id_prefix + gene_id + note_attributes)
+        yield gff_feature(seqid, source, 'mRNA' if is_coding else 'RNA', row[TXN_START], row[TXN_END], '.', strand, '.',
+            id_prefix + transcript_id + ';' + _ATTR_PREFIXES['Parent'] + gene_id + note_attributes)
         
-        self.features.append((seqid, source, type, start, end, score, strand, phase, self._join_attributes(attributes)))
+        exon_prefix = id_prefix + transcript_id + '-E'
+        first, last = offsets[r], offsets[r+1]
+        for j in range(first, last):
+            yield gff_feature(seqid, source, 'exon', exon_starts[j], exon_ends[j], '.', strand, '.', exon_prefix + str(exon_number[j]) + child_attributes)
         
-        ##### mRNA #####
-        type = 'mRNA' if (sline[CDS_START] != None) else 'RNA'
-        start = sline[TXN_START]
-        end = sline[TXN_END]
-        score = '.'
-        strand = sline[STRAND]
-        phase = '.'
-        attributes = base_attributes.copy()
-        attributes['ID'] = sline[FEATURE_NAME]+'-T'
-        attributes['Parent'] = sline[FEATURE_NAME]
-        attributes['Alias'] = ','.join(sline[ALIASES].split('|'))
-        attributes['Note'] = self._escape_text(sline[DESCRIPTION])
+        if is_coding:
+            attributes = id_prefix + gene_id + '-P' + child_attributes
+            if (last - first == 1):
+                yield gff_feature(seqid, source, 'CDS', cds_start[r], cds_end[r], '.', strand, 0, attributes)
+            else:
+                for j in range(first, last):
+                    if cds_piece[j]:
+                        yield gff_feature(seqid, source, 'CDS', piece_starts[j], piece_ends[j], '.', strand, 0, attributes)
+            
+            if upstream_utr[r]:
+                if (strand == '+'):
+                    yield gff_feature(seqid, source, 'five_prime_UTR', row[TXN_START], cds_start[r]-1, '.', strand, '.', id_prefix + gene_id + '-5' + child_attributes)
+                else:
+                    yield gff_feature(seqid, source, 'three_prime_UTR', row[TXN_START], cds_start[r]-1, '.', strand, '.', id_prefix + gene_id + '-3' + child_attributes)
+            if downstream_utr[r]:
+                if (strand == '+'):
+                    yield gff_feature(seqid, source, 'three_prime_UTR', cds_end[r]+1, row[TXN_END], '.', strand, '.', id_prefix + gene_id + '-3' + child_attributes)
+                else:
+                    yield gff_feature(seqid, source, 'five_prime_UTR', cds_end[r]+1, row[TXN_END], '.', strand, '.', id_prefix + gene_id + '-5' + child_attributes)
+
+def _format_feature(feature):
+    '''
+    Serialize one feature record into a GFF line (without the newline)
+    '''
+    if isinstance(feature, gff_feature):
+        return str(feature)
+    return '\t'.join(map(str, feature))
+
+def iter_features(lines, source, engine='python', parse_row=_parse_row, validator=None):
+    '''
+    Generator that lazily yields the GFF feature records for each MochiView
+    data line in 'lines'. The header line must already have been consumed;
+    pass row_parser(header) as 'parse_row' if it may not be the standard
+    layout. Bad rows raise invalid_row (or ValueError/IndexError if they
+    cannot be parsed), unless a row_validator is given, which is passed
+    each one with its line number.
+    
+    'engine' is 'python' (row at a time), 'numpy' (vectorized batches) or
+    'auto' (the fastest engine, currently 'python': in benchmark.py the
+    numpy engine is no faster on large inputs and uses twice the memory).
+    Both engines produce identical output; 'numpy' falls back to 'python'
+    when NumPy is not installed. The 'bytes' engine does not produce
+    records (see convert_bytes()), so it is treated as 'python' here. See
+    iter_feature_batches() to hold many features in memory.
+    '''
+    source = sys.intern(source)
+    if ((engine == 'numpy') and (_numpy_module() != None)):
+        yield from _numpy_features(lines, source, parse_row=parse_row, validator=validator)
+    elif (validator != None):
+        for line_number, line in enumerate(lines, 2):
+            try:
+                features = list(_parsed_row_features(parse_row(line), source))
+            except (ValueError, IndexError) as e:
+                validator.problem(line_number, line, e)
+                continue
+            yield from features
+    else:
+        for line in lines:
+            yield from _parsed_row_features(parse_row(line), source)
+
+def iter_feature_batches(lines, source, batch_size=65536, engine='python', parse_row=_parse_row, validator=None):
+    '''
+    Generator like iter_features(), but yielding the features in
+    feature_batch containers of up to 'batch_size' features each, which
+    hold them in far less memory than the records themselves
+    '''
+    batch = feature_batch()
+    for feature in iter_features(lines, source, engine, parse_row, validator):
+        batch.append(feature)
+        if (len(batch) == batch_size):
+            yield batch
+            batch = feature_batch()
+    if len(batch):
+        yield batch
+
+def write_features(features, outfile, buffer_size=1024*1024):
+    '''
+    Write feature records to the 'outfile' text stream. Lines are collected
+    and written in batches of roughly 'buffer_size' characters instead of one
+    write per row. Whatever has been collected is still written if the
+    'features' iterable raises.
+    '''
+    buf = []
+    size = 0
+    try:
+        for feature in features:
+            line = _format_feature(feature)
+            buf.append(line)
+            size += len(line)
+            if (size >= buffer_size):
+                buf.append('')
+                outfile.write('\n'.join(buf))
+                buf = []
+                size = 0
+    finally:
+        if buf:
+            buf.append('')
+            outfile.write('\n'.join(buf))
+
+def convert(infile, outfile, source, engine='python', stats=None, profile_rows=0, grouper=None, validator=None, sequence_lengths=None):
+    '''
+    Convert the MochiView annotation text stream 'infile' (including its
+    header line) to GFF, written to the text stream 'outfile'. The columns
+    are found by the names in the header line. Pass a conversion_stats as
+    'stats' to instrument the conversion, or an isoform_grouper as
+    grouper' to merge the isoforms of each gene (always with the Python
+    engine). The two cannot be combined. Bad rows are handled by the
+    row_validator 'validator' if given, or raise. Given a dict of sequence
+    lengths as 'sequence_lengths' (see fasta_index), rows on other
+    sequences or past their end are bad too.
+    '''
+    if (stats != None):
+        if (grouper != None):
+            raise ValueError("grouped conversion cannot be instrumented")
+        _convert_instrumented(infile, outfile, source, stats, profile_rows, validator, sequence_lengths)
+        return
+    parse_row = row_parser(next(infile, None))
+    if (sequence_lengths != None):
+        parse_row = _bounded_row_parser(parse_row, sequence_lengths)
+    if (grouper != None):
+        features = grouper.features(infile, source, parse_row, validator)
+    else:
+        features = iter_features(infile, source, engine, parse_row, validator)
+    write_features(features, outfile)
+
+def convert_formats(infile, outfiles, source, validator=None, batch_rows=1000, sequence_lengths=None):
+    '''
+    Convert the MochiView annotation text stream 'infile' (including its
+    header line) to several formats in one pass. 'outfiles' maps names of
+    OUTPUT_FORMATS to text streams, e.g. {'gff': out, 'bed': bed}. Each row
+    is parsed, checked and built into a feature_parser gene model once,
+    and every writer reads that model; lines are written in batches of
+    'batch_rows' rows. Bad rows are handled by the row_validator
+    'validator' if given, or raise. 'sequence_lengths' is as for convert().
+    '''
+    parse_row = row_parser(next(infile, None))
+    if (sequence_lengths != None):
+        parse_row = _bounded_row_parser(parse_row, sequence_lengths)
+    source = sys.intern(source)
+    writers = [(OUTPUT_FORMATS[name], outfile, []) for name, outfile in outfiles.items()]
+    
+    def flush():
+        for lines_of, outfile, buf in writers:
+            if buf:
+                buf.append('')
+                outfile.write('\n'.join(buf))
+                buf.clear()
+    
+    rows = 0
+    try:
+        for line_number, line in enumerate(infile, 2):
+            try:
+                model = feature_parser(line, source, parse_row)
+            except (ValueError, IndexError) as e:
+                if (validator == None):
+                    raise
+                validator.problem(line_number, line, e)
+                continue
+            for lines_of, outfile, buf in writers:
+                buf.extend(lines_of(model))
+            rows += 1
+            if (rows == batch_rows):
+                flush()
+                rows = 0
+    finally:
+        flush()
+
+# Byte-level counterparts of the escaping table and attribute prefixes, for
+# the 'bytes' engine. Only ASCII characters are ever escaped, so UTF-8
+# encoded descriptions can be escaped byte by byte.
+_ESCAPE_BYTES_PATTERN = re.compile(b'[' + re.escape(bytes(sorted(_ESCAPE_TABLE))) + b']')
+_ATTR_PREFIXES_BYTES = {k: v.encode('ascii') for k, v in _ATTR_PREFIXES.items()}
+
+def _escape_bytes(text):
+    '''
+    _escape_text() for UTF-8 encoded bytes. The translation goes through
+    latin-1, which maps every byte to the code point of the same value and
+    back, so multi-byte characters pass through untouched.
+    '''
+    if (_ESCAPE_BYTES_PATTERN.search(text) is None):
+        return text
+    return text.decode('latin-1').translate(_ESCAPE_TABLE).encode('latin-1')
+
+def _text_row(line, source, parse_row=_parse_row):
+    '''
+    Convert one data line of the 'bytes' engine through the str path
+    '''
+    return ''.join([str(f) + '\n' for f in _row_features(line.decode('utf-8'), source.decode('utf-8'), parse_row)]).encode('utf-8')
+
+def _bytes_row(line, source, parse_row=_parse_bytes_row, parse_text=_parse_row):
+    '''
+    Convert one MochiView data line, as UTF-8 bytes, straight to the bytes
+    of its GFF lines. Follows _parsed_row_features() feature for feature.
+    Bad rows, rows this cannot parse, and rows ending in characters that
+    str.rstrip() strips but bytes.rstrip() does not, go through
+    _text_row() instead, so output and errors are the same as with the
+    'python' engine. 'parse_row' and 'parse_text' are the bytes and
+    str parsers for the file's column layout.
+    '''
+    line = line.rstrip()
+    last = line[-1:]
+    if ((last >= b'\x80') or (b'\x1c' <= last <= b'\x1f')):
+        return _text_row(line, source, parse_text)
+    try:
+        row = parse_row(line)
+        problems = _row_problems(row)
+    except (ValueError, IndexError):
+        problems = True
+    if problems:
+        return _text_row(line, source, parse_text)
+    (seqid, start, end, strand, feature_name, txn_start, txn_end, exon_count, exon_starts, exon_ends,
+        cds_start, cds_end, gene_name, aliases, description) = row
+    
+    prefixes = _ATTR_PREFIXES_BYTES
+    if gene_name:
+        id_prefix = prefixes['Name'] + gene_name + b';' + prefixes['ID']
+    else:
+        id_prefix = prefixes['ID']
+    note_attributes = b''
+    if (aliases != None):
+        note_attributes += b';' + prefixes['Alias'] + aliases.replace(b'|', b',')
+    if (description != None):
+        note_attributes += b';' + prefixes['Note'] + _escape_bytes(description)
+    transcript_id = feature_name + b'-T'
+    child_attributes = b';' + prefixes['Parent'] + transcript_id
+    if (strand == b'+'):
+        s_exon_starts = exon_starts
+        s_exon_ends = exon_ends
+    else:
+        s_exon_starts = exon_ends[::-1]
+        s_exon_ends = exon_starts[::-1]
+    
+    head = seqid + b'\t' + source + b'\t'
+    tail = b'\t.\t' + strand + b'\t'
+    out = [
+        head, b'gene\t%d\t%d' % (start, end), tail, b'.\t', id_prefix, feature_name, note_attributes, b'\n',
+        head, b'mRNA' if (cds_start != None) else b'RNA', b'\t%d\t%d' % (txn_start, txn_end), tail, b'.\t',
+            id_prefix, transcript_id, b';', prefixes['Parent'], feature_name, note_attributes, b'\n',
+    ]
+    append = out.append
+    
+    exon_prefix = id_prefix + transcript_id + b'-E'
+    for i in range(exon_count):
+        number = (i+1) if (strand == b'+') else (exon_count-i)
+        append(head + b'exon\t%d\t%d' % (s_exon_starts[i], s_exon_ends[i]) + tail + b'.\t' + exon_prefix + b'%d' % number + child_attributes + b'\n')
+    
+    if (cds_start != None):
+        s_cds_start, s_cds_end = sorted([cds_start, cds_end])
+        cds_tail = tail + b'0\t' + id_prefix + feature_name + b'-P' + child_attributes + b'\n'
+        if (exon_count == 1):
+            append(head + b'CDS\t%d\t%d' % (s_cds_start, s_cds_end) + cds_tail)
+        else:
+            for i in range(len(exon_starts)):
+                if ((s_cds_start < s_exon_ends[i]) and (s_exon_starts[i] < s_cds_end)):
+                    if (s_exon_starts[i] < s_cds_start < s_exon_ends[i]):
+                        cds_from = s_cds_start
+                    else:
+                        cds_from = s_exon_starts[i]
+                    if (cds_from < s_cds_end < s_exon_ends[i]):
+                        cds_to = s_cds_end
+                    else:
+                        cds_to = s_exon_ends[i]
+                    append(head + b'CDS\t%d\t%d' % (cds_from, cds_to) + cds_tail)
         
-        self.features.append((seqid, source, type, start, end, score, strand, phase, self._join_attributes(attributes)))
+        if (txn_start < s_cds_start):
+            if (strand == b'+'):
+                append(head + b'five_prime_UTR\t%d\t%d' % (txn_start, s_cds_start-1) + tail + b'.\t' + id_prefix + feature_name + b'-5' + child_attributes + b'\n')
+            else:
+                append(head + b'three_prime_UTR\t%d\t%d' % (txn_start, s_cds_start-1) + tail + b'.\t' + id_prefix + feature_name + b'-3' + child_attributes + b'\n')
+        if (s_cds_end < txn_end):
+            if (strand == b'+'):
+                append(head + b'three_prime_UTR\t%d\t%d' % (s_cds_end+1, txn_end) + tail + b'.\t' + id_prefix + feature_name + b'-3' + child_attributes + b'\n')
+            else:
+                append(head + b'five_prime_UTR\t%d\t%d' % (s_cds_end+1, txn_end) + tail + b'.\t' + id_prefix + feature_name + b'-5' + child_attributes + b'\n')
+    
+    return b''.join(out)
+
+def _convert_bytes_lines(lines, source, header=None):
+    '''
+    Convert a batch of MochiView data lines given as bytes, from a file
+    with the given 'header' line, and return the GFF as bytes. 'source' is
+    a str.
+    '''
+    source = source.encode('utf-8')
+    parse_row = row_parser(header, binary=True)
+    parse_text = row_parser(header)
+    return b''.join([_bytes_row(line, source, parse_row, parse_text) for line in lines])
+
+def convert_bytes(data, outfile, source, chunk_size=4*1024*1024, validator=None):
+    '''
+    'bytes' engine: convert the UTF-8 MochiView table held in the bytes-like
+    'data' (including its header line), writing the GFF as bytes to the
+    binary stream 'outfile'. Nothing is decoded to str on the way. Lines are
+    split from 'data' about 'chunk_size' bytes at a time, and each chunk's
+    output is written with one call. Whatever was converted before a row
+    raises is still written. Bad rows go to the row_validator 'validator'
+    if given.
+    
+    Unlike text mode, a lone carriage return is not treated as a line break.
+    '''
+    source = source.encode('utf-8')
+    size = len(data)
+    pos = data.find(b'\n') + 1
+    if (pos == 0):
+        return
+    parse_row = row_parser(data[:pos], binary=True)
+    parse_text = row_parser(data[:pos].decode('utf-8', 'replace'))
+    line_number = 1
+    while (pos < size):
+        end = data.find(b'\n', min(pos + chunk_size, size) - 1)
+        end = size if (end == -1) else end + 1
+        lines = data[pos:end].split(b'\n')
+        if (lines[-1] == b''):
+            lines.pop()
+        out = []
+        try:
+            for line in lines:
+                line_number += 1
+                try:
+                    out.append(_bytes_row(line, source, parse_row, parse_text))
+                except (ValueError, IndexError) as e:
+                    if (validator == None):
+                        raise
+                    validator.problem(line_number, line, e)
+        finally:
+            outfile.write(b''.join(out))
+        pos = end
+
+def convert_mmap(path, outfile, source, validator=None):
+    '''
+    Memory-map the uncompressed MochiView file at 'path' and convert it with
+    convert_bytes(), writing to the binary stream 'outfile'
+    '''
+    with open(path, 'rb') as flo:
+        if (os.fstat(flo.fileno()).st_size == 0):
+            return
+        with mmap.mmap(flo.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            convert_bytes(data, outfile, source, validator=validator)
+
+class conversion_stats(object):
+    '''
+    Counters and per-stage timers collected when conversion is instrumented
+    (--stats). Stage times are exclusive: 'build' does not include the time
+    spent in 'escape'. When merged from --jobs workers, stage times are
+    summed over all workers while 'wall' is the elapsed time of the run.
+    '''
+    STAGES = ('read', 'parse', 'build', 'escape', 'serialize', 'write')
+    
+    def __init__(self):
+        self.rows = 0
+        self.features = collections.Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.wall = 0.0
+    
+    def merge(self, other):
+        '''
+        Add the counters of another conversion_stats, or of its as_dict()
+        '''
+        if isinstance(other, conversion_stats):
+            other = other.as_dict()
+        self.rows += other['rows']
+        self.features.update(other['features'])
+        self.bytes_in += other['bytes_in']
+        self.bytes_out += other['bytes_out']
+        for stage, seconds in other['seconds'].items():
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+    
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'features': dict(self.features),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'seconds': dict(self.seconds),
+            'wall': self.wall,
+            'rows_per_s': (self.rows / self.wall) if self.wall else None,
+        }
+    
+    def summary(self):
+        '''
+        Human-readable report, as printed to stderr by --stats
+        '''
+        total = sum(self.seconds.values()) or 1.0
+        lines = [
+            '{__program__} statistics'.format(**globals()),
+            ' rows read      {}'.format(self.rows),
+            ' features       {} ({})'.format(sum(self.features.values()), ', '.join('{} {}'.format(k, v) for k, v in sorted(self.features.items()))),
+            ' bytes in       {}'.format(self.bytes_in),
+            ' bytes out      {}'.format(self.bytes_out),
+            ' wall time      {:.3f} s ({:.0f} rows/s)'.format(self.wall, (self.rows / self.wall) if self.wall else 0),
+        ]
+        for stage in self.seconds:
+            lines.append(' {:<14} {:.3f} s ({:.1%})'.format(stage, self.seconds[stage], self.seconds[stage] / total))
+        return '\n'.join(lines)
+
+def _convert_instrumented(infile, outfile, source, stats, profile_rows=0, validator=None, sequence_lengths=None):
+    '''
+    Instrumented equivalent of convert(), which times every stage of every
+    row and updates the conversion_stats 'stats'. Always uses the Python
+    engine. If 'profile_rows' is set, the first that many data rows are
+    also run under cProfile and tracemalloc, and the reports are printed to
+    stderr. The plain convert() path contains none of this code, so
+    conversion without instrumentation pays nothing for it.
+    '''
+    clock = time.perf_counter
+    seconds = stats.seconds
+    
+    def timed_escape_text(text):
+        t = clock()
+        escaped = _escape_text(text)
+        seconds['escape'] += clock() - t
+        return escaped
+    
+    source = sys.intern(source)
+    profiler = None
+    buf = []
+    size = 0
+    try:
+        t = clock()
+        header = next(infile, None)
+        if (header != None):
+            stats.bytes_in += len(header.encode('utf-8', 'surrogateescape'))
+        seconds['read'] += clock() - t
+        parse_row = row_parser(header)
+        if (sequence_lengths != None):
+            parse_row = _bounded_row_parser(parse_row, sequence_lengths)
         
-        ##### exon #####
-        assert int(sline[EXON_COUNT]) == len(sline[EXON_STARTS]) == len(sline[EXON_ENDS]), "Exons improperly defined"
+        if profile_rows:
+            import cProfile
+            import tracemalloc
+            profiler = cProfile.Profile()
+            tracemalloc.start()
+            profiler.enable()
         
-        for i in range(sline[EXON_COUNT]):
-            type = 'exon'
-            start = s_exon_starts[i]
-            end = s_exon_ends[i]
-            score = '.'
-            strand = sline[STRAND]
-            phase = '.'
-            attributes = base_attributes.copy()
-            if (strand == '+'):
-                attributes['ID'] = sline[FEATURE_NAME]+'-T-E'+str(i+1)
-            elif (strand == '-'):
-                attributes['ID'] = sline[FEATURE_NAME]+'-T-E'+str(sline[EXON_COUNT]-i)
-            attributes['Parent'] = sline[FEATURE_NAME]+'-T'
+        t = clock()
+        for line in infile:
+            t1 = clock()
+            seconds['read'] += t1 - t
+            stats.rows += 1
+            stats.bytes_in += len(line.encode('utf-8', 'surrogateescape'))
             
-            self.features.append((seqid, source, type, start, end, score, strand, phase, self._join_attributes(attributes)))
-        
-        # Add one CDS for every exon if it is a protein-coding gene
-        if (sline[CDS_START] != None):
-            if (sline[EXON_COUNT] == 1):
-                type = 'CDS'
-                start = s_cds_start
-                end = s_cds_end
-                score = '.'
-                strand = sline[STRAND]
-                phase = 0
-                attributes = base_attributes.copy()
-                attributes['ID'] = sline[FEATURE_NAME]+'-P'
-                attributes['Parent'] = sline[FEATURE_NAME]+'-T'
+            try:
+                row = parse_row(line)
+                t2 = clock()
+                seconds['parse'] += t2 - t1
                 
-                self.features.append((seqid, source, type, start, end, score, strand, phase, self._join_attributes(attributes)))
-                
-            #elif (int(sline[EXON_COUNT]) == 2):
+                escape = seconds['escape']
+                features = list(_parsed_row_features(row, source, escape=timed_escape_text))
+            except (ValueError, IndexError) as e:
+                if (validator == None):
+                    raise
+                validator.problem(stats.rows + 1, line, e)
+                t = clock()
+                continue
+            t3 = clock()
+            seconds['build'] += t3 - t2 - (seconds['escape'] - escape)
+            
+            text = '\n'.join(map(str, features)) + '\n'
+            t4 = clock()
+            seconds['serialize'] += t4 - t3
+            
+            for feature in features:
+                stats.features[feature.type] += 1
+            stats.bytes_out += len(text.encode('utf-8', 'surrogateescape'))
+            buf.append(text)
+            size += len(text)
+            if (size >= 1024*1024):
+                t5 = clock()
+                outfile.write(''.join(buf))
+                seconds['write'] += clock() - t5
+                buf = []
+                size = 0
+            
+            if ((profiler != None) and (stats.rows >= profile_rows)):
+                _report_profile(profiler, stats.rows)
+                profiler = None
+            t = clock()
+    finally:
+        if buf:
+            t = clock()
+            outfile.write(''.join(buf))
+            seconds['write'] += clock() - t
+        if (profiler != None):
+            _report_profile(profiler, stats.rows)
+
+def _report_profile(profiler, rows):
+    '''
+    Stop a --profile session and print the cProfile and tracemalloc reports
+    '''
+    import pstats
+    import tracemalloc
+    profiler.disable()
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{__program__} profile of the first {rows} rows'.format(rows=rows, **globals()), file=sys.stderr)
+    pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+    print('Top allocations (peak traced memory {} bytes):'.format(peak), file=sys.stderr)
+    for stat in snapshot.statistics('lineno')[:10]:
+        print(' ' + str(stat), file=sys.stderr)
+
+def _converter_version():
+    '''
+    Fingerprint of the conversion logic: a hash of the source of the
+    functions and tables that determine the GFF produced for a row, or
+    whether the row is rejected instead (only good rows are cached). Used to
+    invalidate conversion caches whenever any of them changes.
+    '''
+    digest = hashlib.sha1()
+    for obj in (_parse_row, _header_columns, _compile_row_parser, row_parser, _bounded_row_parser, _row_problems, invalid_row,
+            _row_features, _parsed_row_features, _row_attributes, _escape_text, gff_feature):
+        try:
+            digest.update(inspect.getsource(obj).encode('utf-8'))
+        except (OSError, TypeError):
+            digest.update(obj.__name__.encode('utf-8'))
+    digest.update(repr(sorted(_ESCAPE_TABLE.items())).encode('utf-8'))
+    digest.update(repr(_ATTR_PREFIXES).encode('utf-8'))
+    digest.update(repr(_REQUIRED_COLUMNS).encode('utf-8'))
+    return digest.hexdigest()
+
+class conversion_cache(object):
+    '''
+    Persistent cache mapping a hash of each MochiView row (and the 'source'
+    argument) to that row's GFF text, stored in an SQLite database at 'path'.
+    The database records the converter version it was built with and is
+    emptied automatically when the conversion logic changes. When the cached
+    text exceeds 'max_bytes', the least recently used rows are evicted.
+    '''
+    def __init__(self, path, max_bytes=1024*1024*1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        import sqlite3
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS rows (key BLOB PRIMARY KEY, gff TEXT, size INTEGER)')
+        # Recency is kept in its own table so that marking a row as used
+        # does not rewrite its GFF text
+        self.db.execute('CREATE TABLE IF NOT EXISTS lru (key BLOB PRIMARY KEY, used INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS lru_used ON lru (used)')
+        version = _converter_version()
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if ((row == None) or (row[0] != version)):
+            self.db.execute('DELETE FROM rows')
+            self.db.execute('DELETE FROM lru')
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM rows').fetchone()[0]
+        self._clock = self.db.execute('SELECT COALESCE(MAX(used), 0) FROM lru').fetchone()[0]
+        self.db.commit()
+    
+    @staticmethod
+    def key(line, source, columns=None):
+        '''
+        Cache key of a data line. The line is stripped with rstrip(), as
+        every row parser strips it, so rows that differ only in trailing
+        whitespace, which convert the same, share a key. 'columns' are the
+        column names of a non-standard layout (see _header_columns()).
+        '''
+        if (columns != None):
+            source += '\t' + ','.join(columns)
+        return hashlib.sha1((source + '\t' + line.rstrip()).encode('utf-8', 'surrogateescape')).digest()
+    
+    def lookup(self, keys):
+        '''
+        Return a dict of the cached GFF text for those of 'keys' that are
+        present, and mark them as recently used
+        '''
+        found = {}
+        self._clock += 1
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i+500]
+            placeholders = ','.join('?' * len(batch))
+            for key, gff in self.db.execute('SELECT key, gff FROM rows WHERE key IN ({})'.format(placeholders), batch):
+                found[key] = gff
+            self.db.execute('UPDATE lru SET used = ? WHERE key IN ({})'.format(placeholders), [self._clock] + batch)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+    
+    def store(self, items):
+        '''
+        Add (key, gff) pairs to the cache. A row whose GFF is larger than
+        'max_bytes' on its own is not stored, as it would evict every other
+        row and then itself.
+        '''
+        self._clock += 1
+        rows = [(key, gff, len(gff)) for key, gff in items if (len(gff) <= self.max_bytes)]
+        self.db.executemany('INSERT OR REPLACE INTO rows VALUES (?, ?, ?)', rows)
+        self.db.executemany('INSERT OR REPLACE INTO lru VALUES (?, ?)', [(key, self._clock) for key, gff, size in rows])
+        self.size += sum(row[2] for row in rows)
+        if (self.size > self.max_bytes):
+            self._evict()
+    
+    def _evict(self):
+        '''
+        Delete least recently used rows until the cache is below 90% of its limit
+        '''
+        target = self.max_bytes * 0.9
+        while (self.size > target):
+            rows = self.db.execute('SELECT lru.key, rows.size FROM lru JOIN rows ON rows.key = lru.key ORDER BY lru.used LIMIT 1000').fetchall()
+            if not rows:
+                self.size = 0
+                break
+            removed = []
+            for key, size in rows:
+                removed.append((key,))
+                self.size -= size
+                if (self.size <= target):
+                    break
+            self.db.executemany('DELETE FROM rows WHERE key = ?', removed)
+            self.db.executemany('DELETE FROM lru WHERE key = ?', removed)
+            self.evicted += len(removed)
+    
+    def summary(self):
+        total = self.hits + self.misses
+        return '{__program__} cache: {hits} hits, {misses} misses ({rate:.1%} hit rate), {evicted} evicted, {size} bytes cached'.format(
+            hits=self.hits, misses=self.misses, rate=(self.hits / total) if total else 0, evicted=self.evicted, size=self.size, **globals())
+    
+    def close(self):
+        if (self.size > self.max_bytes):
+            self._evict()
+        self.db.commit()
+        self.db.close()
+
+def convert_cached(infile, outfile, source, cache, batch_size=1000, validator=None):
+    '''
+    Like convert(), but takes the GFF of unchanged rows from the
+    conversion_cache 'cache' and only converts new or changed rows, which
+    are then added to the cache. Bad rows are never cached, so they are
+    reported again on every run.
+    '''
+    header = next(infile, None)
+    parse_row = row_parser(header)
+    columns = None if (parse_row == _parse_row) else _header_columns(header)
+    source = sys.intern(source)
+    line_number = 2
+    while True:
+        lines = list(itertools.islice(infile, batch_size))
+        if not lines:
+            break
+        first_line = line_number
+        line_number += len(lines)
+        keys = [cache.key(line, source, columns) for line in lines]
+        found = cache.lookup(keys)
+        out = []
+        new = []
+        try:
+            for number, (line, key) in enumerate(zip(lines, keys), first_line):
+                text = found.get(key)
+                if (text == None):
+                    try:
+                        text = ''.join([str(feature) + '\n' for feature in _row_features(line, source, parse_row)])
+                    except (ValueError, IndexError) as e:
+                        if (validator == None):
+                            raise
+                        validator.problem(number, line, e)
+                        continue
+                    found[key] = text
+                    new.append((key, text))
+                out.append(text)
+        finally:
+            outfile.write(''.join(out))
+            if new:
+                cache.store(new)
+
+class sorted_writer(object):
+    '''
+    Text sink that sorts GFF output by seqid and start coordinate. Anything
+    written to it is split into gene blocks (a gene line plus every line up
+    to the next gene line), so the gene -> mRNA -> exon/CDS/UTR order within
+    a gene is kept and blocks are ordered by their gene's seqid and start.
+    Blocks with equal keys keep their input order.
+    
+    With 'by_line', every line is a block of its own instead, so the output
+    is ordered by start line by line, as tabix requires. A gene and its mRNA
+    still come before the features they contain, which start at or after
+    them.
+    
+    Blocks are buffered until they use about 'memory_limit' bytes, then
+    sorted and spilled to a temporary file. close() k-way merges the spilled
+    runs with a heap (at most 'fanin' runs at a time, merging in several
+    passes if needed) and writes the result to 'outfile'. Blocks are kept as
+    (seqid, start, number, lines) tuples, which sort in place without a
+    list of keys, and a quarter of 'memory_limit' is left for the sort, the
+    text being split and the output buffer, so peak memory stays under it.
+    '''
+    # Estimated bytes of a buffered block (the tuple, its integers and its
+    # list of lines), on top of the str objects of the lines
+    BLOCK_BYTES = 200
+    
+    def __init__(self, outfile, memory_limit=512*1024*1024, tmpdir=None, fanin=64, by_line=False):
+        self.outfile = outfile
+        self.memory_limit = memory_limit
+        self.tmpdir = tmpdir
+        self.fanin = fanin
+        self.by_line = by_line
+        self._buffer_limit = memory_limit * 3 // 4
+        self._chunk_size = max(1024, min(64*1024, memory_limit // 64))
+        self._blocks = []
+        self._size = 0
+        self._count = 0
+        # One str object per seqid, shared by its blocks
+        self._seqids = {}
+        self._partial = ''
+        self._runs = []
+    
+    def write(self, text):
+        chunk_size = self._chunk_size
+        if (len(text) > chunk_size):
+            # Split large writes, so that only a small piece of the text is
+            # held twice
+            for i in range(0, len(text), chunk_size):
+                self.write(text[i:i+chunk_size])
+            return
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        blocks = self._blocks
+        seqids = self._seqids
+        for line in lines:
+            fields = line.split('\t', 4)
+            if (self.by_line or (fields[2] == 'gene') or (len(blocks) == 0)):
+                # Every buffered block is complete once a new gene starts
+                if (self._size >= self._buffer_limit):
+                    self._spill()
+                    blocks = self._blocks
+                seqid = seqids.setdefault(fields[0], fields[0])
+                blocks.append((seqid, int(fields[3]), self._count, [line]))
+                self._count += 1
+                self._size += self.BLOCK_BYTES
             else:
-                # Truncate the first exon if needed
-                # Truncate the last exon if needed
-                # If there are any in the middle, the keep the entire exon as a CDS
-                
-                # type = 'CDS'
-                # start = s_cds_start
-                # end = s_exon_ends[0]
-                # score = '.'
-                # strand = sline[STRAND]
-                # phase = 0
-                # attributes = base_attributes.copy()
-                # attributes['ID'] = sline[FEATURE_NAME]+'-P'
-                # attributes['Parent'] = sline[FEATURE_NAME]+'-T'
-                # 
-                # self.features.append((seqid, source, type, start, end, score, strand, phase, self._join_attributes(attributes)))
-                
-                for i in range(len(sline[EXON_STARTS])):
-                    if ((s_cds_start < s_exon_ends[i]) and (s_exon_starts[i] < s_cds_end)):
-                        
-                        type = 'CDS'
-                        
-                        if (s_exon_starts[i] < s_cds_start < s_exon_ends[i]):
-                            start = s_cds_start
-                        else:
-                            start = s_exon_starts[i]
-                        
-                        if (start < s_cds_end < s_exon_ends[i]):
-                            end = s_cds_end
-                        else:
-                            end = s_exon_ends[i]
-                        
-                        #end = s_exon_ends[i]
-                        score = '.'
-                        strand = sline[STRAND]
-                        phase = 0
-                        attributes = base_attributes.copy()
-                        attributes['ID'] = sline[FEATURE_NAME]+'-P'
-                        attributes['Parent'] = sline[FEATURE_NAME]+'-T'
-                        
-                        self.features.append((seqid, source, type, start, end, score, strand, phase, self._join_attributes(attributes)))
-                
-                # Truncate the last exon
-                # if (s_exon_starts[-1] < s_cds_end):
-                #     type = 'CDS'
-                #     start = s_exon_starts[-1]
-                #     end = s_cds_end
-                #     score = '.'
-                #     strand = sline[STRAND]
-                #     phase = 0
-                #     attributes = base_attributes.copy()
-                #     attributes['ID'] = sline[FEATURE_NAME]+'-P'
-                #     attributes['Parent'] = sline[FEATURE_NAME]+'-T'
-                #     
-                #     self.features.append((seqid, source, type, start, end, score, strand, phase, self._join_attributes(attributes)))
+                blocks[-1][3].append(line)
+            self._size += sys.getsizeof(line) + 8
+    
+    def _spill(self):
+        '''
+        Sort the buffered blocks and write them to a temporary run file
+        '''
+        self._blocks.sort()
+        self._runs.append(self._write_run(self._blocks))
+        self._blocks = []
+        self._size = 0
+    
+    def _write_run(self, blocks):
+        run = tempfile.TemporaryFile('w+', encoding='utf-8', errors='surrogateescape', dir=self.tmpdir)
+        for seqid, start, number, lines in blocks:
+            run.write('{}\t{}\n'.format(len(lines), number))
+            run.write('\n'.join(lines))
+            run.write('\n')
+        return run
+    
+    def _merge_runs(self, runs):
+        return heapq.merge(*[_read_run(run) for run in runs])
+    
+    def close(self):
+        if self._partial:
+            self.write('\n')
+        self._blocks.sort()
+        if (len(self._runs) == 0):
+            blocks = self._blocks
+        else:
+            if self._blocks:
+                self._runs.append(self._write_run(self._blocks))
+            self._blocks = []
+            self._runs = _reduce_runs(self._runs, self.fanin, self._write_run, self._merge_runs)
+            blocks = self._merge_runs(self._runs)
+        
+        buf = []
+        size = 0
+        buffer_size = min(1024*1024, self.memory_limit // 32)
+        for seqid, start, number, lines in blocks:
+            for line in lines:
+                buf.append(line)
+                size += len(line)
+            if (size >= buffer_size):
+                buf.append('')
+                self.outfile.write('\n'.join(buf))
+                buf = []
+                size = 0
+        if buf:
+            buf.append('')
+            self.outfile.write('\n'.join(buf))
+        
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._blocks = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if (exc_type == None):
+            self.close()
+        else:
+            for run in self._runs:
+                run.close()
+
+def _reduce_runs(runs, fanin, write_run, merge_runs):
+    '''
+    Reduce the temporary run files 'runs' of an external merge sort until
+    they can be merged in one pass: while there are more than 'fanin', merge
+    them 'fanin' at a time with 'merge_runs' (runs -> sorted items) into new
+    runs written by 'write_run' (items -> run). Merged runs are closed.
+    Returns the remaining runs.
+    '''
+    while (len(runs) > fanin):
+        merged = []
+        for i in range(0, len(runs), fanin):
+            group = runs[i:i+fanin]
+            merged.append(write_run(merge_runs(group)))
+            for run in group:
+                run.close()
+        runs = merged
+    return runs
+
+def _read_run(run):
+    '''
+    Generator that reads back the gene blocks written by
+    sorted_writer._write_run()
+    '''
+    run.seek(0)
+    while True:
+        header = run.readline()
+        if (header == ''):
+            break
+        count, number = header.split('\t')
+        lines = [run.readline()[:-1] for i in range(int(count))]
+        fields = lines[0].split('\t', 4)
+        yield (fields[0], int(fields[3]), int(number), lines)
+
+class isoform_grouper(object):
+    '''
+    Groups the rows of a MochiView file by gene (FEATURE_NAME), so that the
+    isoforms of a gene become the transcripts of one gene feature
+    (--group-isoforms). Genes are converted in the order of their first
+    row.
+    
+    With mode 'adjacent' the rows of each gene must follow each other, and
+    every gene is converted as soon as its last row has been read. Only the
+    names of the genes seen so far are kept, to detect input that is not
+    grouped after all.
+    
+    With mode 'any' the rows may come in any order. A hash index numbers
+    every gene by its first row, and rows are buffered under that number
+    until they use about 'memory_limit' bytes. They are then spilled to a
+    temporary run file in gene order, and the runs are k-way merged at the
+    end (at most 'fanin' at a time, as in sorted_writer).
+    '''
+    def __init__(self, mode='adjacent', memory_limit=512*1024*1024, tmpdir=None, fanin=64):
+        if (mode not in ('adjacent', 'any')):
+            raise ValueError("unknown isoform grouping mode {!r}".format(mode))
+        self.mode = mode
+        self.memory_limit = memory_limit
+        self.tmpdir = tmpdir
+        self.fanin = fanin
+    
+    def features(self, lines, source, parse_row=_parse_row, validator=None):
+        '''
+        Generator yielding the GFF feature records of the MochiView data
+        lines in 'lines', one gene at a time
+        '''
+        source = sys.intern(source)
+        for rows in self.groups(lines, parse_row, validator):
+            yield from _gene_features(rows, source)
+    
+    def groups(self, lines, parse_row=_parse_row, validator=None):
+        '''
+        Generator yielding the list of parsed rows of each gene. Rows are
+        checked as they are read; bad rows raise, or are passed to the
+        row_validator 'validator'.
+        '''
+        if (self.mode == 'adjacent'):
+            return self._adjacent_groups(lines, parse_row, validator)
+        return self._indexed_groups(lines, parse_row, validator)
+    
+    def _adjacent_groups(self, lines, parse_row, validator):
+        seen = set()
+        name = None
+        entries = []
+        for line_number, line in enumerate(lines, 2):
+            row = _checked_row(line_number, line, parse_row, validator)
+            if (row == None):
+                continue
+            if (row[FEATURE_NAME] != name):
+                if (row[FEATURE_NAME] in seen):
+                    error = invalid_row([('adjacent', "Rows of {} are not adjacent; use '--group-isoforms any'".format(row[FEATURE_NAME]))],
+                        row[FEATURE_NAME])
+                    if (validator == None):
+                        raise error
+                    validator.problem(line_number, line, error)
+                    continue
+                if entries:
+                    yield _checked_gene(entries, validator)
+                    entries = []
+                name = row[FEATURE_NAME]
+                seen.add(name)
+            entries.append((line_number, line, row))
+        if entries:
+            yield _checked_gene(entries, validator)
+    
+    def _indexed_groups(self, lines, parse_row, validator):
+        order = {}
+        buckets = {}
+        size = 0
+        runs = []
+        try:
+            for line_number, line in enumerate(lines, 2):
+                row = _checked_row(line_number, line, parse_row, validator)
+                if (row == None):
+                    continue
+                number = order.get(row[FEATURE_NAME])
+                if (number == None):
+                    number = order[row[FEATURE_NAME]] = len(order)
+                bucket = buckets.get(number)
+                if (bucket == None):
+                    bucket = buckets[number] = []
+                bucket.append((line_number, line, row))
+                # Rough size of a buffered row: its text and the parsed row
+                size += 2*len(line) + 500
+                if (size >= self.memory_limit):
+                    runs.append(self._write_run(sorted(buckets.items())))
+                    buckets = {}
+                    size = 0
             
-            # Add upstream 5'(+)/3'(-) UTR
-            if (sline[TXN_START] < s_cds_start):
-                strand = sline[STRAND]
-                start = sline[TXN_START]
-                end = s_cds_start-1
-                attributes = base_attributes.copy()
-                if (strand == '+'):
-                    type = 'five_prime_UTR'
-                    #end = s_cds_start-1
-                    attributes['ID'] = sline[FEATURE_NAME]+'-5'
-                elif (strand == '-'):
-                    type = 'three_prime_UTR'
-                    #end = s_cds_start+1
-                    attributes['ID'] = sline[FEATURE_NAME]+'-3'
-                score = '.'
-                phase = '.'
-                attributes['Parent'] = sline[FEATURE_NAME]+'-T'
-                
-                self.features.append((seqid, source, type, start, end, score, strand, phase, self._join_attributes(attributes)))
+            groups = sorted(buckets.items())
+            if runs:
+                if groups:
+                    runs.append(self._write_run(groups))
+                groups = None
+                buckets = {}
+                runs = _reduce_runs(runs, self.fanin, self._write_run, self._merge_runs)
+                groups = self._merge_runs(runs)
             
-            # Add downstream 3'(+)/5'(-) UTR
-            if (s_cds_end < sline[TXN_END]):
-                strand = sline[STRAND]
-                start = s_cds_end+1
-                end = sline[TXN_END]
-                attributes = base_attributes.copy()
-                if (strand == '+'):
-                    type = 'three_prime_UTR'
-                    #start = s_cds_end+1
-                    attributes['ID'] = sline[FEATURE_NAME]+'-3'
-                elif (strand == '-'):
-                    type = 'five_prime_UTR'
-                    #start = s_cds_end-1
-                    attributes['ID'] = sline[FEATURE_NAME]+'-5'
-                score = '.'
-                phase = '.'
-                attributes['Parent'] = sline[FEATURE_NAME]+'-T'
-                
-                self.features.append((seqid, source, type, start, end, score, strand, phase, self._join_attributes(attributes)))
+            for number, entries in groups:
+                yield _checked_gene([(line_number, line, row if (row != None) else parse_row(line)) for line_number, line, row in entries], validator)
+        finally:
+            for run in runs:
+                run.close()
     
-    def _escape_text(self, text):
+    def _write_run(self, groups):
+        '''
+        Write (number, [(line_number, line, row), ...]) groups to a
+        temporary run file, one 'number<TAB>line_number<TAB>line' record
+        per row
         '''
-        GFF3 files are nine-column, tab-delimited, plain text files. Literal use
-        of tab, newline, carriage return, the percent (%) sign, and control
-        characters must be encoded using RFC 3986 Percent-Encoding; no other
-        characters may be encoded. Backslash and other ad-hoc escaping
-        conventions that have been added to the GFF format are not allowed.
-        The file contents may include any character in the set supported by the
-        operating environment, although for portability with other systems, use
-        of Latin-1 or Unicode are recommended.
+        run = tempfile.TemporaryFile('w+', encoding='utf-8', errors='surrogateescape', dir=self.tmpdir)
+        for number, entries in groups:
+            prefix = str(number) + '\t'
+            run.write(''.join([prefix + str(line_number) + '\t' + line.rstrip('\r\n') + '\n' for line_number, line, row in entries]))
+        return run
+    
+    def _merge_runs(self, runs):
+        '''
+        Merge run files into one sequence of groups in gene order. Rows of
+        one gene from several runs are joined in run order, which is input
+        order. Rows read back from disk are parsed again by groups().
+        '''
+        merged = heapq.merge(*[_read_group_run(run) for run in runs], key=operator.itemgetter(0))
+        for number, groups in itertools.groupby(merged, key=operator.itemgetter(0)):
+            yield number, [entry for number, entries in groups for entry in entries]
+
+def _read_group_run(run):
+    '''
+    Generator that reads back the groups written by
+    isoform_grouper._write_run(), as (number, [(line_number, line, None),
+    ...])
+    '''
+    run.seek(0)
+    current = None
+    entries = []
+    for record in run:
+        number, line_number, line = record.split('\t', 2)
+        number = int(number)
+        if (number != current):
+            if entries:
+                yield current, entries
+            current = number
+            entries = []
+        entries.append((int(line_number), line, None))
+    if entries:
+        yield current, entries
+
+class _handle_pool(object):
+    '''
+    Writes text to many files while keeping at most 'max_open' of them
+    open. Opening one more closes the least recently written one. A file
+    is truncated the first time it is opened and appended to afterwards.
+    '''
+    def __init__(self, max_open):
+        self.max_open = max_open
+        self.opened = 0
+        self._files = collections.OrderedDict()
+        self._created = set()
+    
+    def write(self, path, text):
+        flo = self._files.get(path)
+        if (flo == None):
+            if (len(self._files) >= self.max_open):
+                self._files.popitem(last=False)[1].close()
+            flo = self._files[path] = open(path, 'a' if (path in self._created) else 'w')
+            self._created.add(path)
+            self.opened += 1
+        else:
+            self._files.move_to_end(path)
+        flo.write(text)
+    
+    def close(self):
+        for flo in self._files.values():
+            flo.close()
+        self._files.clear()
+
+class shard_writer(object):
+    '''
+    Text sink that splits GFF output into one file per seqid in
+    'directory', named after the seqid (percent-encoded where it is not
+    safe in a file name). Like sorted_writer it works on gene blocks (a
+    gene line plus every line up to the next one), which it finds by
+    searching for the type column instead of splitting every line; the
+    gene lines also give each shard's range, as they span their features.
+    Blocks are buffered per shard until about 'buffer_size' characters are
+    held, then every buffer is written out through a _handle_pool, so at
+    most 'max_open' files are ever open however many sequences there are.
+    With 'threads' greater than 1, the shards are spread over that many
+    writer threads, each with its own pool, fed through bounded queues.
+    
+    ##sequence-region lines go to the shard of their seqid, and other
+    pragmas (such as ##gff-version) to the top of every shard. close()
+    writes 'manifest.tsv' to the directory: the seqid, file name, feature
+    count and first and last base covered of every shard, in the order the
+    seqids first appeared.
+    '''
+    MANIFEST = 'manifest.tsv'
+    
+    def __init__(self, directory, max_open=128, threads=1, buffer_size=8*1024*1024, suffix='.gff'):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.suffix = suffix
+        self.shards = collections.OrderedDict() # seqid -> [file name, features, start, end]
+        self._buffers = {}
+        self._size = 0
+        self._partial = ''
+        self._pragmas = []
+        self._current = None
+        self._error = None
+        if (threads > 1):
+            self._pool = None
+            self._queues = [queue.Queue(maxsize=16) for i in range(threads)]
+            self._threads = [threading.Thread(target=self._run, args=(tasks, _handle_pool(max(1, max_open // threads))), daemon=True)
+                for tasks in self._queues]
+            for thread in self._threads:
+                thread.start()
+            self._assigned = {}
+        else:
+            self._pool = _handle_pool(max_open)
+            self._threads = []
+    
+    def _add(self, seqid):
+        name = urllib.parse.quote(seqid, safe='')
+        if name.startswith('.'):
+            name = '%2E' + name[1:]
+        shard = self.shards[seqid] = [name + self.suffix, 0, None, None]
+        self._buffers[seqid] = list(self._pragmas)
+        if self._threads:
+            self._assigned[seqid] = self._queues[(len(self.shards) - 1) % len(self._queues)]
+        return shard
+    
+    def write(self, text):
+        if (self._error != None):
+            raise self._error
+        text = self._partial + text
+        cut = text.rfind('\n') + 1
+        self._partial = text[cut:]
+        # Whole gene blocks are routed at once, found by their gene lines
+        pos = 0
+        i = text.find('\tgene\t', 0, cut)
+        while (i != -1):
+            line_start = text.rfind('\n', 0, i) + 1
+            if (text.count('\t', line_start, i) != 1):
+                # 'gene' in another column
+                i = text.find('\tgene\t', i + 1, cut)
+                continue
+            if (line_start > pos):
+                self._route(text[pos:line_start])
+            seqid, source, type, start, end = text[line_start:i+64].split('\t', 5)[:5]
+            shard = self.shards.get(seqid)
+            if (shard == None):
+                shard = self._add(seqid)
+            start = int(start)
+            end = int(end)
+            if ((shard[2] == None) or (start < shard[2])):
+                shard[2] = start
+            if ((shard[3] == None) or (end > shard[3])):
+                shard[3] = end
+            self._current = seqid
+            pos = line_start
+            i = text.find('\tgene\t', i + 1, cut)
+        if (pos < cut):
+            self._route(text[pos:cut])
+        if (self._size >= self.buffer_size):
+            self.flush()
+    
+    def _route(self, lines):
+        '''
+        Add complete 'lines' to the buffer of the current gene's shard, or
+        handle them as pragmas if they come before the first gene
+        '''
+        if (self._current == None):
+            for line in lines.splitlines(True):
+                fields = line.split()
+                if ((len(fields) > 1) and (fields[0] == '##sequence-region')):
+                    if (fields[1] not in self.shards):
+                        self._add(fields[1])
+                    self._buffers[fields[1]].append(line)
+                else:
+                    self._pragmas.append(line)
+        else:
+            self._buffers[self._current].append(lines)
+            self.shards[self._current][1] += lines.count('\n')
+        self._size += len(lines)
+    
+    def flush(self):
+        '''
+        Write out the buffered lines of every shard
+        '''
+        for seqid, buf in self._buffers.items():
+            if buf:
+                path = os.path.join(self.directory, self.shards[seqid][0])
+                if self._threads:
+                    self._assigned[seqid].put((path, ''.join(buf)))
+                else:
+                    self._pool.write(path, ''.join(buf))
+                buf.clear()
+        self._size = 0
+    
+    def _run(self, tasks, pool):
+        '''
+        Writer thread: writes the (path, text) items of the queue 'tasks'
+        until it gets None. After an error it keeps emptying the queue,
+        so the converter is not blocked, and write() or close() raises it.
+        '''
+        try:
+            while True:
+                task = tasks.get()
+                if (task == None):
+                    break
+                if (self._error == None):
+                    pool.write(*task)
+        except Exception as e:
+            self._error = e
+            while (tasks.get() != None):
+                pass
+        finally:
+            pool.close()
+    
+    def _stop(self):
+        if self._threads:
+            for tasks in self._queues:
+                tasks.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+        else:
+            self._pool.close()
+    
+    def close(self):
+        if self._partial:
+            self.write('\n')
+        try:
+            self.flush()
+        finally:
+            self._stop()
+        if (self._error != None):
+            raise self._error
+        with open(os.path.join(self.directory, self.MANIFEST), 'w') as flo:
+            print('#seqid', 'file', 'features', 'start', 'end', sep='\t', file=flo)
+            for seqid, (name, features, start, end) in self.shards.items():
+                print(seqid, name, features, '.' if (start == None) else start, '.' if (end == None) else end, sep='\t', file=flo)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if (exc_type == None):
+            self.close()
+        else:
+            self._stop()
+
+# BGZF (blocked gzip) parameters, as used by samtools/tabix
+_BGZF_BLOCK_SIZE = 0xff00
+_BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+def _bgzf_block(data, level=6):
+    '''
+    Compress 'data' (at most 64 KiB) into a single BGZF block
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25)
+    return header + cdata + struct.pack('<II', zlib.crc32(data), len(data))
+
+class bgzf_writer(object):
+    '''
+    Sink that writes BGZF-compressed output to the binary stream 'fileobj'.
+    write() accepts text (encoded with 'encoding') or bytes. With 'threads'
+    greater than 1, blocks are compressed by a thread pool and written in
+    order; at most 2*threads blocks are in flight.
+    
+    If a tabix_index is given as 'index', every complete GFF line written is
+    added to it, and close() finalizes the index once the compressed offsets
+    are known. The caller then writes it with index.write().
+    '''
+    def __init__(self, fileobj, index=None, threads=1, level=6, encoding='utf-8'):
+        self.fileobj = fileobj
+        self.index = index
+        self.level = level
+        self.encoding = encoding
+        self._buffer = bytearray()
+        self._partial = b''
+        self._uoffset = 0 # Uncompressed bytes received so far
+        self._coffset = 0 # Compressed bytes written so far
+        self._block_offsets = [] # Compressed offset of every block
+        self._pending = collections.deque()
+        self._threads = threads
+        if (threads > 1):
+            self._executor = concurrent.futures.ThreadPoolExecutor(threads)
+        else:
+            self._executor = None
+    
+    def write(self, text):
+        if isinstance(text, str):
+            data = text.encode(self.encoding)
+        else:
+            data = text
+        if (self.index != None):
+            self._index_lines(data)
+        self._uoffset += len(data)
+        self._buffer += data
+        while (len(self._buffer) >= _BGZF_BLOCK_SIZE):
+            self._submit(bytes(self._buffer[:_BGZF_BLOCK_SIZE]))
+            del self._buffer[:_BGZF_BLOCK_SIZE]
+    
+    def _index_lines(self, data):
+        # Position of the first line completed by 'data'
+        offset = self._uoffset - len(self._partial)
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for line in lines:
+            end = offset + len(line) + 1
+            if (line and not line.startswith(b'#')):
+                fields = line.split(b'\t', 5)
+                self.index.add(fields[0].decode(self.encoding), int(fields[3])-1, int(fields[4]), offset, end)
+            offset = end
+    
+    def _submit(self, data):
+        if (self._executor == None):
+            self._write_block(_bgzf_block(data, self.level))
+        else:
+            self._pending.append(self._executor.submit(_bgzf_block, data, self.level))
+            while (len(self._pending) > 2*self._threads):
+                self._write_block(self._pending.popleft().result())
+    
+    def _write_block(self, block):
+        self._block_offsets.append(self._coffset)
+        self.fileobj.write(block)
+        self._coffset += len(block)
+    
+    def virtual_offset(self, uoffset):
+        '''
+        Convert an uncompressed byte position into a BGZF virtual offset.
+        Only valid once the block containing it has been written.
+        '''
+        block, within = divmod(uoffset, _BGZF_BLOCK_SIZE)
+        if (block < len(self._block_offsets)):
+            return (self._block_offsets[block] << 16) | within
+        return self._coffset << 16
+    
+    def close(self):
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self._write_block(self._pending.popleft().result())
+        if (self._executor != None):
+            self._executor.shutdown()
+        if (self.index != None):
+            self.index.finalize(self.virtual_offset)
+        self.fileobj.write(_BGZF_EOF)
+        self.fileobj.flush()
+
+def _reg2bin(beg, end):
+    '''
+    UCSC/tabix bin number for the 0-based, half-open interval [beg, end)
+    '''
+    end -= 1
+    if ((beg >> 14) == (end >> 14)):
+        return 4681 + (beg >> 14)
+    if ((beg >> 17) == (end >> 17)):
+        return 585 + (beg >> 17)
+    if ((beg >> 20) == (end >> 20)):
+        return 73 + (beg >> 20)
+    if ((beg >> 23) == (end >> 23)):
+        return 9 + (beg >> 23)
+    if ((beg >> 26) == (end >> 26)):
+        return 1 + (beg >> 26)
+    return 0
+
+def _reg2bins(beg, end):
+    '''
+    All bin numbers that may contain features overlapping [beg, end)
+    '''
+    end -= 1
+    bins = [0]
+    for offset, shift in ((1, 26), (9, 23), (73, 20), (585, 17), (4681, 14)):
+        bins.extend(range(offset + (beg >> shift), offset + (end >> shift) + 1))
+    return bins
+
+class tabix_index(object):
+    '''
+    Builds a tabix (.tbi) index for GFF written through a bgzf_writer. Lines
+    must be grouped by seqid and sorted by start, which is what --sort
+    produces with --index: htslib stops reading at the first line that
+    starts past the query. Coordinates up to 2^29 are supported, as in the
+    .tbi format; CSI indexes for longer sequences are not implemented.
+    
+    Chunks are recorded as uncompressed offsets while writing and turned
+    into virtual offsets by finalize(), after every block has been written.
+    '''
+    def __init__(self):
+        self.names = []
+        self._refs = {}
+        self._last_name = None
+        self._last_beg = 0
+    
+    def add(self, seqid, beg, end, start_offset, end_offset):
+        if (seqid != self._last_name):
+            if (seqid in self._refs):
+                raise ValueError("Cannot index output that is not grouped by seqid ({!r} seen twice); use --sort".format(seqid))
+            self._refs[seqid] = ({}, [])
+            self.names.append(seqid)
+            self._last_name = seqid
+            self._last_beg = beg
+        if (beg < self._last_beg):
+            raise ValueError("Cannot index output that is not sorted by start ({!r} at {} after {})".format(seqid, beg+1, self._last_beg+1))
+        self._last_beg = beg
+        bins, linear = self._refs[seqid]
         
-        Note that unescaped spaces are allowed within fields, meaning that
-        parsers must split on tabs, not spaces. Use of the "+" (plus) character
-        to encode spaces is depracated from early versions of the spec and is
-        no longer allowed.
+        chunks = bins.setdefault(_reg2bin(beg, end), [])
+        if (chunks and (chunks[-1][1] == start_offset)):
+            chunks[-1][1] = end_offset
+        else:
+            chunks.append([start_offset, end_offset])
         
-        Undefined fields are replaced with the "." character, as described in
-        the original GFF spec.
+        last_window = (max(end, beg+1) - 1) >> 14
+        if (len(linear) <= last_window):
+            linear.extend([None] * (last_window + 1 - len(linear)))
+        for window in range(beg >> 14, last_window + 1):
+            if (linear[window] == None):
+                linear[window] = start_offset
+    
+    def finalize(self, virtual_offset):
+        '''
+        Convert the recorded offsets with the 'virtual_offset' function
+        '''
+        for bins, linear in self._refs.values():
+            for chunks in bins.values():
+                for chunk in chunks:
+                    chunk[0] = virtual_offset(chunk[0])
+                    chunk[1] = virtual_offset(chunk[1])
+            previous = 0
+            for i in range(len(linear)):
+                if (linear[i] == None):
+                    linear[i] = previous
+                else:
+                    linear[i] = previous = virtual_offset(linear[i])
+    
+    def write(self, path):
         '''
+        Write the finalized index as a BGZF-compressed .tbi file
+        '''
+        names = b''.join(name.encode('utf-8') + b'\0' for name in self.names)
+        # magic, n_ref, format (generic, 1-based), col_seq, col_beg, col_end, meta, skip, l_nm
+        data = [b'TBI\1', struct.pack('<8i', len(self.names), 0, 1, 4, 5, ord('#'), 0, len(names)), names]
+        for name in self.names:
+            bins, linear = self._refs[name]
+            data.append(struct.pack('<i', len(bins)))
+            for bin_number in sorted(bins):
+                chunks = bins[bin_number]
+                data.append(struct.pack('<Ii', bin_number, len(chunks)))
+                for chunk in chunks:
+                    data.append(struct.pack('<QQ', chunk[0], chunk[1]))
+            data.append(struct.pack('<i', len(linear)))
+            data.append(struct.pack('<{}Q'.format(len(linear)), *linear))
+        with open(path, 'wb') as flo:
+            writer = bgzf_writer(flo)
+            writer.write(b''.join(data))
+            writer.close()
+
+class _bgzf_reader(object):
+    '''
+    Minimal random-access reader for BGZF files, addressed by virtual offset
+    '''
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self._data = b''
+        self._pos = 0
+        self._coffset = 0
+        self._next_coffset = 0
+    
+    def _load(self, coffset):
+        self._coffset = coffset
+        self._data = b''
+        self._pos = 0
+        self._next_coffset = coffset
+        self.fileobj.seek(coffset)
+        header = self.fileobj.read(12)
+        if (len(header) < 12):
+            return
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = self.fileobj.read(xlen)
+        bsize = None
+        i = 0
+        while (i + 4 <= xlen):
+            slen = struct.unpack('<H', extra[i+2:i+4])[0]
+            if (extra[i:i+2] == b'BC'):
+                bsize = struct.unpack('<H', extra[i+4:i+6])[0]
+            i += 4 + slen
+        if (bsize == None):
+            raise ValueError("Not a BGZF file")
+        cdata = self.fileobj.read(bsize - xlen - 19)
+        self._data = zlib.decompress(cdata, -15)
+        self._next_coffset = coffset + bsize + 1
+    
+    def seek(self, voffset):
+        self._load(voffset >> 16)
+        self._pos = voffset & 0xffff
+    
+    def tell(self):
+        if (self._data and (self._pos >= len(self._data))):
+            return self._next_coffset << 16
+        return (self._coffset << 16) | self._pos
+    
+    def readline(self):
+        parts = []
+        while True:
+            if (self._pos >= len(self._data)):
+                if (self._next_coffset == self._coffset):
+                    break
+                self._load(self._next_coffset)
+                if not self._data:
+                    break
+            i = self._data.find(b'\n', self._pos)
+            if (i < 0):
+                parts.append(self._data[self._pos:])
+                self._pos = len(self._data)
+            else:
+                parts.append(self._data[self._pos:i+1])
+                self._pos = i + 1
+                break
+        return b''.join(parts)
+
+class tabix_reader(object):
+    '''
+    Region queries over a BGZF-compressed GFF file and its .tbi index, such
+    as the ones written with --bgzf --index. Only the blocks that can hold
+    matching features are decompressed.
+    '''
+    def __init__(self, path, index_path=None, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+        if (index_path == None):
+            index_path = path + '.tbi'
+        with open(index_path, 'rb') as flo:
+            data = gzip.decompress(flo.read())
+        if (data[:4] != b'TBI\1'):
+            raise ValueError("Not a tabix index: " + index_path)
+        n_ref, fmt, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack_from('<8i', data, 4)
+        pos = 36
+        self.names = data[pos:pos+l_nm].decode('utf-8').split('\0')[:n_ref]
+        pos += l_nm
+        self._refs = {}
+        for name in self.names:
+            bins = {}
+            n_bin = struct.unpack_from('<i', data, pos)[0]
+            pos += 4
+            for i in range(n_bin):
+                bin_number, n_chunk = struct.unpack_from('<Ii', data, pos)
+                pos += 8
+                chunks = struct.unpack_from('<{}Q'.format(2*n_chunk), data, pos)
+                pos += 16*n_chunk
+                bins[bin_number] = list(zip(chunks[0::2], chunks[1::2]))
+            n_intv = struct.unpack_from('<i', data, pos)[0]
+            pos += 4
+            linear = struct.unpack_from('<{}Q'.format(n_intv), data, pos)
+            pos += 8*n_intv
+            self._refs[name] = (bins, linear)
+    
+    def query(self, seqid, start, end):
+        '''
+        Generator yielding the GFF lines (without the newline) on 'seqid'
+        that overlap the 1-based, inclusive region [start, end]
+        '''
+        if (seqid not in self._refs):
+            return
+        bins, linear = self._refs[seqid]
+        beg = start - 1
+        min_offset = linear[min(beg >> 14, len(linear)-1)] if linear else 0
+        chunks = sorted(chunk for b in _reg2bins(beg, end) for chunk in bins.get(b, ()) if (chunk[1] > min_offset))
         
-        table = {
-            '"': '%22',
-            '%': '%25',
-            '&': '%26',
-            "'": '%27',
-            '(': '%28',
-            ')': '%29',
-            ',': '%2C',
-            ';': '%3B',
-            '=': '%3D',
-            '[': '%5B',
-            '\\': '%5C',
-            ']': '%5D',
-            chr(127): '%7F',
-        }
-        for i in range(33):
-            table[chr(i)] = '%' + hex(i)[2:].zfill(2)
-        #table[chr(0)] = '%20'
+        # Merge overlapping chunks so no line is read twice
+        merged = []
+        for chunk_beg, chunk_end in chunks:
+            if (merged and (chunk_beg <= merged[-1][1])):
+                merged[-1][1] = max(merged[-1][1], chunk_end)
+            else:
+                merged.append([chunk_beg, chunk_end])
         
-        return ''.join(table.get(c,c) for c in text)
+        with open(self.path, 'rb') as flo:
+            reader = _bgzf_reader(flo)
+            for chunk_beg, chunk_end in merged:
+                reader.seek(max(chunk_beg, min_offset))
+                while (reader.tell() < chunk_end):
+                    line = reader.readline()
+                    if not line:
+                        break
+                    fields = line.split(b'\t', 5)
+                    if ((len(fields) > 4) and (fields[0].decode(self.encoding) == seqid) and (int(fields[3]) <= end) and (int(fields[4]) >= start)):
+                        yield line.rstrip(b'\n').decode(self.encoding)
+
+# Leading bytes identifying compressed input
+_COMPRESSION_MAGIC = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+)
+
+def _detect_compression(head):
+    '''
+    Return the name of the compression format that the bytes 'head' start
+    with, or None for uncompressed data
+    '''
+    for magic, name in _COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+class _prefixed_stream(io.RawIOBase):
+    '''
+    Binary stream that returns 'head' followed by the rest of 'fileobj'. Used
+    to put back the bytes consumed while sniffing a non-seekable stream.
+    '''
+    def __init__(self, head, fileobj):
+        self._head = head
+        self._fileobj = fileobj
     
-    def _join_attributes(self, attributes):
-        l = []
-        for k in attributes:
-            l.append(str(k) + '=' + str(attributes[k]))
-        return ';'.join(l)
+    def readable(self):
+        return True
     
-    def __str__(self):
-        return('\n'.join(map(lambda x: '\t'.join(map(str, x)), self.features)))
+    def readinto(self, b):
+        if self._head:
+            n = min(len(b), len(self._head))
+            b[:n] = self._head[:n]
+            self._head = self._head[n:]
+            return n
+        data = self._fileobj.read(len(b))
+        b[:len(data)] = data
+        return len(data)
 
-def main():
-    if (len(sys.argv) != 3):
-        print("USAGE: python3 {__program__} MochiViewAnnotations.txt source > MochiViewAnnotations.gff".format(**globals()))
-        sys.exit()
+class _threaded_reader(io.RawIOBase):
+    '''
+    Binary stream that reads 'fileobj' in a background thread, handing blocks
+    of 'block_size' bytes over through a queue of at most 'depth' blocks.
+    Decompression inside 'fileobj' thus overlaps with conversion in the
+    reading thread, while memory stays bounded.
+    '''
+    def __init__(self, fileobj, block_size=1024*1024, depth=8):
+        self._fileobj = fileobj
+        self._queue = queue.Queue(depth)
+        self._data = b''
+        self._done = False
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, args=(block_size,), daemon=True)
+        self._thread.start()
+    
+    def _run(self, block_size):
+        try:
+            while not self._closing:
+                data = self._fileobj.read(block_size)
+                self._queue.put(data)
+                if not data:
+                    break
+        except Exception as e:
+            self._queue.put(e)
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, b):
+        while ((not self._data) and (not self._done)):
+            data = self._queue.get()
+            if isinstance(data, Exception):
+                self._done = True
+                raise data
+            if not data:
+                self._done = True
+            self._data = data
+        n = min(len(b), len(self._data))
+        b[:n] = self._data[:n]
+        self._data = self._data[n:]
+        return n
+    
+    def close(self):
+        if not self.closed:
+            self._closing = True
+            # Unblock the reader thread if it is waiting on a full queue
+            while self._thread.is_alive():
+                try:
+                    self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._fileobj.close()
+        super().close()
+
+def open_input(path, encoding=None, threaded=True):
+    '''
+    Open the MochiView file at 'path' ('-' for stdin) as a text stream.
+    gzip (including BGZF), bzip2, xz and zstd input is detected from its
+    leading bytes and decompressed on the fly; zstd requires the
+    'zstandard' module. The leading bytes of stdin, pipes and FIFOs, which
+    cannot seek back, are put back in front of the stream. With
+    'threaded', compressed input is decompressed in a background thread.
+    '''
+    if (path == '-'):
+        raw = sys.stdin.buffer
+    else:
+        raw = open(path, 'rb')
+    head = raw.read(6)
+    compression = _detect_compression(head)
+    if ((compression == None) and raw.seekable()):
+        raw.seek(0)
+        return io.TextIOWrapper(raw, encoding=encoding)
+    
+    stream = io.BufferedReader(_prefixed_stream(head, raw))
+    if (compression == 'gzip'):
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    elif (compression == 'bz2'):
+        stream = bz2.BZ2File(stream, 'rb')
+    elif (compression == 'xz'):
+        stream = lzma.LZMAFile(stream, 'rb')
+    elif (compression == 'zstd'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading zstd-compressed input requires the 'zstandard' module")
+        stream = zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+    
+    if (threaded and (compression != None)):
+        stream = io.BufferedReader(_threaded_reader(stream))
+    return io.TextIOWrapper(stream, encoding=encoding)
+
+def _is_plain_file(path):
+    '''
+    True if 'path' is an uncompressed, seekable regular file, which can be
+    split into byte ranges for parallel conversion or memory-mapped.
+    Pipes, FIFOs (including process substitution) and stdin are not.
+    '''
+    if ((path == '-') or not os.path.isfile(path)):
+        return False
+    with open(path, 'rb') as flo:
+        return (flo.seekable() and (_detect_compression(flo.read(6)) == None))
+
+class fasta_index(object):
+    '''
+    Memory-mapped access to the sequences of an uncompressed FASTA file
+    through its samtools-style .fai index (name, length, offset, bases per
+    line, bytes per line). The index at PATH.fai is reused if it is newer
+    than the FASTA; otherwise it is built from the mapping and saved there
+    if the directory is writable. 'lengths' maps each sequence name to its
+    length. Sequences are never loaded whole: write_sequence() copies them
+    to the output straight from the mapping.
+    '''
+    def __init__(self, path, index_path=None):
+        self.path = path
+        if (index_path == None):
+            index_path = path + '.fai'
+        self._file = open(path, 'rb')
+        self._mmap = None
+        try:
+            if (_detect_compression(self._file.read(6)) != None):
+                raise ValueError("The FASTA file must be uncompressed: " + path)
+            if (os.fstat(self._file.fileno()).st_size == 0):
+                raise ValueError("Empty FASTA file: " + path)
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if (os.path.isfile(index_path) and (os.path.getmtime(index_path) >= os.path.getmtime(path))):
+                self.entries = self._read(index_path)
+            else:
+                self.entries = self._build()
+                try:
+                    self._write(index_path)
+                except OSError:
+                    pass
+        except Exception:
+            self.close()
+            raise
+        self.lengths = {name: entry[0] for name, entry in self.entries.items()}
+    
+    @staticmethod
+    def _read(index_path):
+        entries = {}
+        with open(index_path, 'r') as flo:
+            for line in flo:
+                fields = line.rstrip('\r\n').split('\t')
+                if (len(fields) < 5):
+                    raise ValueError("Malformed FASTA index: " + index_path)
+                entries[fields[0]] = tuple(map(int, fields[1:5]))
+        return entries
+    
+    def _write(self, index_path):
+        with open(index_path, 'w') as flo:
+            for name, entry in self.entries.items():
+                print(name, *entry, sep='\t', file=flo)
+    
+    def _build(self):
+        '''
+        Index every record of the mapped FASTA. Lines are not visited one by
+        one: all but the last line of a sequence must have the width of its
+        first line, which is checked by looking only at the bytes where
+        their newlines should be.
+        '''
+        mm = self._mmap
+        size = len(mm)
+        if (mm[:1] != b'>'):
+            raise ValueError("Not a FASTA file: " + self.path)
+        entries = {}
+        pos = 0
+        with memoryview(mm) as view:
+            while (pos < size):
+                eol = mm.find(b'\n', pos)
+                if (eol == -1):
+                    eol = size
+                fields = mm[pos+1:eol].split(None, 1)
+                if not fields:
+                    raise ValueError("{}: a sequence has no name".format(self.path))
+                name = fields[0].decode('utf-8')
+                offset = min(eol + 1, size)
+                end = mm.find(b'\n>', eol)
+                end = size if (end == -1) else end + 1
+                
+                first_eol = mm.find(b'\n', offset, end)
+                if (first_eol == -1):
+                    # One line, without a newline at the end of the file
+                    line_bases = end - offset
+                    line_width = line_bases + 1
+                else:
+                    line_width = first_eol + 1 - offset
+                    line_bases = len(mm[offset:first_eol].rstrip(b'\r'))
+                if (line_bases == 0):
+                    if mm[offset:end].strip():
+                        raise ValueError("{}: {} has an empty line".format(self.path, name))
+                    length = 0
+                else:
+                    full, rest = divmod(end - offset, line_width)
+                    with view[offset+line_width-1:offset+full*line_width:line_width] as ends:
+                        newlines = ends.tobytes()
+                    last = mm[offset+full*line_width:end]
+                    if (newlines.strip(b'\n') or (b'\n' in last.rstrip(b'\r\n'))):
+                        raise ValueError("{}: the lines of {} have different lengths".format(self.path, name))
+                    length = full*line_bases + len(last.rstrip(b'\r\n'))
+                if (name in entries):
+                    raise ValueError("{}: {} appears twice".format(self.path, name))
+                entries[name] = (length, offset, line_bases, line_width)
+                pos = end
+        return entries
+    
+    def write_sequence(self, name, outfile, chunk_size=1024*1024):
+        '''
+        Write the sequence 'name' as a FASTA record to 'outfile', in chunks
+        of about 'chunk_size' bytes sliced from the mapping. Binary outputs
+        (a bgzf_writer, or the buffer under a text file) get the slices
+        themselves; other text streams get them decoded chunk by chunk.
+        Lines keep their width in the FASTA file, and end with a newline.
+        '''
+        if hasattr(outfile, 'buffer'):
+            outfile.flush()
+            write = outfile.buffer.write
+        elif isinstance(outfile, bgzf_writer):
+            write = outfile.write
+        else:
+            write = lambda data: outfile.write(str(data, 'latin-1'))
+        length, offset, line_bases, line_width = self.entries[name]
+        write(b'>' + name.encode('utf-8') + b'\n')
+        if (length == 0):
+            return
+        full, rest = divmod(length, line_bases)
+        end = offset + full*line_width + rest
+        # Whole lines per chunk
+        lines = max(1, chunk_size // line_width)
+        with memoryview(self._mmap) as view:
+            if (line_width == line_bases + 1):
+                step = lines*line_width
+                for start in range(offset, end, step):
+                    write(view[start:min(start + step, end)])
+                if (self._mmap[end-1:end] != b'\n'):
+                    write(b'\n')
+            else:
+                # CR LF line ends are rewritten as LF
+                starts = range(offset, end, line_width)
+                for i in range(0, len(starts), lines):
+                    chunk = [view[start:min(start + line_bases, end)] for start in starts[i:i+lines]]
+                    chunk.append(b'')
+                    write(b'\n'.join(chunk))
+    
+    def close(self):
+        if (self._mmap != None):
+            self._mmap.close()
+        self._file.close()
     
-    line_count = 0
-    with open(sys.argv[1], 'r') as flo:
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _input_seqids(path):
+    '''
+    Return the SEQ_NAME values of the MochiView file at 'path', in the
+    order they first appear. Only that column is split off each line.
+    '''
+    seqids = {}
+    with open_input(path) as flo:
+        columns = _header_columns(next(flo, None))
+        column = SEQ_NAME if (columns == None) else columns.index('SEQ_NAME')
         for line in flo:
-            if (line_count > 0):
-                f = feature_parser(line, sys.argv[2]) # 'mochiview2gff-Tuch-et-al-2010'
-                print(f)
-            line_count += 1
+            fields = line.split('\t', column + 1)
+            if (len(fields) > column):
+                seqids[fields[column]] = None
+    return list(seqids)
+
+def _bounded_row_parser(parse_row, lengths):
+    '''
+    Wrap the row parser 'parse_row' so that a row on a sequence missing
+    from 'lengths' (sequence name to length), or ending after the end of
+    its sequence, raises invalid_row. The other coordinates are checked
+    against END by _row_problems().
+    '''
+    def parse_bounded_row(line):
+        sline = parse_row(line)
+        length = lengths.get(sline[SEQ_NAME])
+        if (length == None):
+            raise invalid_row([('sequence', "Unknown sequence: {!r} is not in the FASTA file".format(sline[SEQ_NAME]))], sline[FEATURE_NAME])
+        if (sline[END] > length):
+            raise invalid_row([('sequence_end', "END {} is after the end of {} ({} bp)".format(sline[END], sline[SEQ_NAME], length))], sline[FEATURE_NAME])
+        return sline
+    return parse_bounded_row
+
+def _chunk_offsets(path, chunk_size):
+    '''
+    Split the file at 'path' into byte ranges of roughly 'chunk_size' bytes.
+    Every range ends just after a newline, so no line straddles two ranges.
+    Returns a list of (start, end) tuples.
+    '''
+    size = os.path.getsize(path)
+    offsets = []
+    with open(path, 'rb') as flo:
+        start = 0
+        while (start < size):
+            flo.seek(start + chunk_size)
+            flo.readline()
+            end = min(flo.tell(), size)
+            offsets.append((start, end))
+            start = end
+    return offsets
+
+def _convert_chunk(path, start, end, source, engine='python', instrument=False, header=''):
+    '''
+    Worker function for parallel conversion. Converts the lines within bytes
+    [start, end) of 'path', whose columns are named by the file's 'header'
+    line, and returns the GFF text. The chunk that begins the file reads
+    the header line itself. With 'instrument', returns a (text,
+    conversion_stats dict) tuple instead.
+    '''
+    with open(path, 'rb') as flo:
+        flo.seek(start)
+        data = flo.read(end - start)
+    
+    with io.TextIOWrapper(io.BytesIO(data)) as flo:
+        if (start == 0):
+            header = next(flo, '')
+        return _convert_lines(flo, source, engine, instrument, header)
+
+def _convert_lines(lines, source, engine='python', instrument=False, header=''):
+    '''
+    Worker function for parallel conversion of a batch of data lines from a
+    file with the given 'header' line. Returns the GFF text, or with
+    'instrument' a (text, conversion_stats dict) tuple.
+    '''
+    out = io.StringIO()
+    stats = conversion_stats() if instrument else None
+    convert(itertools.chain([header], lines), out, source, engine, stats)
+    if instrument:
+        return out.getvalue(), stats.as_dict()
+    return out.getvalue()
+
+def _read_header(path):
+    '''
+    Return the header line of the uncompressed MochiView file at 'path'
+    '''
+    with open(path, 'r') as flo:
+        return flo.readline()
+
+def _line_batches(infile, batch_size):
+    '''
+    Generator yielding lists of data lines from the text stream 'infile',
+    each holding about 'batch_size' characters. The header line must
+    already have been consumed.
+    '''
+    batch = []
+    size = 0
+    for line in infile:
+        batch.append(line)
+        size += len(line)
+        if (size >= batch_size):
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+def convert_parallel(path, source, outfile, jobs, engine='python', stats=None, chunk_size=4*1024*1024):
+    '''
+    Convert the MochiView file at 'path' using a pool of 'jobs' processes,
+    writing GFF to the 'outfile' text stream. Output is written in input
+    order and is identical to the serial conversion. At most 2*jobs chunks
+    are in flight at any time, so memory use does not grow with file size.
+    
+    Uncompressed files are split into byte ranges that the workers read
+    themselves. Compressed input and stdin ('-') are read by this process
+    and sent to the workers in batches of lines.
+    
+    If a conversion_stats is given as 'stats', the workers are instrumented
+    and their counters are merged into it.
+    '''
+    def write(result):
+        if (stats != None):
+            result, worker_stats = result
+            stats.merge(worker_stats)
+        outfile.write(result)
+    
+    import multiprocessing
+    pending = collections.deque()
+    with multiprocessing.Pool(jobs) as pool:
+        if _is_plain_file(path):
+            header = _read_header(path)
+            tasks = ((_convert_chunk, (path, start, end, source, engine, stats != None, header)) for start, end in _chunk_offsets(path, chunk_size))
+            infile = None
+        else:
+            infile = open_input(path)
+            header = next(infile, '')
+            tasks = ((_convert_lines, (lines, source, engine, stats != None, header)) for lines in _line_batches(infile, chunk_size))
+        for function, task_args in tasks:
+            if (len(pending) >= 2*jobs):
+                write(pending.popleft().get())
+            pending.append(pool.apply_async(function, task_args))
+        while pending:
+            write(pending.popleft().get())
+        if (infile != None):
+            infile.close()
+
+def _convert_file(path, output, source, engine='python'):
+    '''
+    Worker function for batch conversion of a file that cannot be split
+    into byte ranges (compressed input). Writes the GFF to 'output'.
+    '''
+    with open_input(path, threaded=False) as infile, open(output, 'w') as outfile:
+        convert(infile, outfile, source, engine)
+
+def _batch_output(path, output_dir=None):
+    '''
+    Default output path for a batch input: the input name with its
+    compression and '.txt' extensions replaced by '.gff'
+    '''
+    name = os.path.basename(path)
+    for extension in ('.gz', '.bgz', '.bz2', '.xz', '.zst', '.txt', '.tsv'):
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    if (output_dir == None):
+        output_dir = os.path.dirname(path)
+    return os.path.join(output_dir, name + '.gff')
+
+def read_manifest(path, output_dir=None):
+    '''
+    Read a batch manifest: one 'input<TAB>source[<TAB>output]' entry per
+    line. Blank lines and lines starting with '#' are ignored. Returns a
+    list of (input, source, output) tuples.
+    '''
+    jobs = []
+    with open(path, 'r') as flo:
+        for line_number, line in enumerate(flo, 1):
+            line = line.rstrip('\r\n')
+            if ((line.strip() == '') or line.startswith('#')):
+                continue
+            fields = line.split('\t')
+            if (len(fields) == 2):
+                fields.append(_batch_output(fields[0], output_dir))
+            elif (len(fields) != 3):
+                raise ValueError("{}:{}: expected 'input<TAB>source[<TAB>output]'".format(path, line_number))
+            jobs.append(tuple(fields))
+    return jobs
+
+def convert_batch(jobs, workers, engine='python', chunk_size=4*1024*1024):
+    '''
+    Convert many MochiView files with one shared pool of 'workers' processes.
+    'jobs' is a list of (input, source, output) tuples. Files are scheduled
+    largest first, and uncompressed files are split into byte ranges so a
+    single large file is spread over the whole pool. Each output is written
+    to a temporary file in its destination directory and renamed into place
+    once complete. Raises ValueError, before converting anything, if two
+    jobs have the same output.
+    
+    A failure in one file does not stop the others. Returns a dict mapping
+    the input path of every failed job to its exception.
+    '''
+    outputs = {}
+    for path, source, output in jobs:
+        key = os.path.normcase(os.path.abspath(output))
+        if (key in outputs):
+            raise ValueError("{} and {} would both be converted to {}".format(outputs[key], path, output))
+        outputs[key] = path
+    # Temporary files get the permissions a plain open() would have given
+    # the output
+    umask = os.umask(0)
+    os.umask(umask)
+    errors = {}
+    files = []
+    for path, source, output in jobs:
+        try:
+            files.append((os.path.getsize(path), path, source, output))
+        except OSError as e:
+            errors[path] = e
+    files.sort(key=lambda f: -f[0])
+    
+    def tasks():
+        for size, path, source, output in files:
+            state = {'path': path, 'output': output, 'temp': None, 'handle': None, 'failed': False}
+            try:
+                handle, state['temp'] = tempfile.mkstemp(prefix=os.path.basename(output) + '.', suffix='.tmp',
+                    dir=os.path.dirname(output) or '.')
+                os.close(handle)
+                os.chmod(state['temp'], 0o666 & ~umask)
+                if _is_plain_file(path):
+                    header = _read_header(path)
+                    offsets = _chunk_offsets(path, chunk_size) or [(0, 0)]
+                    for i, (start, end) in enumerate(offsets):
+                        yield state, (i == len(offsets)-1), _convert_chunk, (path, start, end, source, engine, False, header)
+                else:
+                    yield state, True, _convert_file, (path, state['temp'], source, engine)
+            except OSError as e:
+                errors[path] = e
+                if ((state['temp'] != None) and os.path.exists(state['temp'])):
+                    os.remove(state['temp'])
+    
+    def finish(state, last, result):
+        if state['failed']:
+            return
+        error = None
+        try:
+            text = result.get()
+        except Exception as e:
+            error = e
+        else:
+            try:
+                # Chunk tasks return text; whole-file tasks write the
+                # temporary file themselves
+                if (text != None):
+                    if (state['handle'] == None):
+                        state['handle'] = open(state['temp'], 'w')
+                    state['handle'].write(text)
+                if last:
+                    if (state['handle'] != None):
+                        state['handle'].close()
+                    os.replace(state['temp'], state['output'])
+            except OSError as e:
+                error = e
+        if (error != None):
+            state['failed'] = True
+            errors[state['path']] = error
+            if (state['handle'] != None):
+                state['handle'].close()
+            if os.path.exists(state['temp']):
+                os.remove(state['temp'])
+    
+    import multiprocessing
+    pending = collections.deque()
+    with multiprocessing.Pool(workers) as pool:
+        for state, last, function, task_args in tasks():
+            if (len(pending) >= 2*workers):
+                finish(*pending.popleft())
+            if not state['failed']:
+                pending.append((state, last, pool.apply_async(function, task_args)))
+        while pending:
+            finish(*pending.popleft())
+    return errors
+
+# Conversion server protocol. The client sends one JSON line such as
+# {"source": "mochiview2gff-Tuch-et-al-2010", "engine": "python"}, then the
+# MochiView table (including its header line) as UTF-8, and closes its
+# writing side. The server answers with frames of a one-byte type and a
+# big-endian length: b'D' carries GFF text, b'E' an error message that ends
+# the response, and b'Z' (empty) marks a successful end.
+_FRAME = struct.Struct('>cI')
+
+def _server_lines(lines, source, engine, header):
+    '''
+    Worker function for the conversion server: _convert_lines() on data
+    lines and header given as UTF-8 bytes, returning the GFF as bytes
+    '''
+    return _convert_lines([line.decode('utf-8') for line in lines], source, engine, False, header.decode('utf-8')).encode('utf-8')
+
+class conversion_server(object):
+    '''
+    asyncio server that keeps the converter loaded and converts MochiView
+    tables sent over the Unix domain socket at 'path' (--serve). Requests
+    are handled concurrently. Each one is converted in batches of about
+    'batch_size' bytes, and every batch is sent back as soon as it is
+    converted. Input is not read while the client is slow to take the
+    output, so a request never buffers more than a batch or two.
+    
+    Batches are converted outside the event loop, so that a large batch
+    does not stall the other connections: in a worker thread, or with
+    'jobs' above 1 in a pool of that many processes.
+    '''
+    def __init__(self, path, engine='python', jobs=1, batch_size=256*1024):
+        self.path = path
+        self.engine = engine
+        self.batch_size = batch_size
+        self.requests = 0
+        self.failures = 0
+        if (jobs > 1):
+            self.pool = concurrent.futures.ProcessPoolExecutor(jobs)
+        else:
+            self.pool = concurrent.futures.ThreadPoolExecutor(1)
+    
+    async def _send(self, writer, kind, data=b''):
+        writer.write(_FRAME.pack(kind, len(data)))
+        writer.write(data)
+        await writer.drain()
+    
+    async def _convert(self, lines, source, engine, header):
+        '''
+        Convert a batch of data lines, as bytes, and return the GFF as bytes
+        '''
+        if (engine == 'bytes'):
+            function, task_args = _convert_bytes_lines, (lines, source, header)
+        else:
+            function, task_args = _server_lines, (lines, source, engine, header)
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, function, *task_args)
+    
+    async def handle(self, reader, writer):
+        '''
+        Serve one request on the connection ('reader', 'writer')
+        '''
+        self.requests += 1
+        try:
+            header = json.loads(await reader.readline())
+            source = header['source']
+            engine = header.get('engine', self.engine)
+            if (engine not in ('python', 'numpy', 'auto', 'bytes')):
+                raise ValueError("unknown engine {!r}".format(engine))
+            
+            header = await reader.readline()
+            row_parser(header) # Reject a header without the required columns up front
+            batch = []
+            size = 0
+            while True:
+                line = await reader.readline()
+                if line:
+                    batch.append(line)
+                    size += len(line)
+                if (batch and ((not line) or (size >= self.batch_size))):
+                    await self._send(writer, b'D', await self._convert(batch, source, engine, header))
+                    batch = []
+                    size = 0
+                if not line:
+                    break
+            await self._send(writer, b'Z')
+        except ConnectionError:
+            self.failures += 1
+        except Exception as e:
+            self.failures += 1
+            try:
+                await self._send(writer, b'E', str(e).encode('utf-8'))
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+    
+    async def run(self):
+        '''
+        Listen on the socket until cancelled, or until SIGINT or SIGTERM
+        '''
+        import asyncio
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.cancel)
+        server = await asyncio.start_unix_server(self.handle, self.path, limit=16*1024*1024)
+        try:
+            async with server:
+                await stop
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.pool.shutdown()
+    
+    def summary(self):
+        return '{__program__} server: {requests} requests, {failures} failed'.format(
+            requests=self.requests, failures=self.failures, **globals())
+
+def request(path, infile, outfile, source, engine='python', block_size=1024*1024):
+    '''
+    Convert the MochiView text stream 'infile' (including its header line)
+    with the conversion server listening on the Unix domain socket 'path'
+    (--connect), writing the GFF to the text stream 'outfile' as it arrives.
+    Raises ValueError with the server's message if the conversion fails.
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        
+        # Send from a thread while reading the response here, as the server
+        # stops reading input until its output has been taken
+        def send():
+            try:
+                sock.sendall(json.dumps({'source': source, 'engine': engine}).encode('utf-8') + b'\n')
+                while True:
+                    data = infile.read(block_size)
+                    if not data:
+                        break
+                    sock.sendall(data.encode('utf-8'))
+                sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                # The server has ended the request early; its response
+                # says why
+                pass
+        sender = threading.Thread(target=send, daemon=True)
+        sender.start()
+        
+        with sock.makefile('rb') as response:
+            while True:
+                head = response.read(_FRAME.size)
+                if (len(head) < _FRAME.size):
+                    raise ConnectionError("conversion server closed the connection")
+                kind, length = _FRAME.unpack(head)
+                data = response.read(length)
+                if (kind == b'D'):
+                    outfile.write(data.decode('utf-8'))
+                elif (kind == b'E'):
+                    raise ValueError(data.decode('utf-8'))
+                else:
+                    break
+        sender.join()
+
+def _report_validation(validator, report=None, error=None):
+    '''
+    Report the rows rejected by the row_validator 'validator', and the
+    invalid_row 'error' if one stopped the conversion: as JSON to the path
+    'report' ('-' for stderr) if given, and as messages on stderr. Returns
+    the exit status.
+    '''
+    if ((error != None) and (validator.invalid_rows == 0)):
+        # Raised by a --jobs worker, which has no validator
+        validator.invalid_rows += 1
+        for check, message in error.problems:
+            validator.problems.append({'line': error.line_number, 'feature': error.feature, 'check': check, 'message': message})
+    if report:
+        if (report == '-'):
+            json.dump(validator.as_dict(), sys.stderr, indent=2)
+            print(file=sys.stderr)
+        else:
+            with open(report, 'w') as flo:
+                json.dump(validator.as_dict(), flo, indent=2)
+    if (error != None):
+        print('{__program__}: {error}'.format(error=error, **globals()), file=sys.stderr)
+        return 1
+    if validator.problems:
+        # The report already lists the problems
+        print(validator.summary(0 if report else 20), file=sys.stderr)
+        if (validator.mode == 'collect'):
+            return 1
+    return 0
+
+# Options (argparse destinations) that --serve, batch mode and the
+# memory-mapped path of the 'bytes' engine do not support
+_BATCH_EXCLUDED = ('input', 'connect', 'sort', 'output', 'bgzf', 'stats', 'stats_json', 'profile', 'cache', 'group_isoforms',
+    'gtf', 'bed', 'fasta', 'shard_dir', 'validation_report')
+_SERVE_EXCLUDED = ('batch', 'manifest') + _BATCH_EXCLUDED
+_MMAP_EXCLUDED = ('sort', 'bgzf', 'cache', 'connect', 'group_isoforms', 'gtf', 'bed', 'fasta', 'shard_dir')
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog=__program__,
+        description="Convert a MochiView annotation file to GFF3. The GFF is written to stdout.",
+        usage="python3 {__program__} [-j N] MochiViewAnnotations.txt source > MochiViewAnnotations.gff\n"
+            "       python3 {__program__} [-j N] (--batch INPUT SOURCE ... | --manifest FILE) [--output-dir DIR]\n"
+            "       python3 {__program__} [-j N] --serve SOCKET\n"
+            "       python3 {__program__} --connect SOCKET MochiViewAnnotations.txt source > MochiViewAnnotations.gff".format(**globals()),
+    )
+    parser.add_argument("input", nargs='?', help="MochiView annotation file, optionally gzip/bzip2/xz/zstd compressed ('-' for stdin)")
+    parser.add_argument("source", nargs='?', help="value for the GFF 'source' column (e.g. 'mochiview2gff-Tuch-et-al-2010')")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+        help="number of worker processes (default: 1)")
+    parser.add_argument("--engine", choices=['python', 'numpy', 'auto', 'bytes'], default='python',
+        help="conversion engine; 'numpy' vectorizes batches of rows and falls back to 'python' when NumPy is not installed; "
+            "'auto' picks the fastest, currently 'python'; "
+            "'bytes' memory-maps the input and converts it without decoding, and falls back to 'python' for compressed or "
+            "piped input and with --jobs, --sort, --bgzf, --stats, --profile, --cache, --group-isoforms, --gtf, --bed, "
+            "--fasta or --shard-dir (default: python)")
+    parser.add_argument("-s", "--sort", action="store_true",
+        help="sort the output by seqid and start, keeping each gene's features together (with --index, every line is "
+            "sorted by start, as tabix requires)")
+    parser.add_argument("--sort-memory", type=int, default=512, metavar="MB",
+        help="memory used to buffer features before spilling sorted runs to disk with --sort (default: 512)")
+    parser.add_argument("--group-isoforms", choices=['adjacent', 'any'], metavar="MODE",
+        help="merge rows sharing a FEATURE_NAME into one gene with numbered transcripts, using the ISOFORM_NAME and "
+            "IS_PRIMARY columns if present; 'adjacent' streams input whose rows are grouped by gene, 'any' accepts "
+            "rows in any order")
+    parser.add_argument("--group-memory", type=int, default=512, metavar="MB",
+        help="memory used to buffer rows before spilling them to disk with '--group-isoforms any' (default: 512)")
+    parser.add_argument("--tmpdir", metavar="DIR",
+        help="directory for temporary files (default: system temporary directory)")
+    parser.add_argument("-o", "--output", metavar="PATH",
+        help="write the GFF to PATH instead of stdout")
+    parser.add_argument("--gtf", metavar="PATH",
+        help="also write the genes as GTF, with gene_id and transcript_id attributes, to PATH in the same pass")
+    parser.add_argument("--bed", metavar="PATH",
+        help="also write the transcripts as BED12, with the CDS as the thick part, to PATH in the same pass")
+    parser.add_argument("--fasta", metavar="PATH",
+        help="reference FASTA file (uncompressed) of the genome: adds ##gff-version and ##sequence-region lines for the "
+            "sequences in the input, and makes rows on other sequences or past their end bad rows; its index is read "
+            "from PATH.fai, or built and saved there; the input must be a file, not stdin or a pipe")
+    parser.add_argument("--embed-fasta", action="store_true",
+        help="append those sequences to the GFF in a ##FASTA section (requires --fasta)")
+    parser.add_argument("--shard-dir", metavar="DIR",
+        help="write the GFF of each seqid to its own file in DIR instead, with a manifest.tsv of the files, their "
+            "feature counts and the range they cover")
+    parser.add_argument("--shard-files", type=int, default=128, metavar="N",
+        help="most shard files kept open at once with --shard-dir (default: 128)")
+    parser.add_argument("--bgzf", action="store_true",
+        help="compress the output with BGZF, as used by tabix")
+    parser.add_argument("--index", action="store_true",
+        help="also write a tabix index to PATH.tbi (requires --bgzf, --sort and --output)")
+    parser.add_argument("--threads", type=int, default=1, metavar="N",
+        help="number of threads compressing BGZF blocks, or writing shards with --shard-dir (default: 1)")
+    parser.add_argument("--stats", action="store_true",
+        help="time each conversion stage, count rows, features and bytes, and print a summary to stderr")
+    parser.add_argument("--stats-json", metavar="PATH",
+        help="write the --stats summary as JSON to PATH instead ('-' for stderr)")
+    parser.add_argument("--profile", type=int, default=0, metavar="ROWS",
+        help="run the first ROWS rows under cProfile and tracemalloc and print the reports to stderr")
+    parser.add_argument("--cache", metavar="PATH",
+        help="reuse the GFF of unchanged rows from the conversion cache database at PATH, and add new rows to it")
+    parser.add_argument("--cache-size", type=int, default=1024, metavar="MB",
+        help="size limit of the conversion cache; least recently used rows are evicted beyond it, and a row whose GFF "
+            "alone is larger is not cached. Reruns only hit the cache if the GFF of the input fits in it (default: 1024)")
+    parser.add_argument("--batch", nargs=2, action="append", default=[], metavar=("INPUT", "SOURCE"),
+        help="convert INPUT to a .gff file in batch mode; may be given many times")
+    parser.add_argument("--manifest", metavar="FILE",
+        help="convert every 'input<TAB>source[<TAB>output]' entry of FILE in batch mode")
+    parser.add_argument("--output-dir", metavar="DIR",
+        help="directory for batch outputs without an explicit path (default: next to each input)")
+    parser.add_argument("--validate", choices=row_validator.MODES, default='fail',
+        help="what to do with bad rows (unknown strand, wrong EXON_COUNT, coordinates out of order or outside the gene, "
+            "transcript or exons, unparsable values): 'fail' stops at the first one, 'skip' leaves them out and lists them, "
+            "'collect' does the same but exits with status 1 (default: fail)")
+    parser.add_argument("--validation-report", metavar="PATH",
+        help="write the bad rows found, with their line numbers and problems, as JSON to PATH ('-' for stderr)")
+    parser.add_argument("--serve", metavar="SOCKET",
+        help="run a conversion server listening on the Unix domain socket SOCKET until interrupted")
+    parser.add_argument("--connect", metavar="SOCKET",
+        help="convert the input with the conversion server listening on SOCKET")
+    args = parser.parse_args()
+    
+    if (args.jobs < 1):
+        parser.error("--jobs must be at least 1")
+    
+    if args.serve:
+        if (any(getattr(args, name) for name in _SERVE_EXCLUDED) or (args.validate != 'fail')):
+            parser.error("--serve only supports --jobs and --engine")
+        server = conversion_server(args.serve, args.engine, args.jobs)
+        print('{__program__}: serving on {path}'.format(path=args.serve, **globals()), file=sys.stderr)
+        import asyncio
+        asyncio.run(server.run())
+        print(server.summary(), file=sys.stderr)
+        return
+    if (args.batch or args.manifest):
+        if (any(getattr(args, name) for name in _BATCH_EXCLUDED) or (args.validate != 'fail')):
+            parser.error("batch mode only supports --jobs, --engine and --output-dir")
+        jobs = [(path, source, _batch_output(path, args.output_dir)) for path, source in args.batch]
+        if args.manifest:
+            try:
+                jobs.extend(read_manifest(args.manifest, args.output_dir))
+            except (OSError, ValueError) as e:
+                parser.error(str(e))
+        try:
+            errors = convert_batch(jobs, args.jobs, args.engine)
+        except ValueError as e:
+            parser.error(str(e))
+        for path in errors:
+            print('{__program__}: {path}: {error}'.format(path=path, error=errors[path], **globals()), file=sys.stderr)
+        if errors:
+            sys.exit(1)
+        return
+    if (args.source == None):
+        parser.error("the following arguments are required: input, source")
+    if (args.sort_memory < 1):
+        parser.error("--sort-memory must be at least 1")
+    if (args.threads < 1):
+        parser.error("--threads must be at least 1")
+    if (args.index and not (args.bgzf and args.sort and args.output)):
+        parser.error("--index requires --bgzf, --sort and --output")
+    if (args.profile and (args.jobs > 1)):
+        parser.error("--profile cannot be combined with --jobs")
+    if (args.cache and ((args.jobs > 1) or args.stats or args.stats_json or args.profile)):
+        parser.error("--cache cannot be combined with --jobs, --stats or --profile")
+    if (args.connect and ((args.jobs > 1) or args.stats or args.stats_json or args.profile or args.cache)):
+        parser.error("--connect cannot be combined with --jobs, --stats, --profile or --cache")
+    if (args.group_isoforms and ((args.jobs > 1) or args.stats or args.stats_json or args.profile or args.cache or args.connect)):
+        parser.error("--group-isoforms cannot be combined with --jobs, --stats, --profile, --cache or --connect")
+    if (args.group_memory < 1):
+        parser.error("--group-memory must be at least 1")
+    if ((args.gtf or args.bed) and ((args.jobs > 1) or args.stats or args.stats_json or args.profile or args.cache or args.connect or args.group_isoforms)):
+        parser.error("--gtf and --bed cannot be combined with --jobs, --stats, --profile, --cache, --connect or --group-isoforms")
+    if (args.fasta and ((args.jobs > 1) or args.cache or args.connect)):
+        parser.error("--fasta cannot be combined with --jobs, --cache or --connect")
+    if (args.fasta and ((args.input == '-') or (os.path.exists(args.input) and not os.path.isfile(args.input)))):
+        # The input is read once for its sequences and again to convert it
+        parser.error("--fasta requires an input file, not stdin or a pipe")
+    if (args.embed_fasta and not args.fasta):
+        parser.error("--embed-fasta requires --fasta")
+    if (args.embed_fasta and args.index):
+        parser.error("--embed-fasta cannot be combined with --index")
+    if (args.shard_dir and (args.output or args.bgzf or args.embed_fasta)):
+        parser.error("--shard-dir cannot be combined with --output, --bgzf or --embed-fasta")
+    if (args.shard_files < 1):
+        parser.error("--shard-files must be at least 1")
+    if ((args.validate != 'fail') and ((args.jobs > 1) or args.connect)):
+        parser.error("--validate {} cannot be combined with --jobs or --connect".format(args.validate))
+    
+    if (args.stats or args.stats_json or args.profile):
+        stats = conversion_stats()
+        started = time.perf_counter()
+    else:
+        stats = None
+    
+    validator = row_validator(args.validate)
+    if args.fasta:
+        try:
+            fasta = fasta_index(args.fasta)
+            seqids = [seqid for seqid in _input_seqids(args.input) if (seqid in fasta.lengths)]
+        except (OSError, ValueError) as e:
+            print('{__program__}: {error}'.format(error=e, **globals()), file=sys.stderr)
+            sys.exit(1)
+        sequence_lengths = fasta.lengths
+    else:
+        fasta = None
+        sequence_lengths = None
+    if ((args.engine == 'bytes') and (args.jobs == 1) and (stats == None) and
+            not any(getattr(args, name) for name in _MMAP_EXCLUDED) and (args.input != '-') and _is_plain_file(args.input)):
+        try:
+            if args.output:
+                with open(args.output, 'wb') as outfile:
+                    convert_mmap(args.input, outfile, args.source, validator)
+            else:
+                convert_mmap(args.input, sys.stdout.buffer, args.source, validator)
+        except invalid_row as e:
+            sys.exit(_report_validation(validator, args.validation_report, e))
+        except ValueError as e:
+            # A header without a required column
+            print('{__program__}: {error}'.format(error=e, **globals()), file=sys.stderr)
+            sys.exit(1)
+        status = _report_validation(validator, args.validation_report)
+        if status:
+            sys.exit(status)
+        return
+    
+    index = tabix_index() if args.index else None
+    if args.shard_dir:
+        target = outfile = shard_writer(args.shard_dir, args.shard_files, args.threads)
+    elif args.bgzf:
+        if args.output:
+            target = open(args.output, 'wb')
+        else:
+            target = sys.stdout.buffer
+        outfile = bgzf_writer(target, index, args.threads)
+    elif args.output:
+        target = outfile = open(args.output, 'w')
+    else:
+        target = outfile = sys.stdout
+    
+    if (fasta != None):
+        outfile.write('##gff-version 3\n' + ''.join(['##sequence-region {} 1 {}\n'.format(seqid, fasta.lengths[seqid]) for seqid in seqids]))
+    
+    if args.sort:
+        sink = outfile
+        outfile = sorted_writer(sink, args.sort_memory*1024*1024, args.tmpdir, by_line=args.index)
+    
+    try:
+        if args.connect:
+            try:
+                with open_input(args.input) as flo:
+                    request(args.connect, flo, outfile, args.source, args.engine)
+            except (OSError, ValueError) as e:
+                print('{__program__}: {error}'.format(error=e, **globals()), file=sys.stderr)
+                sys.exit(1)
+        elif args.cache:
+            cache = conversion_cache(args.cache, args.cache_size*1024*1024)
+            try:
+                with open_input(args.input) as flo:
+                    convert_cached(flo, outfile, args.source, cache, validator=validator)
+            finally:
+                cache.close()
+            print(cache.summary(), file=sys.stderr)
+        elif (args.jobs > 1):
+            convert_parallel(args.input, args.source, outfile, args.jobs, args.engine, stats)
+        elif (args.gtf or args.bed):
+            outfiles = {'gff': outfile}
+            try:
+                if args.gtf:
+                    outfiles['gtf'] = open(args.gtf, 'w')
+                if args.bed:
+                    outfiles['bed'] = open(args.bed, 'w')
+                with open_input(args.input) as flo:
+                    convert_formats(flo, outfiles, args.source, validator, sequence_lengths=sequence_lengths)
+            finally:
+                for name in ('gtf', 'bed'):
+                    if (name in outfiles):
+                        outfiles[name].close()
+        elif args.group_isoforms:
+            grouper = isoform_grouper(args.group_isoforms, args.group_memory*1024*1024, args.tmpdir)
+            with open_input(args.input) as flo:
+                convert(flo, outfile, args.source, grouper=grouper, validator=validator, sequence_lengths=sequence_lengths)
+        else:
+            with open_input(args.input) as flo:
+                convert(flo, outfile, args.source, args.engine, stats, args.profile, validator=validator,
+                    sequence_lengths=sequence_lengths) # 'mochiview2gff-Tuch-et-al-2010'
+    except invalid_row as e:
+        sys.exit(_report_validation(validator, args.validation_report, e))
+    except ValueError as e:
+        print('{__program__}: {error}'.format(error=e, **globals()), file=sys.stderr)
+        sys.exit(1)
+    
+    finishing = time.perf_counter()
+    if args.sort:
+        outfile.close()
+        outfile = sink
+    if (fasta != None):
+        if args.embed_fasta:
+            outfile.write('##FASTA\n')
+            for seqid in seqids:
+                fasta.write_sequence(seqid, outfile)
+        fasta.close()
+    if args.bgzf:
+        outfile.close()
+    if (target != sys.stdout) and (target != sys.stdout.buffer):
+        target.close()
+    if (index != None):
+        index.write(args.output + '.tbi')
+    
+    if (stats != None):
+        # Sorting, compression and indexing finish after the last row
+        stats.seconds['write'] += time.perf_counter() - finishing
+        stats.wall = time.perf_counter() - started
+        if args.stats_json:
+            if (args.stats_json == '-'):
+                json.dump(stats.as_dict(), sys.stderr, indent=2)
+                print(file=sys.stderr)
+            else:
+                with open(args.stats_json, 'w') as flo:
+                    json.dump(stats.as_dict(), flo, indent=2)
+        else:
+            print(stats.summary(), file=sys.stderr)
+    
+    status = _report_validation(validator, args.validation_report)
+    if status:
+        sys.exit(status)
     
     # Force encoding
     # with open('temp.new', 'w', encoding="ascii") as out:
@@ -0,0 +1,958 @@
+#!/usr/bin/env python3
+
+"""
+Tests for mochiview2gff. Run from the repository root with:
+
+ python3 -m pytest tests
+"""
+
+import sys
+import os
+import io
+import random
+import time
+import tempfile
+import unittest
+import unittest.mock
+import concurrent.futures
+import subprocess
+import hashlib
+import json
+import gzip
+import bz2
+import lzma
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import mochiview2gff
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+SCRIPT = os.path.join(ROOT, 'mochiview2gff.py')
+DATA = os.path.join(ROOT, 'tests', 'data')
+SOURCE = 'mochiview2gff'
+
+def data_path(name):
+    return os.path.join(DATA, name)
+
+def read_data(name):
+    with open(data_path(name), 'r', encoding='utf-8', newline='') as flo:
+        return flo.read()
+
+def run_script(*args):
+    '''
+    Run mochiview2gff.py with 'args' and return its stdout as text
+    '''
+    result = subprocess.run([sys.executable, SCRIPT] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return result.stdout.decode('utf-8')
+
+class golden_test(unittest.TestCase):
+    '''
+    tests/data/golden.gff is the output of the original, unoptimized
+    converter for tests/data/golden.txt. Every engine and every way of
+    running the conversion must reproduce it byte for byte.
+    '''
+    ENGINES = ('python', 'numpy', 'auto', 'bytes')
+
+    def setUp(self):
+        self.expected = read_data('golden.gff')
+
+    def test_engines(self):
+        for engine in self.ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(run_script('--engine', engine, data_path('golden.txt'), SOURCE), self.expected)
+
+    def test_jobs(self):
+        for engine in self.ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(run_script('-j', '2', '--engine', engine, data_path('golden.txt'), SOURCE), self.expected)
+
+    def test_parallel_chunks(self):
+        # Small chunks, so the rows are spread over many worker tasks
+        out = io.StringIO()
+        mochiview2gff.convert_parallel(data_path('golden.txt'), SOURCE, out, 2, chunk_size=512)
+        self.assertEqual(out.getvalue(), self.expected)
+
+    def test_convert(self):
+        for engine in ('python', 'numpy'):
+            with self.subTest(engine=engine):
+                out = io.StringIO()
+                with open(data_path('golden.txt'), 'r') as flo:
+                    mochiview2gff.convert(flo, out, SOURCE, engine)
+                self.assertEqual(out.getvalue(), self.expected)
+
+    def test_convert_bytes(self):
+        with open(data_path('golden.txt'), 'rb') as flo:
+            data = flo.read()
+        for chunk_size in (100, 4*1024*1024):
+            with self.subTest(chunk_size=chunk_size):
+                out = io.BytesIO()
+                mochiview2gff.convert_bytes(data, out, SOURCE, chunk_size)
+                self.assertEqual(out.getvalue().decode('utf-8'), self.expected)
+
+    def test_instrumented(self):
+        escape_text = mochiview2gff._escape_text
+        stats = mochiview2gff.conversion_stats()
+        out = io.StringIO()
+        with open(data_path('golden.txt'), 'r') as flo:
+            mochiview2gff._convert_instrumented(flo, out, SOURCE, stats)
+        self.assertEqual(out.getvalue(), self.expected)
+        self.assertIs(mochiview2gff._escape_text, escape_text)
+        self.assertGreater(stats.seconds['escape'], 0)
+
+    def test_feature_parser(self):
+        lines = read_data('golden.txt').splitlines(True)[1:]
+        text = ''.join([str(mochiview2gff.feature_parser(line, SOURCE)) + '\n' for line in lines])
+        self.assertEqual(text, self.expected)
+
+class formats_test(unittest.TestCase):
+    '''
+    tests/data/golden.gtf and golden.bed are the GTF and BED12 output for
+    tests/data/golden.txt, written in the same pass as the GFF
+    '''
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.rows = [line.split('\t') for line in read_data('golden.txt').splitlines()[1:]]
+
+    def test_script(self):
+        gtf, bed = os.path.join(self.tmpdir, 'out.gtf'), os.path.join(self.tmpdir, 'out.bed')
+        self.assertEqual(run_script('--gtf', gtf, '--bed', bed, data_path('golden.txt'), SOURCE), read_data('golden.gff'))
+        for name, path in (('golden.gtf', gtf), ('golden.bed', bed)):
+            with open(path, 'r', encoding='utf-8', newline='') as flo:
+                self.assertEqual(flo.read(), read_data(name), name)
+
+    def test_convert_formats(self):
+        outfiles = {name: io.StringIO() for name in mochiview2gff.OUTPUT_FORMATS}
+        with open(data_path('golden.txt'), 'r') as flo:
+            mochiview2gff.convert_formats(flo, outfiles, SOURCE, batch_rows=7)
+        for name, out in outfiles.items():
+            self.assertEqual(out.getvalue(), read_data('golden.' + name), name)
+
+    def test_minus_strand_exon_number(self):
+        # Exons of a minus-strand gene are numbered from its highest exon
+        row = next(row for row in self.rows if (row[mochiview2gff.STRAND] == '-'))
+        model = mochiview2gff.feature_parser('\t'.join(row), SOURCE)
+        exons = [line.split('\t') for line in model.gtf_lines() if (line.split('\t')[2] == 'exon')]
+        numbers = [int(fields[8].split('exon_number "')[1].split('"')[0]) for fields in exons]
+        self.assertEqual(numbers, list(range(len(exons), 0, -1)))
+        self.assertEqual([int(fields[3]) for fields in exons], sorted(int(fields[3]) for fields in exons))
+
+    def test_bed_blocks(self):
+        for row in self.rows:
+            with self.subTest(feature=row[mochiview2gff.FEATURE_NAME]):
+                fields = mochiview2gff.feature_parser('\t'.join(row), SOURCE).bed_lines()[0].split('\t')
+                chrom_start, chrom_end, thick_start, thick_end = map(int, (fields[1], fields[2], fields[6], fields[7]))
+                sizes = [int(size) for size in fields[10].split(',')[:-1]]
+                starts = [int(start) for start in fields[11].split(',')[:-1]]
+                self.assertEqual(len(sizes), int(fields[9]))
+                self.assertEqual(starts[0], 0)
+                self.assertEqual(starts[-1] + sizes[-1], chrom_end - chrom_start)
+                self.assertEqual(starts, sorted(starts))
+                if (row[mochiview2gff.CDS_START] == ''):
+                    # Non-coding: an empty thick part
+                    self.assertEqual(thick_start, thick_end)
+                else:
+                    self.assertLess(thick_start, thick_end)
+
+class gff_feature_test(unittest.TestCase):
+    def setUp(self):
+        self.fields = ('chr1', SOURCE, 'gene', 10, 20, '.', '+', '.', 'ID=G1')
+        self.feature = mochiview2gff.gff_feature(*self.fields)
+
+    def test_equality(self):
+        self.assertEqual(self.feature, mochiview2gff.gff_feature(*self.fields))
+        self.assertEqual(self.feature, self.fields)
+        self.assertEqual(self.feature, list(self.fields))
+        self.assertNotEqual(self.feature, mochiview2gff.gff_feature(*self.fields[:-1], 'ID=G2'))
+        self.assertNotEqual(self.feature, None)
+        self.assertNotEqual(self.feature, 5)
+        self.assertNotEqual(self.feature, str(self.feature))
+
+    def test_hash(self):
+        self.assertEqual(hash(self.feature), hash(self.fields))
+        self.assertEqual(len({self.feature, mochiview2gff.gff_feature(*self.fields), self.fields}), 1)
+
+class digest_writer(object):
+    '''
+    Text sink that keeps only a SHA-1 digest of what is written to it
+    '''
+    def __init__(self):
+        self.digest = hashlib.sha1()
+
+    def write(self, text):
+        self.digest.update(text.encode('utf-8'))
+
+class feature_batch_test(unittest.TestCase):
+    def setUp(self):
+        self.lines = read_data('golden.txt').splitlines(True)[1:]
+        self.expected = read_data('golden.gff')
+
+    def test_iter_feature_batches(self):
+        batches = list(mochiview2gff.iter_feature_batches(self.lines, SOURCE, batch_size=100))
+        self.assertEqual([len(batch) for batch in batches[:-1]], [100] * (len(batches) - 1))
+        self.assertEqual(''.join([line + '\n' for batch in batches for line in batch.lines()]), self.expected)
+        features = list(mochiview2gff.iter_features(self.lines, SOURCE))
+        self.assertEqual([feature for batch in batches for feature in batch], features)
+
+    def test_attributes(self):
+        features = [mochiview2gff.gff_feature('chr1', SOURCE, 'exon', 1, 2, '.', '+', '.', attributes) for attributes in
+            ('', 'ID=A', 'ID=A;Parent=B', 'Name=N;ID=A;Parent=B;Note=x', 'Name=N;ID=A2;Parent=B;Note=x', 'Note=x;Parent=B',
+            'Name=N;ID=é;Parent=B', 'ID=A;Note=x', 'Name=ID=A;Parent=B')]
+        batch = mochiview2gff.feature_batch(features)
+        self.assertEqual(list(batch), features)
+        self.assertEqual(list(batch.lines()), [str(feature) for feature in features])
+        self.assertEqual(batch[-1], features[-1])
+
+    def test_feature_parser(self):
+        batch = mochiview2gff.feature_batch()
+        for line in self.lines:
+            self.assertIs(mochiview2gff.feature_parser(line, SOURCE).batch(batch), batch)
+        out = io.StringIO()
+        batch.write(out)
+        self.assertEqual(out.getvalue(), self.expected)
+
+def write_table(directory, header, rows):
+    '''
+    Write a MochiView table with the column names 'header' and the cell
+    lists 'rows' to a file in 'directory', and return its path
+    '''
+    path = os.path.join(directory, 'table.txt')
+    with open(path, 'w', encoding='utf-8') as flo:
+        flo.write('\t'.join(header) + '\n')
+        for row in rows:
+            flo.write('\t'.join(row) + '\n')
+    return path
+
+class layout_test(unittest.TestCase):
+    '''
+    Column layouts other than the standard one must give the same GFF for
+    the same rows
+    '''
+    def setUp(self):
+        lines = read_data('golden.txt').splitlines()
+        self.header = lines[0].split('\t')
+        self.rows = [line.split('\t') for line in lines[1:]]
+        self.expected = read_data('golden.gff')
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def assert_converts(self, path, expected, engines=('python', 'numpy', 'bytes')):
+        for engine in engines:
+            with self.subTest(engine=engine):
+                self.assertEqual(run_script('--engine', engine, path, SOURCE), expected)
+
+    def test_blank_is_primary(self):
+        # Only the primary isoform has 'Y'; the last cells of the others are blank
+        rows = [row + (['iso1', 'Y'] if (i % 3 == 0) else ['', '']) for i, row in enumerate(self.rows)]
+        path = write_table(self.tmpdir.name, self.header + ['ISOFORM_NAME', 'IS_PRIMARY'], rows)
+        self.assert_converts(path, self.expected)
+
+    def test_reordered_with_blank_group(self):
+        order = list(range(len(self.header)))
+        random.Random(1).shuffle(order)
+        header = [self.header[i] for i in order] + ['GROUP']
+        rows = [[row[i] for i in order] + ([str(i)] if (i % 2) else ['']) for i, row in enumerate(self.rows)]
+        path = write_table(self.tmpdir.name, header, rows)
+        self.assert_converts(path, self.expected)
+
+    def test_reordered_with_trailing_spaces(self):
+        # Trailing whitespace is stripped from the line whatever the layout
+        order = list(range(len(self.header)))
+        order[mochiview2gff.SEQ_NAME], order[mochiview2gff.START] = order[mochiview2gff.START], order[mochiview2gff.SEQ_NAME]
+        header = [self.header[i] for i in order]
+        rows = [[row[i] for i in order] for row in self.rows]
+        for row in rows:
+            row[-1] += '  '
+        path = write_table(self.tmpdir.name, header, rows)
+        self.assert_converts(path, self.expected)
+
+    def test_missing_strand(self):
+        plus = [row for row in self.rows if (row[mochiview2gff.STRAND] == '+')]
+        out = io.StringIO()
+        mochiview2gff.convert(io.StringIO('\n'.join(['\t'.join(row) for row in [self.header] + plus]) + '\n'), out, SOURCE)
+        strand = mochiview2gff.STRAND
+        path = write_table(self.tmpdir.name, self.header[:strand] + self.header[strand+1:],
+            [row[:strand] + row[strand+1:] for row in plus])
+        self.assert_converts(path, out.getvalue())
+
+    def test_missing_required_column(self):
+        name = mochiview2gff.FEATURE_NAME
+        path = write_table(self.tmpdir.name, self.header[:name] + self.header[name+1:], [row[:name] + row[name+1:] for row in self.rows])
+        result = subprocess.run([sys.executable, SCRIPT, path, SOURCE], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stderr.decode('utf-8'), 'mochiview2gff.py: MochiView header is missing the FEATURE_NAME column(s)\n')
+
+class validation_test(unittest.TestCase):
+    '''
+    --validate fails on, skips or collects bad rows, and
+    --validation-report lists each one by line number and check
+    '''
+    def setUp(self):
+        lines = read_data('golden.txt').splitlines()
+        self.header = lines[0].split('\t')
+        self.rows = [line.split('\t') for line in lines[1:]]
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.checks = {}
+        m = mochiview2gff
+        # A minus-strand row with an unknown strand gets no orientation checks
+        self.breaks(3, ['strand'], STRAND='.')
+        self.breaks(4, ['exon_count'], EXON_COUNT='7')
+        row = self.rows[3]
+        self.breaks(5, ['gene_span', 'transcript_span'], START=row[m.END], END=row[m.START])
+        self.breaks(6, ['transcript_span'], TXN_END=str(int(self.rows[4][m.END]) + 10))
+        row = self.rows[5]
+        exon_starts = row[m.EXON_STARTS].split('|')
+        exon_starts[2] = str(int(row[m.EXON_ENDS].split('|')[2]) + 1)
+        self.breaks(7, ['exon_span'], EXON_STARTS='|'.join(exon_starts))
+        self.breaks(8, ['cds_span'], CDS_END='')
+        self.breaks(9, ['cds_span'], CDS_END=str(int(self.rows[7][m.TXN_END]) + 5))
+        self.breaks(10, ['parse'], START='x')
+        self.path = write_table(self.tmpdir.name, self.header, self.rows)
+
+    def breaks(self, line_number, checks, **cells):
+        '''
+        Set 'cells' of the row on 'line_number', which then fails 'checks'
+        '''
+        row = self.rows[line_number - 2]
+        for name, value in cells.items():
+            row[getattr(mochiview2gff, name)] = value
+        self.checks[line_number] = checks
+
+    def run_validated(self, *args):
+        return subprocess.run([sys.executable, SCRIPT] + list(args) + [self.path, SOURCE],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def good_output(self):
+        rows = [row for i, row in enumerate(self.rows, 2) if (i not in self.checks)]
+        out = io.StringIO()
+        mochiview2gff.convert(io.StringIO(''.join(['\t'.join(row) + '\n' for row in [self.header] + rows])), out, SOURCE)
+        return out.getvalue()
+
+    def test_fail(self):
+        result = self.run_validated()
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stderr.decode('utf-8'),
+            "mochiview2gff.py: line 3: {}: Unknown strand: '.'\n".format(self.rows[1][mochiview2gff.FEATURE_NAME]))
+
+    def test_skip_and_collect(self):
+        expected = self.good_output()
+        for mode, status in (('skip', 0), ('collect', 1)):
+            for engine in ('python', 'numpy', 'bytes'):
+                with self.subTest(mode=mode, engine=engine):
+                    report = os.path.join(self.tmpdir.name, 'report.json')
+                    result = self.run_validated('--engine', engine, '--validate', mode, '--validation-report', report)
+                    self.assertEqual(result.returncode, status, result.stderr)
+                    self.assertEqual(result.stdout.decode('utf-8'), expected)
+                    with open(report, 'r') as flo:
+                        report = json.load(flo)
+                    self.assertEqual(report['mode'], mode)
+                    self.assertEqual(report['invalid_rows'], len(self.checks))
+                    checks = {}
+                    for problem in report['problems']:
+                        checks.setdefault(problem['line'], []).append(problem['check'])
+                    self.assertEqual(checks, self.checks)
+                    self.assertIn('{} invalid rows'.format(len(self.checks)), result.stderr.decode('utf-8'))
+
+class cache_test(unittest.TestCase):
+    '''
+    convert_cached() takes unchanged rows from the cache and converts new
+    or edited ones
+    '''
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'cache.sqlite')
+        self.text = read_data('golden.txt')
+        self.expected = read_data('golden.gff')
+
+    def convert(self, text):
+        '''
+        Convert 'text' through the cache and return the GFF and the cache
+        '''
+        cache = mochiview2gff.conversion_cache(self.path)
+        out = io.StringIO()
+        try:
+            mochiview2gff.convert_cached(io.StringIO(text), out, SOURCE, cache)
+        finally:
+            cache.close()
+        return out.getvalue(), cache
+
+    def test_hits_and_misses(self):
+        rows = len(self.text.splitlines()) - 1
+        output, cache = self.convert(self.text)
+        self.assertEqual(output, self.expected)
+        self.assertEqual((cache.hits, cache.misses), (0, rows))
+        output, cache = self.convert(self.text)
+        self.assertEqual(output, self.expected)
+        self.assertEqual((cache.hits, cache.misses), (rows, 0))
+
+    def test_edited_row(self):
+        self.convert(self.text)
+        lines = self.text.splitlines(True)
+        lines[1] = lines[1].replace('\tG000000\t', '\tEDITED\t')
+        output, cache = self.convert(''.join(lines))
+        self.assertEqual(cache.misses, 1)
+        out = io.StringIO()
+        mochiview2gff.convert(io.StringIO(''.join(lines)), out, SOURCE)
+        self.assertEqual(output, out.getvalue())
+        self.assertIn('ID=EDITED', output)
+
+    def test_trailing_whitespace(self):
+        # Rows that differ only in trailing whitespace convert the same, in
+        # any layout, so they may share a key
+        lines = self.text.splitlines()
+        header = lines[0] + '\tGROUP\n'
+        padded = header + ''.join([line + '\t  \n' for line in lines[1:]])
+        plain = header + ''.join([line + '\n' for line in lines[1:]])
+        self.assertEqual(self.convert(padded)[0], self.expected)
+        output, cache = self.convert(plain)
+        self.assertEqual(output, self.expected)
+        self.assertEqual(cache.misses, 0)
+
+    def test_too_large_row(self):
+        cache = mochiview2gff.conversion_cache(self.path, max_bytes=1000)
+        try:
+            cache.store([(b'small1', 'a' * 300), (b'small2', 'b' * 300)])
+            cache.store([(b'large', 'c' * 1001), (b'small3', 'd' * 300)])
+            self.assertEqual(cache.lookup([b'small1', b'small2', b'small3', b'large']),
+                {b'small1': 'a' * 300, b'small2': 'b' * 300, b'small3': 'd' * 300})
+            self.assertEqual(cache.evicted, 0)
+            self.assertEqual(cache.size, 900)
+        finally:
+            cache.close()
+
+    def test_version_change(self):
+        self.convert(self.text)
+        with unittest.mock.patch.object(mochiview2gff, '_converter_version', return_value='changed'):
+            output, cache = self.convert(self.text)
+        self.assertEqual(output, self.expected)
+        self.assertEqual(cache.hits, 0)
+
+class sorted_writer_test(unittest.TestCase):
+    '''
+    sorted_writer sorts gene blocks, or lines with 'by_line', by seqid and
+    start, keeping input order for ties, and stays under its memory limit
+    '''
+    LIMIT = 1024*1024
+
+    def setUp(self):
+        # Many copies of the golden output, so the writer spills several runs
+        self.lines = read_data('golden.gff').splitlines() * 60
+
+    def expected(self, by_line):
+        blocks = []
+        for line in self.lines:
+            if (by_line or (line.split('\t')[2] == 'gene')):
+                blocks.append([])
+            blocks[-1].append(line)
+        blocks.sort(key=lambda block: (block[0].split('\t')[0], int(block[0].split('\t')[3])))
+        return ''.join([line + '\n' for block in blocks for line in block])
+
+    def test_sorted(self):
+        text = ''.join([line + '\n' for line in self.lines])
+        for by_line in (False, True):
+            with self.subTest(by_line=by_line):
+                out = digest_writer()
+                tracemalloc.start()
+                try:
+                    with mochiview2gff.sorted_writer(out, self.LIMIT, fanin=2, by_line=by_line) as writer:
+                        writer.write(text)
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+                self.assertEqual(out.digest.hexdigest(), hashlib.sha1(self.expected(by_line).encode('utf-8')).hexdigest())
+                self.assertLess(peak, self.LIMIT)
+
+class input_test(unittest.TestCase):
+    '''
+    open_input() reads compressed files, stdin, pipes and FIFOs
+    '''
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.text = read_data('golden.txt')
+        self.expected = read_data('golden.gff')
+
+    def compressed(self, name, module):
+        '''
+        Write golden.txt compressed with 'module' to 'name', and return its path
+        '''
+        path = os.path.join(self.tmpdir, name)
+        with module.open(path, 'wb') as flo:
+            flo.write(self.text.encode('utf-8'))
+        return path
+
+    def test_compression(self):
+        for name, module, compression in (('in.gz', gzip, 'gzip'), ('in.bz2', bz2, 'bz2'), ('in.xz', lzma, 'xz')):
+            path = self.compressed(name, module)
+            with self.subTest(compression=compression):
+                with open(path, 'rb') as flo:
+                    self.assertEqual(mochiview2gff._detect_compression(flo.read(6)), compression)
+                for threaded in (False, True):
+                    with mochiview2gff.open_input(path, threaded=threaded) as flo:
+                        self.assertEqual(flo.read(), self.text)
+                self.assertEqual(run_script(path, SOURCE), self.expected)
+        self.assertEqual(mochiview2gff._detect_compression(self.text[:6].encode('utf-8')), None)
+
+    def test_stdin(self):
+        gz = self.compressed('in.gz', gzip)
+        for path in (data_path('golden.txt'), gz):
+            for args in ([], ['-j', '2']):
+                with self.subTest(path=path, args=args), open(path, 'rb') as flo:
+                    result = subprocess.run([sys.executable, SCRIPT] + args + ['-', SOURCE], stdin=flo,
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+                    self.assertEqual(result.stdout.decode('utf-8'), self.expected)
+
+    @unittest.skipIf(not hasattr(os, 'mkfifo'), "FIFOs are not supported")
+    def test_fifo(self):
+        gz = self.compressed('in.gz', gzip)
+        for path in (data_path('golden.txt'), gz):
+            for args in ([], ['-j', '2'], ['--engine', 'bytes']):
+                with self.subTest(path=path, args=args):
+                    fifo = os.path.join(self.tmpdir, 'fifo')
+                    os.mkfifo(fifo)
+                    try:
+                        process = subprocess.Popen([sys.executable, SCRIPT] + args + [fifo, SOURCE],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                        with open(path, 'rb') as infile, open(fifo, 'wb') as outfile:
+                            outfile.write(infile.read())
+                        stdout, stderr = process.communicate()
+                    finally:
+                        os.remove(fifo)
+                    self.assertEqual(process.returncode, 0, stderr)
+                    self.assertEqual(stdout.decode('utf-8'), self.expected)
+
+    @unittest.skipIf(not os.path.isdir('/dev/fd'), "/dev/fd is not available")
+    def test_pipe(self):
+        # As with process substitution, <(gzip -c golden.txt)
+        data = gzip.compress(self.text.encode('utf-8'))
+        read_fd, write_fd = os.pipe()
+        self.assertLess(len(data), 65536) # Fits in the pipe buffer
+        with open(write_fd, 'wb') as flo:
+            flo.write(data)
+        try:
+            with mochiview2gff.open_input('/dev/fd/{}'.format(read_fd)) as flo:
+                self.assertEqual(flo.read(), self.text)
+        finally:
+            os.close(read_fd)
+
+    def test_threaded_reader_order(self):
+        data = bytes(random.Random(1).getrandbits(8) for i in range(100000))
+        reader = io.BufferedReader(mochiview2gff._threaded_reader(io.BytesIO(data), block_size=777, depth=2))
+        chunks = []
+        while True:
+            chunk = reader.read(1000)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        reader.close()
+        self.assertEqual(b''.join(chunks), data)
+
+    def test_threaded_reader_error(self):
+        class failing_stream(io.BytesIO):
+            def read(self, size=-1):
+                if (self.tell() >= 3000):
+                    raise OSError("read failed")
+                return io.BytesIO.read(self, size)
+        reader = mochiview2gff._threaded_reader(failing_stream(b'x' * 10000), block_size=1000)
+        data = b''
+        with self.assertRaisesRegex(OSError, "read failed"):
+            while True:
+                chunk = reader.read(500)
+                if not chunk:
+                    break
+                data += chunk
+        self.assertEqual(data, b'x' * 3000)
+        reader.close()
+
+class fasta_test(unittest.TestCase):
+    '''
+    fasta_index reads and writes .fai indexes and copies sequences, and
+    --fasta checks rows against the sequence lengths
+    '''
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+
+    def write_fasta(self, records, width=60, newline='\n'):
+        '''
+        Write 'records', (name, sequence) pairs, as a FASTA file with lines
+        of 'width' bases and return its path
+        '''
+        path = os.path.join(self.tmpdir, 'genome.fa')
+        with open(path, 'wb') as flo:
+            for name, sequence in records:
+                lines = ['>' + name + ' description'] + [sequence[i:i+width] for i in range(0, len(sequence), width)]
+                flo.write(''.join([line + newline for line in lines]).encode('ascii'))
+        return path
+
+    def records(self):
+        return [('chrA', 'ACGT' * 50), ('chrB', 'TTGCA' * 13), ('chrC', 'G' * 60)]
+
+    def test_index(self):
+        path = self.write_fasta(self.records())
+        with mochiview2gff.fasta_index(path) as fasta:
+            self.assertEqual(fasta.lengths, {'chrA': 200, 'chrB': 65, 'chrC': 60})
+            self.assertEqual(fasta.entries['chrA'], (200, 18, 60, 61))
+            self.assertEqual(fasta.entries['chrB'], (65, 18 + 204 + 18, 60, 61))
+        with open(path + '.fai', 'r') as flo:
+            self.assertEqual(flo.readline(), 'chrA\t200\t18\t60\t61\n')
+
+    def test_write_sequence(self):
+        records = self.records()
+        for newline in ('\n', '\r\n'):
+            path = self.write_fasta(records, 7, newline)
+            # The index of the previous file may not look older than this one
+            if os.path.exists(path + '.fai'):
+                os.remove(path + '.fai')
+            with mochiview2gff.fasta_index(path) as fasta:
+                for name, sequence in records:
+                    for chunk_size in (1, 20, 1024*1024):
+                        with self.subTest(newline=newline, name=name, chunk_size=chunk_size):
+                            out = io.StringIO()
+                            fasta.write_sequence(name, out, chunk_size)
+                            expected = '>' + name + '\n' + ''.join([sequence[i:i+7] + '\n' for i in range(0, len(sequence), 7)])
+                            self.assertEqual(out.getvalue(), expected)
+
+    def test_different_line_lengths(self):
+        path = os.path.join(self.tmpdir, 'ragged.fa')
+        with open(path, 'w') as flo:
+            flo.write('>chrA\nACGT\nACG\nACGT\n>chrB\nAC\n')
+        with self.assertRaisesRegex(ValueError, 'the lines of chrA have different lengths'):
+            mochiview2gff.fasta_index(path)
+
+    @unittest.skipIf(not os.path.isdir('/proc/self/fd'), "/proc/self/fd is not available")
+    def test_closed_on_error(self):
+        def open_files(path):
+            return [fd for fd in os.listdir('/proc/self/fd') if (os.path.realpath('/proc/self/fd/' + fd) == os.path.realpath(path))]
+        ragged = os.path.join(self.tmpdir, 'ragged.fa')
+        with open(ragged, 'w') as flo:
+            flo.write('>chrA\nACGT\nACG\nACGT\n')
+        malformed = self.write_fasta(self.records())
+        with open(malformed + '.fai', 'w') as flo:
+            flo.write('chrA\t200\n')
+        for path in (ragged, malformed):
+            with self.subTest(path=path):
+                with self.assertRaises(ValueError):
+                    mochiview2gff.fasta_index(path)
+                self.assertEqual(open_files(path), [])
+
+    def test_stale_index(self):
+        path = self.write_fasta(self.records())
+        with open(path + '.fai', 'w') as flo:
+            flo.write('chrA\t100\t18\t60\t61\n')
+        # An index newer than the FASTA is reused as it is
+        os.utime(path, (1000000000, 1000000000))
+        with mochiview2gff.fasta_index(path) as fasta:
+            self.assertEqual(fasta.lengths, {'chrA': 100})
+        # An older one is rebuilt and saved
+        os.utime(path + '.fai', (999999999, 999999999))
+        with mochiview2gff.fasta_index(path) as fasta:
+            self.assertEqual(fasta.lengths, {'chrA': 200, 'chrB': 65, 'chrC': 60})
+        with open(path + '.fai', 'r') as flo:
+            self.assertEqual(len(flo.readlines()), 3)
+
+    def test_sequence_checks(self):
+        # chr4 ends before its last gene, and chr5 is missing
+        lengths = {'chr1': 400000, 'chr2': 1001946, 'chr3': 1000000, 'chr4': 350000}
+        path = self.write_fasta([(name, 'ACGT' * (length // 4) + 'ACGT'[:length % 4]) for name, length in lengths.items()])
+        rows = [line.split('\t') for line in read_data('golden.txt').splitlines()[1:]]
+        expected = {}
+        for line_number, row in enumerate(rows, 2):
+            seqid = row[mochiview2gff.SEQ_NAME]
+            if (seqid not in lengths):
+                expected[line_number] = 'sequence'
+            elif (int(row[mochiview2gff.END]) > lengths[seqid]):
+                expected[line_number] = 'sequence_end'
+        self.assertIn('sequence_end', expected.values())
+        
+        report = os.path.join(self.tmpdir, 'report.json')
+        result = subprocess.run([sys.executable, SCRIPT, '--fasta', path, '--validate', 'skip', '--validation-report', report,
+            data_path('golden.txt'), SOURCE], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        with open(report, 'r') as flo:
+            problems = json.load(flo)['problems']
+        self.assertEqual({problem['line']: problem['check'] for problem in problems}, expected)
+        
+        output = result.stdout.decode('utf-8').splitlines()
+        seqids = [seqid for seqid in dict.fromkeys(row[mochiview2gff.SEQ_NAME] for row in rows) if (seqid in lengths)]
+        self.assertEqual(output[:len(seqids) + 1], ['##gff-version 3'] +
+            ['##sequence-region {} 1 {}'.format(seqid, lengths[seqid]) for seqid in seqids])
+        self.assertEqual(len([line for line in output if (line.split('\t')[2:3] == ['gene'])]), len(rows) - len(expected))
+
+    def test_piped_input(self):
+        path = self.write_fasta(self.records())
+        with open(data_path('golden.txt'), 'rb') as flo:
+            result = subprocess.run([sys.executable, SCRIPT, '--fasta', path, '-', SOURCE], stdin=flo,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn('--fasta requires an input file, not stdin or a pipe', result.stderr.decode('utf-8'))
+
+    def test_embed_fasta(self):
+        records = self.records()
+        path = self.write_fasta(records)
+        table = write_table(self.tmpdir, ['SEQ_NAME', 'START', 'END', 'FEATURE_NAME', 'EXON_STARTS', 'EXON_ENDS'],
+            [['chrB', '5', '40', 'G1', '5', '40']])
+        output = run_script('--fasta', path, '--embed-fasta', table, SOURCE)
+        self.assertEqual(output.split('##FASTA\n')[1], '>chrB\n' + records[1][1][:60] + '\n' + records[1][1][60:] + '\n')
+
+class shard_test(unittest.TestCase):
+    '''
+    shard_writer splits GFF into one file per seqid, with a manifest of
+    the feature count and range of each, whatever the number of open
+    files and threads
+    '''
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.lines = read_data('golden.gff').splitlines(True)
+        self.seqids = list(dict.fromkeys(line.split('\t')[0] for line in self.lines))
+
+    def assert_shards(self, directory, pragmas=()):
+        '''
+        Check the shards and manifest in 'directory' against the golden
+        output, with the 'pragmas' lines at the top of every shard
+        '''
+        with open(os.path.join(directory, 'manifest.tsv'), 'r') as flo:
+            manifest = [line.rstrip('\n').split('\t') for line in flo]
+        self.assertEqual(manifest[0], ['#seqid', 'file', 'features', 'start', 'end'])
+        self.assertEqual([fields[0] for fields in manifest[1:]], self.seqids)
+        self.assertEqual(sorted(os.listdir(directory)), sorted(['manifest.tsv'] + [seqid + '.gff' for seqid in self.seqids]))
+        for seqid, name, features, start, end in manifest[1:]:
+            with self.subTest(seqid=seqid):
+                lines = [line for line in self.lines if (line.split('\t')[0] == seqid)]
+                genes = [line.split('\t') for line in lines if (line.split('\t')[2] == 'gene')]
+                with open(os.path.join(directory, name), 'r', encoding='utf-8', newline='') as flo:
+                    self.assertEqual(flo.read(), ''.join(list(pragmas) + lines))
+                self.assertEqual(int(features), len(lines))
+                self.assertEqual(int(start), min(int(fields[3]) for fields in genes))
+                self.assertEqual(int(end), max(int(fields[4]) for fields in genes))
+
+    def test_shard_writer(self):
+        text = ''.join(self.lines)
+        pragmas = ['##gff-version 3\n']
+        for max_open, threads in ((128, 1), (2, 1), (1, 3), (2, 2)):
+            with self.subTest(max_open=max_open, threads=threads):
+                directory = os.path.join(self.tmpdir, '{}-{}'.format(max_open, threads))
+                # A small buffer, so every shard is written many times
+                with mochiview2gff.shard_writer(directory, max_open, threads, buffer_size=2000) as writer:
+                    writer.write(''.join(pragmas))
+                    for i in range(0, len(text), 777):
+                        writer.write(text[i:i+777])
+                self.assert_shards(directory, pragmas)
+                if ((threads == 1) and (max_open < len(self.seqids))):
+                    # Shards were closed and reopened to append to them
+                    self.assertGreater(writer._pool.opened, len(self.seqids))
+
+    def test_script(self):
+        for args in (['--shard-files', '2'], ['--threads', '3'], ['--shard-files', '1', '--threads', '2']):
+            with self.subTest(args=args):
+                directory = os.path.join(self.tmpdir, '-'.join(args))
+                self.assertEqual(run_script('--shard-dir', directory, *args, data_path('golden.txt'), SOURCE), '')
+                self.assert_shards(directory)
+
+class index_test(unittest.TestCase):
+    '''
+    --sort --bgzf --index writes lines sorted by start, so region queries
+    through the index find every overlapping feature
+    '''
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'golden.gff.gz')
+        run_script('--sort', '--bgzf', '--index', '-o', self.path, data_path('golden.txt'), SOURCE)
+        with mochiview2gff.open_input(self.path) as flo:
+            self.lines = [line.rstrip('\n') for line in flo]
+        self.regions = [(fields[0], int(fields[3]) + offset, int(fields[3]) + offset + 2000)
+            for fields in [line.split('\t') for line in self.lines[::7]] for offset in (-1500, 0, 700)]
+
+    def overlapping(self, seqid, start, end):
+        return [line for line in self.lines if (line.split('\t')[0] == seqid) and
+            (int(line.split('\t')[3]) <= end) and (int(line.split('\t')[4]) >= start)]
+
+    def test_sorted_by_start(self):
+        keys = [(fields[0], int(fields[3])) for fields in [line.split('\t') for line in self.lines]]
+        seqids = [seqid for i, (seqid, start) in enumerate(keys) if ((i == 0) or (keys[i-1][0] != seqid))]
+        self.assertEqual(len(seqids), len(set(seqids)))
+        for previous, key in zip(keys, keys[1:]):
+            if (previous[0] == key[0]):
+                self.assertLessEqual(previous[1], key[1])
+        self.assertEqual(sorted(self.lines), sorted(read_data('golden.gff').splitlines()))
+
+    def test_tabix_reader(self):
+        reader = mochiview2gff.tabix_reader(self.path)
+        for seqid, start, end in self.regions:
+            self.assertEqual(list(reader.query(seqid, start, end)), self.overlapping(seqid, start, end))
+
+    @unittest.skipIf(pysam == None, "pysam is not installed")
+    def test_pysam(self):
+        with pysam.TabixFile(self.path, encoding='utf-8') as tabix:
+            for seqid, start, end in self.regions:
+                self.assertEqual(list(tabix.fetch(seqid, start-1, end)), self.overlapping(seqid, start, end))
+
+class batch_test(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.expected = read_data('golden.gff')
+
+    def copy(self, name):
+        path = os.path.join(self.tmpdir.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(data_path('golden.txt'), 'rb') as infile, open(path, 'wb') as outfile:
+            outfile.write(infile.read())
+        return path
+
+    def test_outputs(self):
+        first, second = self.copy('a/x.txt'), self.copy('b/y.tsv')
+        output_dir = os.path.join(self.tmpdir.name, 'out')
+        os.mkdir(output_dir)
+        run_script('-j', '2', '--batch', first, SOURCE, '--batch', second, SOURCE, '--output-dir', output_dir)
+        self.assertEqual(sorted(os.listdir(output_dir)), ['x.gff', 'y.gff'])
+        for name in ('x.gff', 'y.gff'):
+            with open(os.path.join(output_dir, name), 'r', encoding='utf-8', newline='') as flo:
+                self.assertEqual(flo.read(), self.expected)
+
+    def test_duplicate_outputs(self):
+        output_dir = os.path.join(self.tmpdir.name, 'out')
+        os.mkdir(output_dir)
+        for first, second, args in (('a/x.txt', 'b/x.txt', ['--output-dir', output_dir]), ('t.txt', 't.txt.gz', [])):
+            with self.subTest(first=first, second=second):
+                first, second = self.copy(first), self.copy(second)
+                result = subprocess.run([sys.executable, SCRIPT, '--batch', first, 'A', '--batch', second, 'B'] + args,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                self.assertEqual(result.returncode, 2)
+                self.assertIn('would both be converted to', result.stderr.decode('utf-8'))
+        self.assertEqual(os.listdir(output_dir), [])
+
+class server_test(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'socket')
+        self.expected = read_data('golden.gff')
+
+    def serve(self, *args):
+        '''
+        Start a conversion server with 'args' and return its process
+        '''
+        server = subprocess.Popen([sys.executable, SCRIPT, '--serve', self.path] + list(args), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while not os.path.exists(self.path):
+            if (time.monotonic() > deadline):
+                server.kill()
+                server.wait()
+                self.fail("the server did not start")
+            time.sleep(0.05)
+        return server
+
+    def convert(self, engine):
+        out = io.StringIO()
+        with open(data_path('golden.txt'), 'r', encoding='utf-8', newline='') as infile:
+            mochiview2gff.request(self.path, infile, out, SOURCE, engine)
+        return out.getvalue()
+
+    def test_concurrent_requests(self):
+        for jobs in ('1', '2'):
+            with self.subTest(jobs=jobs):
+                server = self.serve('-j', jobs)
+                try:
+                    engines = ['python', 'numpy', 'bytes'] * 2
+                    with concurrent.futures.ThreadPoolExecutor(len(engines)) as pool:
+                        for output in pool.map(self.convert, engines):
+                            self.assertEqual(output, self.expected)
+                finally:
+                    server.terminate()
+                    server.wait()
+
+class group_isoforms_test(unittest.TestCase):
+    '''
+    --group-isoforms merges the rows of a gene, and reports the rows that
+    cannot be merged as bad rows
+    '''
+    MODES = ('adjacent', 'any')
+
+    def setUp(self):
+        lines = read_data('golden.txt').splitlines()
+        self.header = lines[0].split('\t') + ['ISOFORM_NAME', 'IS_PRIMARY']
+        self.rows = [line.split('\t') for line in lines[1:]]
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def isoform(self, row, gene, isoform, primary='', **cells):
+        row = list(row)
+        row[mochiview2gff.FEATURE_NAME] = gene
+        for name, value in cells.items():
+            row[getattr(mochiview2gff, name)] = value
+        return row + [isoform, primary]
+
+    def run_grouped(self, mode, rows, *args):
+        path = write_table(self.tmpdir.name, self.header, rows)
+        return subprocess.run([sys.executable, SCRIPT, '--group-isoforms', mode] + list(args) + [path, SOURCE],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def test_blank_is_primary(self):
+        rows = [self.isoform(self.rows[0], 'GENE1', 'a'), self.isoform(self.rows[0], 'GENE1', 'b', 'Y')]
+        for mode in self.MODES:
+            with self.subTest(mode=mode):
+                result = self.run_grouped(mode, rows)
+                self.assertEqual(result.returncode, 0, result.stderr)
+                mrnas = [line.split('\t')[8] for line in result.stdout.decode('utf-8').splitlines() if ('\tmRNA\t' in line)]
+                self.assertEqual(len(mrnas), 2)
+                self.assertIn('ID=GENE1-T1;', mrnas[0])
+                self.assertIn('Name=b', mrnas[0])
+
+    def test_different_sequences(self):
+        rows = [self.isoform(self.rows[0], 'GENE1', 'a', 'Y'), self.isoform(self.rows[0], 'GENE1', 'b', SEQ_NAME='chr9')]
+        for mode in self.MODES:
+            with self.subTest(mode=mode):
+                result = self.run_grouped(mode, rows)
+                self.assertEqual(result.returncode, 1)
+                self.assertEqual(result.stderr.decode('utf-8'),
+                    'mochiview2gff.py: line 3: GENE1: Isoforms of GENE1 are on different sequences or strands\n')
+                result = self.run_grouped(mode, rows, '--validate', 'skip', '--validation-report', '-')
+                self.assertEqual(result.returncode, 0, result.stderr)
+                self.assertEqual(result.stdout.decode('utf-8').count('\tmRNA\t'), 1)
+                self.assertIn('"check": "isoforms"', result.stderr.decode('utf-8'))
+
+    def test_spilled_runs(self):
+        # Every gene has two isoforms, and the rows are shuffled
+        rows = [self.isoform(row, row[mochiview2gff.FEATURE_NAME], name, primary)
+            for row in self.rows for name, primary in (('a', 'Y'), ('b', ''))]
+        random.Random(2).shuffle(rows)
+        header = '\t'.join(self.header) + '\n'
+        lines = ['\t'.join(row) + '\n' for row in rows]
+        parse_row = mochiview2gff.row_parser(header)
+        expected = list(mochiview2gff.isoform_grouper('any').features(lines, SOURCE, parse_row))
+        self.assertEqual(len([f for f in expected if (f.type == 'gene')]), len(self.rows))
+        for memory_limit, fanin in ((1, 64), (3000, 2)):
+            with self.subTest(memory_limit=memory_limit, fanin=fanin):
+                grouper = mochiview2gff.isoform_grouper('any', memory_limit, self.tmpdir.name, fanin)
+                with unittest.mock.patch.object(grouper, '_write_run', wraps=grouper._write_run) as write_run:
+                    self.assertEqual(list(grouper.features(lines, SOURCE, parse_row)), expected)
+                self.assertGreater(write_run.call_count, fanin)
+
+    def test_not_adjacent(self):
+        rows = [self.isoform(self.rows[0], 'GENE1', 'a', 'Y'), self.rows[1] + ['', ''], self.isoform(self.rows[0], 'GENE1', 'b')]
+        result = self.run_grouped('adjacent', rows)
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stderr.decode('utf-8'),
+            "mochiview2gff.py: line 4: GENE1: Rows of GENE1 are not adjacent; use '--group-isoforms any'\n")
+        result = self.run_grouped('adjacent', rows, '--validate', 'collect', '--validation-report', '-')
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout.decode('utf-8').count('\tgene\t'), 2)
+        self.assertIn('"check": "adjacent"', result.stderr.decode('utf-8'))
+
+if (__name__ == "__main__"):
+    unittest.main()